@@ -1,18 +1,45 @@
 from flask import Flask
 from flask_cors import CORS
 from config import Config
-from .database import db, login_manager
+from .database import db, login_manager, create_missing_indexes, add_missing_columns
 from .auth import jwt
+from .jwt_keys import key_ring
+from .auth_state import auth_state
+from .jobs import job_queue
+from .logging_config import configure_logging
+from .metrics import metrics
+from .passwords import password_hasher
+from .search import create_search_index
+from .similarity import near_duplicates
+from .ratelimit import rate_limiter
+from .retention import retention_manager
+from .upstream_http import init_deadlines
+from .writebehind import write_behind
 
 def create_app():
     app = Flask(__name__)
     app.config.from_object(Config)
     
+    # Khởi động process pool hash password trước khi tạo bất kỳ thread nào
+    # (kể cả QueueListener của logging): fork khi đã có thread dễ bị deadlock
+    password_hasher.init_app(app)
+    
+    # Logging tập trung, cấu hình trước các extension
+    configure_logging(app)
+    
     # Initialize extensions
     CORS(app)
     db.init_app(app)
+    metrics.init_app(app)
     jwt.init_app(app)
+    key_ring.init_app(app)
+    auth_state.init_app(app)
     login_manager.init_app(app)
+    job_queue.init_app(app)
+    rate_limiter.init_app(app)
+    
+    # Deadline của mỗi request cho các lời gọi OpenAI
+    init_deadlines(app)
     
     # Register blueprints
     from .auth_routes import auth
@@ -21,8 +48,30 @@ def create_app():
     app.register_blueprint(auth, url_prefix='/api/auth')
     app.register_blueprint(api, url_prefix='/api')
     
+    # CLI commands (flask storage-backfill, ...)
+    from .commands import register_commands
+    register_commands(app)
+    
     # Create database tables
     with app.app_context():
         db.create_all()
+        add_missing_columns()
+        create_missing_indexes()
+        create_search_index()
+        # Job của lần chạy trước bị dừng giữa chừng không bao giờ được chạy tiếp
+        job_queue.fail_stale()
+        
+    # Worker retention chỉ chạy sau khi các bảng đã được tạo
+    retention_manager.init_app(app)
+    write_behind.init_app(app)
+    near_duplicates.init_app(app)
     
-    return app
\ No newline at end of file
+    return app
+
+def create_async_app():
+    """
+    App ASGI (chạy bằng uvicorn / hypercorn): các route code-assist xử lý
+    async với ChatCompletion.acreate, các route còn lại chạy qua Flask app
+    """
+    from .asgi import AsyncApp
+    return AsyncApp(create_app())
\ No newline at end of file
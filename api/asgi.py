@@ -0,0 +1,408 @@
+import asyncio
+import io
+import json
+import logging
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import openai
+from flask import g, request
+
+from .auth import jwt_required
+from .metrics import metrics
+from .ratelimit import rate_limit
+from .similarity import near_duplicates
+from .routes import code_assistant, code_assist_params, save_code_session, use_near_duplicate, _sse
+from .upstream_http import request_budget, set_deadline
+from .usage import enforce_quota
+
+logger = logging.getLogger(__name__)
+
+
+@jwt_required
+@rate_limit('code_assist', token_budget=True)
+@enforce_quota
+def _code_assist_gate():
+    """
+    Chạy cùng chuỗi decorator với các route code-assist (JWT, rate limit,
+    quota). Trả về None nếu request được phép, ngược lại là response lỗi
+    """
+    return None
+
+
+def _build_environ(scope: Dict[str, Any], body: bytes) -> Dict[str, Any]:
+    """
+    Chuyển ASGI scope + body thành WSGI environ
+    """
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': str(server[0]),
+        'SERVER_PORT': str(server[1]),
+        'REMOTE_ADDR': str(client[0]),
+        'REMOTE_PORT': str(client[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False
+    }
+    for raw_name, raw_value in scope.get('headers', []):
+        name = raw_name.decode('latin-1').lower()
+        value = raw_value.decode('latin-1')
+        if name == 'content-length':
+            continue
+        if name == 'content-type':
+            environ['CONTENT_TYPE'] = value
+            continue
+        key = 'HTTP_' + name.upper().replace('-', '_')
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def _encode_headers(headers) -> List[Tuple[bytes, bytes]]:
+    return [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+
+
+class AsyncApp:
+    """
+    ASGI app bọc Flask app: các route code-assist (chủ yếu là chờ OpenAI)
+    được xử lý bằng handler async với ChatCompletion.acreate, nên một
+    process giữ được hàng nghìn request đồng thời mà không cần hàng nghìn
+    thread. DB (xác thực, lưu session) được offload sang thread pool nhỏ.
+    Các route còn lại chạy qua Flask (WSGI) trong cùng thread pool đó
+    """
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.threads = flask_app.config.get('ASYNC_THREADS', 32)
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.threads,
+            thread_name_prefix='asgi-worker'
+        )
+        self.max_connections = flask_app.config.get('ASYNC_OPENAI_MAX_CONNECTIONS', 1000)
+        self.deadline = flask_app.config.get('REQUEST_DEADLINE', 0)
+        self.deadline_header = flask_app.config.get('REQUEST_DEADLINE_HEADER', 'X-Request-Timeout').lower().encode('latin-1')
+        self.http = None
+        self.in_flight = 0
+        self.routes = {
+            ('POST', '/api/code-assist'): self._code_assist,
+            ('POST', '/api/code-assist/stream'): self._code_assist_stream
+        }
+        metrics.register_stats('asgi', self.stats)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'in_flight': self.in_flight,
+            'threads': self.threads,
+            'max_connections': self.max_connections
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        body = await self._read_body(receive)
+        handler = self.routes.get((scope['method'], scope['path']))
+        self.in_flight += 1
+        try:
+            if handler is not None:
+                await self._ensure_http()
+                # Mỗi request là một task riêng -> contextvar không lẫn giữa các request
+                header = dict(scope.get('headers') or []).get(self.deadline_header)
+                set_deadline(request_budget(header.decode('latin-1') if header else None, self.deadline))
+                await handler(scope, body, receive, send)
+            else:
+                await self._call_wsgi(scope, body, send)
+        finally:
+            self.in_flight -= 1
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await self._ensure_http()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.http is not None:
+                    await self.http.close()
+                    self.http = None
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _ensure_http(self):
+        """
+        Một aiohttp session dùng chung (connection pool) cho mọi lời gọi acreate
+        """
+        if self.http is None:
+            import aiohttp
+            self.http = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections)
+            )
+        # openai đọc session từ contextvar -> gán trong context của từng request
+        openai.aiosession.set(self.http)
+
+    async def _read_body(self, receive) -> bytes:
+        chunks = []
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                break
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body'):
+                break
+        return b''.join(chunks)
+
+    async def _offload(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    def _authorize(self, environ) -> Tuple[Optional[str], List[Tuple[str, str]], Any]:
+        """
+        Chạy before_request hooks + chuỗi decorator xác thực trong request context.
+        Trả về (user_id, headers, None) với headers là các header mà
+        after_request hooks thêm vào (CORS, X-Request-ID), hoặc
+        (None, [], response lỗi)
+        """
+        with self.flask_app.request_context(environ):
+            rv = self.flask_app.preprocess_request()
+            if rv is None:
+                rv = _code_assist_gate()
+            if rv is None:
+                # Latency được đo ở handler async, không phải ở response thử này
+                g.pop('_metrics_start', None)
+                probe = self.flask_app.process_response(self.flask_app.response_class())
+                headers = [
+                    (name, value) for name, value in probe.headers.items()
+                    if name.lower() not in ('content-type', 'content-length')
+                ]
+                return request.user_id, headers, None
+            response = self.flask_app.process_response(self.flask_app.make_response(rv))
+            return None, [], (response.status_code, list(response.headers.items()), response.get_data())
+
+    def _save(self, environ, user_id, query, code_context, language, result):
+        # Request context để SQL metrics được gắn đúng route
+        with self.flask_app.request_context(environ):
+            return save_code_session(user_id, query, code_context, language, result)
+
+    def _near_duplicate(self, environ, user_id, query, code_context, language):
+        with self.flask_app.request_context(environ):
+            return near_duplicates.answer(user_id, query, code_context, language)
+
+    def _record(self, method: str, path: str, status: int, started: float) -> None:
+        metrics.http_latency.observe(time.perf_counter() - started, method, path)
+        metrics.http_requests.inc(method, path, str(status))
+
+    async def _send_response(self, send, status: int, headers, body: bytes) -> None:
+        await send({'type': 'http.response.start', 'status': status, 'headers': _encode_headers(headers)})
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def _send_json(self, send, status: int, payload: Dict[str, Any], headers) -> None:
+        headers = [('Content-Type', 'application/json')] + headers
+        await self._send_response(send, status, headers, json.dumps(payload).encode('utf-8'))
+
+    async def _prepare(self, scope, body, send):
+        """
+        Xác thực + đọc body chung cho hai route code-assist.
+        Trả về (environ, user_id, headers, params); nếu đã gửi response lỗi
+        thì trả về status (lỗi validate) hoặc None (bị gate từ chối, metrics đã
+        được after_request hooks ghi)
+        """
+        environ = _build_environ(scope, body)
+        user_id, headers, error = await self._offload(self._authorize, environ)
+        if error is not None:
+            await self._send_response(send, *error)
+            return None
+
+        try:
+            data = json.loads(body) if body else None
+        except ValueError:
+            data = None
+        if not data:
+            await self._send_json(send, 400, {'error': 'No data provided'}, headers)
+            return 400
+
+        params = code_assist_params(data, environ.get('HTTP_CACHE_CONTROL', ''))
+        if not params[0]:
+            await self._send_json(send, 400, {'error': 'Query is required'}, headers)
+            return 400
+        environ['code_assist.near_duplicate'] = use_near_duplicate(data, params[3])
+        return environ, user_id, headers, params
+
+    async def _code_assist(self, scope, body, receive, send):
+        started = time.perf_counter()
+        prepared = await self._prepare(scope, body, send)
+        if not isinstance(prepared, tuple):
+            if prepared is not None:
+                self._record(scope['method'], scope['path'], prepared, started)
+            return
+        environ, user_id, headers, (query, code_context, language, use_cache) = prepared
+        
+        status = 500
+        try:
+            logger.debug("Processing async code assist request: %s...", query[:100])
+
+            response = None
+            if environ['code_assist.near_duplicate']:
+                response = await self._offload(
+                    self._near_duplicate, environ, user_id, query, code_context, language
+                )
+            if response is None:
+                response = await code_assistant.process_request_async(
+                    query=query,
+                    code_context=code_context,
+                    language=language,
+                    use_cache=use_cache
+                )
+            if not response.get('success'):
+                await self._send_json(send, 500, {
+                    'error': 'Code assistant processing failed',
+                    'details': response.get('error')
+                }, headers)
+                return
+
+            session_id = await self._offload(
+                self._save, environ, user_id, query, code_context, language, response
+            )
+            status = 200
+            await self._send_json(send, 200, {
+                'success': True,
+                'response': response['response'],
+                'tokens_used': response.get('tokens_used', 0),
+                'cached': response.get('cached', False),
+                'coalesced': response.get('coalesced', False),
+                'context_tokens': response.get('context_tokens'),
+                'near_duplicate': response.get('near_duplicate'),
+                'session_id': session_id
+            }, headers)
+        finally:
+            self._record(scope['method'], scope['path'], status, started)
+
+    async def _code_assist_stream(self, scope, body, receive, send):
+        started = time.perf_counter()
+        prepared = await self._prepare(scope, body, send)
+        if not isinstance(prepared, tuple):
+            if prepared is not None:
+                self._record(scope['method'], scope['path'], prepared, started)
+            return
+        environ, user_id, headers, (query, code_context, language, use_cache) = prepared
+        logger.debug("Streaming async code assist request: %s...", query[:100])
+
+        headers = [
+            ('Content-Type', 'text/event-stream; charset=utf-8'),
+            ('Cache-Control', 'no-cache'),
+            ('X-Accel-Buffering', 'no')
+        ] + headers
+        await send({'type': 'http.response.start', 'status': 200, 'headers': _encode_headers(headers)})
+
+        async def write(chunk: str) -> None:
+            await send({'type': 'http.response.body', 'body': chunk.encode('utf-8'), 'more_body': True})
+
+        async def stream():
+            events = code_assistant.stream_request_async(
+                query=query,
+                code_context=code_context,
+                language=language,
+                use_cache=use_cache
+            )
+            try:
+                async for event in events:
+                    if event['type'] == 'delta':
+                        await write(_sse({'content': event['content']}))
+                        continue
+
+                    if event['type'] == 'error':
+                        await write(_sse({
+                            'error': 'Code assistant processing failed',
+                            'details': event['error']
+                        }, event='error'))
+                        return
+
+                    session_id = await self._offload(
+                        self._save, environ, user_id, query, code_context, language, event
+                    )
+                    await write(_sse({
+                        'success': True,
+                        'tokens_used': event['tokens_used'],
+                        'cached': event['cached'],
+                        'context_tokens': event.get('context_tokens'),
+                        'session_id': session_id
+                    }, event='done'))
+            finally:
+                await events.aclose()
+
+        async def wait_disconnect():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+
+        # Client ngắt kết nối -> hủy stream để đóng luôn request upstream
+        stream_task = asyncio.ensure_future(stream())
+        disconnect_task = asyncio.ensure_future(wait_disconnect())
+        try:
+            await asyncio.wait({stream_task, disconnect_task}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in (stream_task, disconnect_task):
+                if not task.done():
+                    task.cancel()
+            await asyncio.gather(stream_task, disconnect_task, return_exceptions=True)
+            self._record(scope['method'], scope['path'], 200, started)
+
+        if stream_task.done() and not stream_task.cancelled():
+            await send({'type': 'http.response.body', 'body': b''})
+
+    async def _call_wsgi(self, scope, body, send):
+        """
+        Chạy Flask app trong thread pool, body được gửi dần về event loop
+        (response stream như export / SSE vẫn được stream)
+        """
+        loop = asyncio.get_running_loop()
+        environ = _build_environ(scope, body)
+
+        def blocking_send(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        def run():
+            response_start = {}
+
+            def start_response(status, headers, exc_info=None):
+                response_start['status'] = int(status.split(' ', 1)[0])
+                response_start['headers'] = headers
+                return lambda data: None
+
+            def flush_start():
+                # Gửi status + headers đúng một lần, trước chunk body đầu tiên
+                if not response_start.get('sent'):
+                    blocking_send({
+                        'type': 'http.response.start',
+                        'status': response_start['status'],
+                        'headers': _encode_headers(response_start['headers'])
+                    })
+                    response_start['sent'] = True
+
+            result = self.flask_app(environ, start_response)
+            try:
+                for chunk in result:
+                    if not chunk:
+                        continue
+                    flush_start()
+                    blocking_send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                flush_start()
+                blocking_send({'type': 'http.response.body', 'body': b''})
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+
+        await loop.run_in_executor(self.executor, run)
\ No newline at end of file
@@ -1,21 +1,44 @@
 from flask_jwt_extended import JWTManager, create_access_token, get_jwt_identity, verify_jwt_in_request
+from .auth_state import auth_state
+from .jwt_keys import key_ring
 from datetime import timedelta
 from functools import wraps
-from flask import jsonify, request
+from flask import current_app, jsonify, request
 import logging
+import threading
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
 
 jwt = JWTManager()
 
+# Key generate_token đã chọn (kid trong header phải khớp key ký)
+_signing = threading.local()
+
+@jwt.token_in_blocklist_loader
+def check_if_token_revoked(jwt_header, jwt_payload):
+    # Phần lớn token không bị thu hồi -> chỉ kiểm tra Bloom filter, không chạm DB
+    return auth_state.is_revoked(jwt_payload.get('jti'))
+
+@jwt.encode_key_loader
+def encode_key(identity):
+    if not key_ring.enabled:
+        return current_app.config['JWT_SECRET_KEY']
+    key = getattr(_signing, 'key', None) or key_ring.signing_key()
+    return key.private_key
+
+@jwt.decode_key_loader
+def decode_key(jwt_header, jwt_payload):
+    # Chấp nhận mọi key còn trong key ring (key cũ vẫn verify được khi xoay key)
+    if not key_ring.enabled:
+        return current_app.config['JWT_SECRET_KEY']
+    return key_ring.verification_key(jwt_header)
+
 def jwt_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
         try:
             # Get token from header
             auth_header = request.headers.get('Authorization')
-            logger.debug(f"Auth header: {auth_header}")
             
             if not auth_header:
                 return jsonify({'error': 'No Authorization header'}), 401
@@ -29,22 +52,23 @@ def jwt_required(f):
             elif len(parts) > 2:
                 return jsonify({'error': 'Authorization header must be Bearer token'}), 401
                 
-            token = parts[1]
-            logger.debug(f"Extracted token: {token}")
-            
             # Verify token
             verify_jwt_in_request()
             current_user = get_jwt_identity()
-            logger.debug(f"Current user: {current_user}")
+            logger.debug("Current user: %s", current_user)
             
             if not current_user:
                 return jsonify({'error': 'Invalid user in token'}), 401
                 
+            # Trạng thái user được cache có TTL thay vì query mỗi request
+            if not auth_state.is_user_active(int(current_user)):
+                return jsonify({'error': 'User is inactive'}), 401
+                
             request.user_id = current_user
             return f(*args, **kwargs)
             
         except Exception as e:
-            logger.error(f"Token validation error: {str(e)}")
+            logger.error("Token validation error: %s", e)
             return jsonify({
                 'error': 'Invalid token',
                 'details': str(e)
@@ -53,8 +77,19 @@ def jwt_required(f):
     return decorated
 
 def generate_token(user_id: int) -> str:
-    # Convert user_id to string before creating token
-    return create_access_token(
-        identity=str(user_id),
-        expires_delta=timedelta(days=1)
-    )
\ No newline at end of file
+    if not key_ring.enabled:
+        # Convert user_id to string before creating token
+        return create_access_token(
+            identity=str(user_id),
+            expires_delta=timedelta(days=1)
+        )
+        
+    _signing.key = key = key_ring.signing_key()
+    try:
+        return create_access_token(
+            identity=str(user_id),
+            expires_delta=timedelta(days=1),
+            additional_headers={'kid': key.kid}
+        )
+    finally:
+        _signing.key = None
\ No newline at end of file
@@ -1,11 +1,19 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, current_app, request, jsonify, stream_with_context
 from .models import User, db
-from .auth import generate_token
+from .auth import generate_token, jwt_required
+from .auth_state import auth_state
+from .jwt_keys import key_ring
+from .passwords import password_hasher
+from .provisioning import duplicate_user_error, import_users, iter_lines
+from .export import ndjson_lines
+from .ratelimit import rate_limit
+from flask_jwt_extended import get_jwt
 from datetime import datetime
+from sqlalchemy.exc import IntegrityError
+import hmac
 import logging
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
 
 auth = Blueprint('auth', __name__)
 
@@ -13,7 +21,7 @@ auth = Blueprint('auth', __name__)
 def register():
     try:
         data = request.get_json()
-        logger.debug(f"Registration request data: {data}")
+        logger.debug("Registration request for user: %s", data.get('username') if data else None)
         
         # Validate required fields
         required_fields = ['username', 'email', 'password']
@@ -21,54 +29,64 @@ def register():
             if field not in data:
                 return jsonify({'error': f'{field} is required'}), 400
         
-        if User.query.filter_by(username=data['username']).first():
-            return jsonify({'error': 'Username already exists'}), 400
-            
-        if User.query.filter_by(email=data['email']).first():
-            return jsonify({'error': 'Email already exists'}), 400
-
         user = User(
             username=data['username'],
             email=data['email']
         )
         user.set_password(data['password'])
         
+        # Một INSERT, trùng username / email do unique constraint phát hiện
         db.session.add(user)
+        try:
+            db.session.flush()
+        except IntegrityError as e:
+            db.session.rollback()
+            return jsonify({'error': duplicate_user_error(e)}), 409
+        user_id = user.id
         db.session.commit()
 
-        token = generate_token(str(user.id))  # Convert to string
-        logger.debug(f"Generated token for user {user.id}: {token}")
+        token = generate_token(str(user_id))  # Convert to string
+        logger.debug("Generated token for user %s", user_id)
         
         return jsonify({
             'message': 'User registered successfully',
             'token': token,
             'user': {
-                'id': user.id,
-                'username': user.username,
-                'email': user.email
+                'id': user_id,
+                'username': data['username'],
+                'email': data['email']
             }
         }), 201
 
     except Exception as e:
-        logger.error(f"Registration error: {str(e)}")
+        logger.error("Registration error: %s", e)
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
 @auth.route('/login', methods=['POST'])
+@rate_limit('login')
 def login():
     try:
         data = request.get_json()
-        logger.debug(f"Login attempt for user: {data.get('username')}")
+        logger.debug("Login attempt for user: %s", data.get('username'))
         
         user = User.query.filter_by(username=data['username']).first()
         
         if user and user.check_password(data['password']):
+            if not user.is_active:
+                return jsonify({'error': 'Account is deactivated'}), 403
+                
+            # Nâng cấp hash cũ sang thuật toán / cost hiện tại
+            if user.password_needs_rehash():
+                user.set_password(data['password'])
+                logger.debug("Rehashed password for user %s", user.id)
+                
             user.last_login = datetime.utcnow()
             db.session.commit()
             
             # Generate token with string user_id
             token = generate_token(str(user.id))  # Convert to string
-            logger.debug(f"Generated token for user {user.id}: {token}")
+            logger.debug("Generated token for user %s", user.id)
             
             return jsonify({
                 'token': token,
@@ -79,8 +97,113 @@ def login():
                 }
             })
             
+        if not user:
+            # Giữ thời gian phản hồi giống như khi sai password
+            password_hasher.dummy_verify(data['password'])
+            
         return jsonify({'error': 'Invalid credentials'}), 401
 
     except Exception as e:
-        logger.error(f"Login error: {str(e)}")
-        return jsonify({'error': str(e)}), 500
\ No newline at end of file
+        logger.error("Login error: %s", e)
+        return jsonify({'error': str(e)}), 500
+
+@auth.route('/logout', methods=['POST'])
+@jwt_required
+def logout():
+    try:
+        payload = get_jwt()
+        auth_state.revoke_token(
+            payload['jti'],
+            int(request.user_id),
+            datetime.utcfromtimestamp(payload['exp']) if payload.get('exp') else None
+        )
+        logger.debug("User %s logged out", request.user_id)
+        
+        return jsonify({'message': 'Logged out successfully'})
+
+    except Exception as e:
+        logger.error("Logout error: %s", e)
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@auth.route('/deactivate', methods=['POST'])
+@jwt_required
+def deactivate():
+    try:
+        user = db.session.query(User).get(int(request.user_id))
+        if not user:
+            return jsonify({'error': 'User not found'}), 404
+            
+        user.is_active = False
+        db.session.commit()
+        auth_state.invalidate_user(user.id)
+        
+        payload = get_jwt()
+        auth_state.revoke_token(
+            payload['jti'],
+            user.id,
+            datetime.utcfromtimestamp(payload['exp']) if payload.get('exp') else None
+        )
+        logger.debug("User %s deactivated", user.id)
+        
+        return jsonify({'message': 'Account deactivated successfully'})
+
+    except Exception as e:
+        logger.error("Deactivate error: %s", e)
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@auth.route('/.well-known/jwks.json', methods=['GET'])
+def jwks():
+    """
+    Public key của các key ký token (JWKS) để service khác tự verify token.
+    Cache theo JWKS_MAX_AGE, hỗ trợ If-None-Match
+    """
+    try:
+        response = jsonify(key_ring.jwks() if key_ring.enabled else {'keys': []})
+        response.headers['Cache-Control'] = f"public, max-age={current_app.config.get('JWKS_MAX_AGE', 300)}"
+        if key_ring.etag:
+            response.set_etag(key_ring.etag)
+        return response.make_conditional(request)
+
+    except Exception as e:
+        logger.error("JWKS error: %s", e)
+        return jsonify({'error': str(e)}), 500
+
+@auth.route('/users/bulk', methods=['POST'])
+def bulk_provision():
+    """
+    Tạo user hàng loạt từ CSV (header username,email,password) hoặc NDJSON.
+    Xác thực bằng header X-Provisioning-Token (PROVISIONING_TOKEN, rỗng = tắt).
+    Body được đọc dần theo chunk trong lúc stream kết quả, cần Content-Length
+    và không quá PROVISIONING_MAX_CONTENT_LENGTH byte.
+    Response là NDJSON stream: event 'error' cho từng dòng lỗi, 'progress'
+    sau mỗi batch và 'done' ở cuối
+    """
+    expected = current_app.config.get('PROVISIONING_TOKEN')
+    if not expected:
+        return jsonify({'error': 'Bulk provisioning is disabled'}), 404
+    if not hmac.compare_digest(request.headers.get('X-Provisioning-Token', ''), expected):
+        return jsonify({'error': 'Invalid provisioning token'}), 403
+        
+    data_format = request.args.get('format') or (
+        'csv' if 'csv' in (request.content_type or '') else 'ndjson'
+    )
+    if data_format not in ('csv', 'ndjson'):
+        return jsonify({'error': 'format must be csv or ndjson'}), 400
+        
+    max_length = current_app.config.get('PROVISIONING_MAX_CONTENT_LENGTH')
+    if request.content_length is None:
+        return jsonify({'error': 'Content-Length is required'}), 411
+    if max_length and request.content_length > max_length:
+        return jsonify({'error': f'Upload exceeds limit of {max_length} bytes'}), 413
+        
+    logger.info("Bulk provisioning %s bytes of %s", request.content_length, data_format)
+    events = import_users(
+        iter_lines(request.stream), data_format,
+        current_app.config.get('PROVISIONING_BATCH_SIZE', 200)
+    )
+    return Response(
+        stream_with_context(ndjson_lines(events)),
+        mimetype='application/x-ndjson'
+    )
\ No newline at end of file
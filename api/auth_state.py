@@ -0,0 +1,236 @@
+import hashlib
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from .database import db
+from .metrics import metrics
+from .models import User, RevokedToken, AuthInvalidation
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    """
+    Bloom filter gọn nhẹ: trả lời "chắc chắn không có" hoặc "có thể có"
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        capacity = max(1, capacity)
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, int(round(self.size / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str):
+        digest = hashlib.sha256(item.encode('utf-8')).digest()
+        h1 = int.from_bytes(digest[:8], 'big')
+        h2 = int.from_bytes(digest[8:16], 'big') | 1
+        for i in range(self.hash_count):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, item: str) -> None:
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+
+class AuthState:
+    """
+    Cache trạng thái user (is_active) có TTL và denylist token theo jti.
+    Trường hợp phổ biến (token chưa bị thu hồi) chỉ cần kiểm tra Bloom filter,
+    thay đổi được đồng bộ giữa các worker qua bảng AuthInvalidation
+    """
+
+    # Bloom filter không xóa được phần tử nên được dựng lại định kỳ
+    REBUILD_INTERVAL = 3600
+
+    def __init__(self):
+        self.user_ttl = 60
+        self.sync_interval = 5.0
+        self.capacity = 100000
+        self.error_rate = 0.001
+        self.max_users = 100000
+        # LRU user_id -> (hết hạn, is_active), tối đa max_users entry
+        self._users = OrderedDict()
+        # Các jti đã được xác nhận bị thu hồi (tránh hỏi lại DB)
+        self._revoked = set()
+        self._bloom = BloomFilter(self.capacity, self.error_rate)
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._last_event_id = None
+        self._next_sync = 0.0
+        self._next_rebuild = 0.0
+        self.user_hits = 0
+        self.user_misses = 0
+        self.bloom_negatives = 0
+        self.db_lookups = 0
+
+    def init_app(self, app):
+        self.user_ttl = app.config.get('USER_STATE_CACHE_TTL', 60)
+        self.sync_interval = app.config.get('AUTH_STATE_SYNC_INTERVAL', 5.0)
+        self.capacity = app.config.get('TOKEN_DENYLIST_CAPACITY', 100000)
+        self.error_rate = app.config.get('TOKEN_DENYLIST_ERROR_RATE', 0.001)
+        self.max_users = app.config.get('USER_STATE_CACHE_MAX_SIZE', 100000)
+        self._bloom = BloomFilter(self.capacity, self.error_rate)
+        metrics.register_stats('auth_state', self.stats)
+
+    def is_user_active(self, user_id: int) -> bool:
+        """
+        Kiểm tra user còn active, chỉ truy vấn DB khi cache hết hạn
+        """
+        self.sync()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._users.move_to_end(user_id)
+                self.user_hits += 1
+                return entry[1]
+            self.user_misses += 1
+
+        is_active = db.session.query(User.is_active)\
+            .filter(User.id == user_id)\
+            .scalar()
+        active = bool(is_active)
+        with self._lock:
+            self._users[user_id] = (now + self.user_ttl, active)
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        return active
+
+    def is_revoked(self, jti: Optional[str]) -> bool:
+        """
+        Kiểm tra token đã bị thu hồi chưa
+        """
+        if not jti:
+            return False
+        self.sync()
+        with self._lock:
+            if jti not in self._bloom:
+                self.bloom_negatives += 1
+                return False
+            if jti in self._revoked:
+                return True
+            self.db_lookups += 1
+
+        # Bloom filter báo dương tính (có thể giả) -> xác nhận với DB
+        revoked = db.session.query(RevokedToken.jti)\
+            .filter(RevokedToken.jti == jti)\
+            .first() is not None
+        if revoked:
+            with self._lock:
+                self._revoked.add(jti)
+        return revoked
+
+    def revoke_token(self, jti: str, user_id: int, expires_at: Optional[datetime]) -> None:
+        """
+        Thu hồi token và ghi log để các worker khác cập nhật
+        """
+        if db.session.query(RevokedToken).get(jti) is None:
+            db.session.add(RevokedToken(
+                jti=jti,
+                user_id=user_id,
+                expires_at=expires_at
+            ))
+        db.session.add(AuthInvalidation(kind='token', user_id=user_id, jti=jti))
+        db.session.commit()
+        with self._lock:
+            self._bloom.add(jti)
+            self._revoked.add(jti)
+
+    def invalidate_user(self, user_id: int) -> None:
+        """
+        Xóa trạng thái user khỏi cache (ở mọi worker)
+        """
+        db.session.add(AuthInvalidation(kind='user', user_id=user_id))
+        db.session.commit()
+        with self._lock:
+            self._users.pop(user_id, None)
+
+    def sync(self, force: bool = False) -> None:
+        """
+        Đọc các invalidation mới từ bảng dùng chung (tối đa mỗi sync_interval giây)
+        """
+        now = time.monotonic()
+        if not force and now < self._next_sync:
+            return
+        if not self._sync_lock.acquire(blocking=False):
+            return
+        try:
+            self._next_sync = now + self.sync_interval
+            if self._last_event_id is None or now >= self._next_rebuild:
+                self._rebuild()
+                self._next_rebuild = now + self.REBUILD_INTERVAL
+                return
+
+            events = db.session.query(AuthInvalidation)\
+                .filter(AuthInvalidation.id > self._last_event_id)\
+                .order_by(AuthInvalidation.id)\
+                .all()
+            with self._lock:
+                for event in events:
+                    if event.kind == 'token' and event.jti:
+                        self._bloom.add(event.jti)
+                    elif event.kind == 'user':
+                        self._users.pop(event.user_id, None)
+                    self._last_event_id = event.id
+        except Exception as e:
+            logger.error("Auth state sync error: %s", e)
+        finally:
+            self._sync_lock.release()
+
+    def _rebuild(self) -> None:
+        now = datetime.utcnow()
+        jtis = [row.jti for row in db.session.query(RevokedToken.jti).filter(
+            (RevokedToken.expires_at == None) | (RevokedToken.expires_at > now)  # noqa: E711
+        )]
+        last_event_id = db.session.query(db.func.max(AuthInvalidation.id)).scalar() or 0
+
+        # Dọn các bản ghi đã hết hạn trên connection riêng: _rebuild có thể chạy
+        # giữa request (JWT blocklist loader), không commit lẫn db.session của request
+        revoked = RevokedToken.__table__
+        invalidations = AuthInvalidation.__table__
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(revoked.delete().where(revoked.c.expires_at <= now))
+                conn.execute(invalidations.delete().where(invalidations.c.created_at < now - timedelta(days=1)))
+        except Exception as e:
+            # Chỉ là dọn dẹp, lần rebuild sau làm lại
+            logger.warning("Auth state cleanup error: %s", e)
+
+        bloom = BloomFilter(max(self.capacity, len(jtis) * 2), self.error_rate)
+        for jti in jtis:
+            bloom.add(jti)
+        with self._lock:
+            self._bloom = bloom
+            self._revoked = set()
+            self._users.clear()
+            self._last_event_id = last_event_id
+        logger.debug("Token denylist rebuilt with %s entries", len(jtis))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'cached_users': len(self._users),
+                'max_cached_users': self.max_users,
+                'user_hits': self.user_hits,
+                'user_misses': self.user_misses,
+                'denylist_entries': self._bloom.count,
+                'confirmed_revoked': len(self._revoked),
+                'bloom_bits': self._bloom.size,
+                'bloom_hashes': self._bloom.hash_count,
+                'bloom_negatives': self.bloom_negatives,
+                'db_lookups': self.db_lookups
+            }
+
+
+auth_state = AuthState()
\ No newline at end of file
@@ -0,0 +1,178 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Any
+
+from flask import has_app_context
+
+from .database import db
+from .models import ResponseCacheEntry
+
+logger = logging.getLogger(__name__)
+
+
+def make_cache_key(
+    model: str,
+    temperature: float,
+    language: str,
+    query: str,
+    code_context: Optional[str]
+) -> str:
+    """
+    Tạo cache key từ các tham số đã được chuẩn hóa
+    """
+    context_hash = hashlib.sha256((code_context or '').strip().encode('utf-8')).hexdigest()
+    payload = json.dumps([
+        model,
+        round(float(temperature), 3),
+        (language or '').strip().lower(),
+        ' '.join((query or '').split()),
+        context_hash
+    ])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+    Cache response 2 tầng: LRU trong process (giới hạn size + TTL)
+    và tầng persistent dùng chung qua bảng ResponseCacheEntry
+    """
+
+    # Khoảng cách tối thiểu (giây) giữa hai lần xóa row persistent đã hết hạn
+    EXPIRED_PURGE_INTERVAL = 60
+
+    def __init__(self, max_size: int = 1024, ttl: int = 3600, persistent: bool = False):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.persistent = persistent
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self.tokens_saved = 0
+        self.expired_purged = 0
+        self._next_purge = 0.0
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Lấy response từ cache, trả về None nếu không có hoặc đã hết hạn
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    self.tokens_saved += value.get('tokens_used', 0)
+                    return value
+                del self._entries[key]
+
+        value = self._get_persistent(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.persistent_hits += 1
+            self.tokens_saved += value.get('tokens_used', 0)
+        self._set_local(key, value)
+        return value
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        """
+        Lưu response vào cache (cả tầng local và persistent nếu được bật)
+        """
+        self._set_local(key, value)
+        self._set_persistent(key, value)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'persistent': self.persistent,
+                'hits': self.hits,
+                'persistent_hits': self.persistent_hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'tokens_saved': self.tokens_saved,
+                'expired_purged': self.expired_purged
+            }
+
+    def _set_local(self, key: str, value: Dict[str, Any]) -> None:
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def _purge_due(self) -> bool:
+        """
+        True tối đa một lần mỗi EXPIRED_PURGE_INTERVAL giây (trong process)
+        """
+        now = time.monotonic()
+        with self._lock:
+            if now < self._next_purge:
+                return False
+            self._next_purge = now + self.EXPIRED_PURGE_INTERVAL
+            return True
+
+    def _get_persistent(self, key: str) -> Optional[Dict[str, Any]]:
+        if not self.persistent or not has_app_context():
+            return None
+        try:
+            table = ResponseCacheEntry.__table__
+            with db.engine.connect() as conn:
+                row = conn.execute(
+                    table.select().where(table.c.cache_key == key)
+                ).first()
+            if row is None or (row.expires_at and row.expires_at <= datetime.utcnow()):
+                return None
+            return {
+                'response': row.response,
+                'tokens_used': row.tokens_used or 0,
+                'model': row.model
+            }
+        except Exception as e:
+            logger.error("Response cache read error: %s", e)
+            return None
+
+    def _set_persistent(self, key: str, value: Dict[str, Any]) -> None:
+        if not self.persistent or not has_app_context():
+            return
+        try:
+            table = ResponseCacheEntry.__table__
+            now = datetime.utcnow()
+            # Dùng connection riêng để không commit lẫn vào db.session của request
+            with db.engine.begin() as conn:
+                conn.execute(table.delete().where(table.c.cache_key == key))
+                conn.execute(table.insert().values(
+                    cache_key=key,
+                    model=value.get('model'),
+                    response=value['response'],
+                    tokens_used=value.get('tokens_used', 0),
+                    created_at=now,
+                    expires_at=now + timedelta(seconds=self.ttl)
+                ))
+                if self._purge_due():
+                    # Row hết hạn chỉ bị bỏ qua khi đọc -> dọn dần khi ghi để bảng không phình mãi
+                    purged = conn.execute(table.delete().where(table.c.expires_at <= now)).rowcount
+                    with self._lock:
+                        self.expired_purged += max(0, purged or 0)
+        except Exception as e:
+            logger.error("Response cache write error: %s", e)
\ No newline at end of file
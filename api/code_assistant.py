@@ -1,16 +1,47 @@
 import openai
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, AsyncIterator, Iterator, List, Tuple
 import os
+import json
+import hashlib
 import logging
+import time
 from datetime import datetime
+from config import Config
+from .cache import ResponseCache, make_cache_key
+from .compaction import comment_prefix, compact_context, estimate_tokens
+from .metrics import metrics
+from .resilience import CircuitOpenError, Resilience
+from .singleflight import SingleFlight
+from .upstream_http import PooledSession
 
-# Thiết lập logging
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-handler = logging.StreamHandler()
-handler.setFormatter(formatter)
-logger.addHandler(handler)
+
+class _DeltaFormatter:
+    """
+    Format tăng dần các chunk của stream: bỏ khoảng trắng đầu, giữ lại
+    khoảng trắng cuối cho tới khi biết chắc nó không nằm ở cuối response
+    """
+
+    def __init__(self):
+        self.parts = []
+        self.pending = ''
+
+    def feed(self, chunk) -> str:
+        content = chunk['choices'][0].get('delta', {}).get('content')
+        if not content:
+            return ''
+        text = self.pending + content
+        if not self.parts:
+            text = text.lstrip()
+        stripped = text.rstrip()
+        self.pending = text[len(stripped):]
+        if stripped:
+            self.parts.append(stripped)
+        return stripped
+
+    @property
+    def text(self) -> str:
+        return ''.join(self.parts)
 
 class CodeAssistant:
     def __init__(self):
@@ -30,6 +61,58 @@ class CodeAssistant:
         self.max_tokens = 2000
         self.temperature = 0.7
         
+        # Cache response cho các request giống hệt nhau
+        self.cache = None
+        if Config.RESPONSE_CACHE_ENABLED:
+            self.cache = ResponseCache(
+                max_size=Config.RESPONSE_CACHE_MAX_SIZE,
+                ttl=Config.RESPONSE_CACHE_TTL,
+                persistent=Config.RESPONSE_CACHE_PERSISTENT
+            )
+            
+        # Gộp các request giống hệt nhau đang chờ OpenAI
+        self.single_flight = None
+        if Config.SINGLE_FLIGHT_ENABLED:
+            self.single_flight = SingleFlight(timeout=Config.SINGLE_FLIGHT_TIMEOUT)
+            
+        # Connection pool dùng chung cho các lời gọi OpenAI đồng bộ
+        self.http = PooledSession(
+            pool_connections=Config.OPENAI_POOL_CONNECTIONS,
+            pool_maxsize=Config.OPENAI_POOL_MAXSIZE,
+            pool_block=Config.OPENAI_POOL_BLOCK,
+            keepalive=Config.OPENAI_KEEPALIVE,
+            connect_timeout=Config.OPENAI_CONNECT_TIMEOUT,
+            read_timeout=Config.OPENAI_READ_TIMEOUT,
+            # Retry đã do lớp resilience đảm nhận
+            max_retries=0 if Config.UPSTREAM_RESILIENCE_ENABLED else 2
+        )
+        
+        # Retry / circuit breaker / hedging / fallback model cho lời gọi OpenAI
+        self.resilience = None
+        if Config.UPSTREAM_RESILIENCE_ENABLED:
+            self.resilience = Resilience(
+                max_retries=Config.UPSTREAM_MAX_RETRIES,
+                base_delay=Config.UPSTREAM_RETRY_BASE_DELAY,
+                max_delay=Config.UPSTREAM_RETRY_MAX_DELAY,
+                failure_threshold=Config.UPSTREAM_CIRCUIT_FAILURE_THRESHOLD,
+                recovery_timeout=Config.UPSTREAM_CIRCUIT_RECOVERY_TIMEOUT,
+                hedge_after=Config.UPSTREAM_HEDGE_AFTER,
+                hedge_workers=Config.UPSTREAM_HEDGE_WORKERS,
+                fallback_models=Config.UPSTREAM_FALLBACK_MODELS
+            )
+            
+        if self.cache is not None:
+            metrics.register_stats('response_cache', self.cache.stats)
+        if self.single_flight is not None:
+            metrics.register_stats('single_flight', self.single_flight.stats)
+        metrics.register_stats('openai_http', self.http.stats)
+        if self.resilience is not None:
+            metrics.register_stats('upstream', self.resilience.stats)
+            metrics.register_gauge(
+                'upstream_circuit_state', 'Circuit breaker state by model (0=closed, 1=half_open, 2=open)',
+                self.resilience.breaker_states, ('model',)
+            )
+        
     def create_prompt(self, query: str, code_context: str, language: str) -> str:
         """
         Tạo prompt cho OpenAI API
@@ -42,6 +125,173 @@ class CodeAssistant:
         ]
         return "\n".join(filter(None, prompt_parts))
 
+    def fit_prompt(
+        self,
+        query: str,
+        code_context: Optional[str],
+        language: str
+    ) -> Tuple[List[Dict[str, str]], int, Dict[str, int]]:
+        """
+        Tạo messages vừa context window của model: code_context được nén về
+        phần token còn lại sau prompt cố định và số token tối thiểu dành cho
+        câu trả lời, max_tokens co lại theo phần còn trống.
+        Trả về (messages, max_tokens, {'original': ..., 'compacted': ...})
+        """
+        window = Config.MODEL_CONTEXT_WINDOWS.get(self.model, Config.DEFAULT_CONTEXT_WINDOW)
+        margin = Config.PROMPT_SAFETY_MARGIN
+        original = estimate_tokens(code_context)
+        context_tokens = {'original': original, 'compacted': original}
+        
+        if code_context and Config.PROMPT_COMPACTION_ENABLED:
+            base_tokens = self.count_message_tokens(
+                self.build_messages(self.create_prompt(query, '', language))
+            )
+            budget = min(
+                Config.PROMPT_CONTEXT_BUDGET,
+                window - base_tokens - Config.PROMPT_MIN_COMPLETION_TOKENS - margin
+            )
+            code_context, stats = compact_context(
+                query, code_context, max(budget, 0), comment_prefix(language)
+            )
+            context_tokens = {'original': stats['original'], 'compacted': stats['compacted']}
+            if stats['compacted'] < stats['original']:
+                logger.debug(
+                    "Code context compacted from %d to %d tokens (%d/%d chunks kept)",
+                    stats['original'], stats['compacted'], stats['kept'], stats['chunks']
+                )
+                
+        messages = self.build_messages(self.create_prompt(query, code_context, language))
+        available = window - self.count_message_tokens(messages) - margin
+        max_tokens = max(1, min(self.max_tokens, available))
+        return messages, max_tokens, context_tokens
+
+    def estimate_request_tokens(self, query: str, code_context: Optional[str]) -> int:
+        """
+        Ước lượng trần số token (prompt + completion) của một request, dùng để giữ chỗ quota
+        """
+        window = Config.MODEL_CONTEXT_WINDOWS.get(self.model, Config.DEFAULT_CONTEXT_WINDOW)
+        return min(window, estimate_tokens(query) + estimate_tokens(code_context) + self.max_tokens)
+
+    def count_message_tokens(self, messages: List[Dict[str, str]]) -> int:
+        """
+        Ước lượng token của danh sách messages (~4 token overhead mỗi message)
+        """
+        return sum(estimate_tokens(m['content']) + 4 for m in messages) + 3
+
+    def build_messages(self, prompt: str) -> List[Dict[str, str]]:
+        """
+        Tạo danh sách messages gửi lên ChatCompletion
+        """
+        return [
+            {
+                "role": "system",
+                "content": (
+                    "You are an expert programming assistant. "
+                    "Provide clear, concise, and practical answers "
+                    "with code examples when appropriate."
+                )
+            },
+            {"role": "user", "content": prompt}
+        ]
+
+    def create_completion(self, **params) -> Tuple[Any, str, bool]:
+        """
+        Gọi ChatCompletion.create, gộp với lời gọi giống hệt đang in-flight.
+        Trả về (response, model đã trả lời, coalesced)
+        """
+        if self.single_flight is None:
+            return self._resilient_create(**params) + (False,)
+            
+        key = hashlib.sha256(
+            json.dumps(params, sort_keys=True).encode('utf-8')
+        ).hexdigest()
+        (response, model), coalesced = self.single_flight.do(
+            key, lambda: self._resilient_create(**params)
+        )
+        return response, model, coalesced
+
+    def _resilient_create(self, hedge: bool = True, **params) -> Tuple[Any, str]:
+        """
+        _timed_create qua lớp resilience (retry, circuit breaker, hedging,
+        fallback model). Trả về (response, model đã trả lời).
+        Stream được đo trong _stream_done nên mở trực tiếp, không qua _timed_create
+        """
+        create = self._call_upstream if params.get('stream') else self._timed_create
+        if self.resilience is None:
+            return create(**params), params['model']
+        return self.resilience.call(
+            lambda model: create(**dict(params, model=model)),
+            params['model'], hedge=hedge
+        )
+
+    def _call_upstream(self, **params):
+        """
+        ChatCompletion.create qua connection pool dùng chung, timeout theo
+        deadline của request đến
+        """
+        timeout = self.http.request_timeout()
+        self.http.install()
+        return openai.ChatCompletion.create(request_timeout=timeout, **params)
+
+    async def _acall_upstream(self, **params):
+        # aiohttp session (pool) do AsyncApp gán qua openai.aiosession
+        return await openai.ChatCompletion.acreate(request_timeout=self.http.request_timeout(), **params)
+
+    def _timed_create(self, **params):
+        """
+        Gọi ChatCompletion.create và ghi latency / token theo model vào metrics
+        """
+        model = params.get('model', self.model)
+        started = time.perf_counter()
+        try:
+            response = self._call_upstream(**params)
+        except Exception:
+            metrics.observe_upstream(model, time.perf_counter() - started, outcome='error')
+            raise
+        metrics.observe_upstream(model, time.perf_counter() - started, usage=getattr(response, 'usage', None))
+        return response
+
+    async def acreate_completion(self, **params) -> Tuple[Any, str, bool]:
+        """
+        Bản async của create_completion (ChatCompletion.acreate)
+        """
+        if self.single_flight is None:
+            return await self._resilient_acreate(**params) + (False,)
+            
+        key = hashlib.sha256(
+            json.dumps(params, sort_keys=True).encode('utf-8')
+        ).hexdigest()
+        (response, model), coalesced = await self.single_flight.do_async(
+            key, lambda: self._resilient_acreate(**params)
+        )
+        return response, model, coalesced
+
+    async def _resilient_acreate(self, hedge: bool = True, **params) -> Tuple[Any, str]:
+        acreate = self._acall_upstream if params.get('stream') else self._timed_acreate
+        if self.resilience is None:
+            return await acreate(**params), params['model']
+        return await self.resilience.acall(
+            lambda model: acreate(**dict(params, model=model)),
+            params['model'], hedge=hedge
+        )
+
+    async def _timed_acreate(self, **params):
+        model = params.get('model', self.model)
+        started = time.perf_counter()
+        try:
+            response = await self._acall_upstream(**params)
+        except Exception:
+            metrics.observe_upstream(model, time.perf_counter() - started, outcome='error')
+            raise
+        metrics.observe_upstream(model, time.perf_counter() - started, usage=getattr(response, 'usage', None))
+        return response
+
+    def estimate_tokens(self, text: str) -> int:
+        """
+        Ước lượng số token khi API không trả về usage
+        """
+        return max(1, estimate_tokens(text))
+
     def format_response(self, ai_response: str) -> str:
         """
         Format response từ AI để dễ đọc hơn
@@ -53,14 +303,16 @@ class CodeAssistant:
         self, 
         query: str, 
         code_context: Optional[str] = '', 
-        language: str = 'python'
+        language: str = 'python',
+        use_cache: bool = True
     ) -> Dict[str, Any]:
         """
-        Xử lý yêu cầu và trả về response từ OpenAI
+        Xử lý yêu cầu và trả về response từ OpenAI.
+        use_cache=False bỏ qua bước đọc cache (kết quả mới vẫn được ghi vào cache)
         """
         try:
             # Log request
-            logger.debug(f"Processing request - Query: {query[:100]}...")
+            logger.debug("Processing request - Query: %s...", (query or '')[:100])
             
             # Validate inputs
             if not query:
@@ -69,80 +321,314 @@ class CodeAssistant:
                     'error': 'Query is required'
                 }
                 
-            # Tạo prompt
-            prompt = self.create_prompt(query, code_context, language)
-            
-            # Gọi OpenAI API
+            # Tra cache trước khi gọi OpenAI
             start_time = datetime.now()
+            cache_key, cached = self._lookup_cache(query, code_context, language, use_cache, start_time)
+            if cached is not None:
+                return cached
             
-            response = openai.ChatCompletion.create(
-                model=self.model,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": (
-                            "You are an expert programming assistant. "
-                            "Provide clear, concise, and practical answers "
-                            "with code examples when appropriate."
-                        )
-                    },
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=self.max_tokens,
-                temperature=self.temperature,
-                n=1,
-                stop=None
-            )
-            
-            # Calculate response time
-            response_time = (datetime.now() - start_time).total_seconds()
-            logger.debug(f"OpenAI API response time: {response_time:.2f} seconds")
+            # Gọi OpenAI API
+            params, context_tokens = self._completion_params(query, code_context, language)
+            response, model, coalesced = self.create_completion(**params)
+            return self._completion_result(response, model, coalesced, start_time, cache_key, context_tokens)
             
-            # Extract and format response
-            ai_response = response.choices[0].message.content
-            formatted_response = self.format_response(ai_response)
+        except Exception as e:
+            return self._error_result(e)
+
+    async def process_request_async(
+        self,
+        query: str,
+        code_context: Optional[str] = '',
+        language: str = 'python',
+        use_cache: bool = True
+    ) -> Dict[str, Any]:
+        """
+        Bản async của process_request: dùng openai.ChatCompletion.acreate nên
+        không giữ thread nào trong lúc chờ OpenAI
+        """
+        try:
+            logger.debug("Processing async request - Query: %s...", (query or '')[:100])
             
-            # Log success
-            logger.debug(
-                f"Request processed successfully - "
-                f"Tokens used: {response.usage.total_tokens}"
-            )
+            if not query:
+                return {
+                    'success': False,
+                    'error': 'Query is required'
+                }
+                
+            start_time = datetime.now()
+            cache_key, cached = self._lookup_cache(query, code_context, language, use_cache, start_time)
+            if cached is not None:
+                return cached
+                
+            params, context_tokens = self._completion_params(query, code_context, language)
+            response, model, coalesced = await self.acreate_completion(**params)
+            return self._completion_result(response, model, coalesced, start_time, cache_key, context_tokens)
             
-            return {
-                'success': True,
+        except Exception as e:
+            return self._error_result(e)
+
+    def _lookup_cache(
+        self,
+        query: str,
+        code_context: Optional[str],
+        language: str,
+        use_cache: bool,
+        start_time: datetime
+    ) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+        """
+        Trả về (cache_key, kết quả lấy từ cache hoặc None)
+        """
+        if self.cache is None:
+            return None, None
+        cache_key = make_cache_key(
+            self.model, self.temperature, language, query, code_context
+        )
+        cached = self.cache.get(cache_key) if use_cache else None
+        if cached is None:
+            return cache_key, None
+        logger.debug("Response served from cache")
+        return cache_key, {
+            'success': True,
+            'response': cached['response'],
+            'tokens_used': 0,
+            'response_time': (datetime.now() - start_time).total_seconds(),
+            'model': cached.get('model') or self.model,
+            'cached': True
+        }
+
+    def _completion_params(
+        self,
+        query: str,
+        code_context: Optional[str],
+        language: str,
+        **extra
+    ) -> Tuple[Dict[str, Any], Dict[str, int]]:
+        """
+        Tham số gửi lên ChatCompletion cho một yêu cầu, kèm số token của
+        code_context trước / sau khi nén
+        """
+        messages, max_tokens, context_tokens = self.fit_prompt(query, code_context, language)
+        params = dict(
+            model=self.model,
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=self.temperature,
+            n=1,
+            stop=None
+        )
+        params.update(extra)
+        return params, context_tokens
+
+    def _completion_result(
+        self,
+        response: Any,
+        model: str,
+        coalesced: bool,
+        start_time: datetime,
+        cache_key: Optional[str],
+        context_tokens: Dict[str, int]
+    ) -> Dict[str, Any]:
+        """
+        Chuyển response của ChatCompletion thành kết quả trả về, ghi cache
+        """
+        # Calculate response time
+        response_time = (datetime.now() - start_time).total_seconds()
+        logger.debug("OpenAI API response time: %.2f seconds", response_time)
+        
+        # Request được gộp không tốn thêm token nào
+        tokens_used = 0 if coalesced else response.usage.total_tokens
+        
+        # Extract and format response
+        ai_response = response.choices[0].message.content
+        formatted_response = self.format_response(ai_response)
+        
+        # Log success
+        logger.debug("Request processed successfully - Tokens used: %s", response.usage.total_tokens)
+        
+        if cache_key is not None and not coalesced:
+            self.cache.set(cache_key, {
                 'response': formatted_response,
                 'tokens_used': response.usage.total_tokens,
-                'response_time': response_time,
-                'model': self.model
-            }
+                'model': model
+            })
+        
+        return {
+            'success': True,
+            'response': formatted_response,
+            'tokens_used': tokens_used,
+            'response_time': response_time,
+            'model': model,
+            'cached': False,
+            'coalesced': coalesced,
+            'context_tokens': context_tokens
+        }
+
+    def _error_result(self, e: Exception) -> Dict[str, Any]:
+        if isinstance(e, openai.error.AuthenticationError):
+            logger.error("Authentication error: %s", e)
+        elif isinstance(e, openai.error.RateLimitError):
+            logger.error("Rate limit error: %s", e)
+        elif isinstance(e, openai.error.InvalidRequestError):
+            logger.error("Invalid request error: %s", e)
+        elif isinstance(e, openai.error.Timeout):
+            logger.error("Timeout error: %s", e)
+        else:
+            logger.error("Unexpected error: %s", e)
+        return {
+            'success': False,
+            'error': self._error_message(e)
+        }
+
+    def stream_request(
+        self,
+        query: str,
+        code_context: Optional[str] = '',
+        language: str = 'python',
+        use_cache: bool = True
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Gọi OpenAI với stream=True và yield từng event:
+        {'type': 'delta', 'content': ...}, cuối cùng là 'done' hoặc 'error'.
+        Đóng generator (client ngắt kết nối) sẽ đóng luôn stream upstream.
+        """
+        if not query:
+            yield {'type': 'error', 'error': 'Query is required'}
+            return
             
-        except openai.error.AuthenticationError as e:
-            logger.error(f"Authentication error: {str(e)}")
-            return {
-                'success': False,
-                'error': 'Invalid OpenAI API key'
-            }
+        start_time = datetime.now()
+        cache_key, cached = self._lookup_cache(query, code_context, language, use_cache, start_time)
+        if cached is not None:
+            yield {'type': 'delta', 'content': cached['response']}
+            yield dict(cached, type='done')
+            return
+                
+        params, context_tokens = self._completion_params(query, code_context, language, stream=True)
+        formatter = _DeltaFormatter()
+        upstream = None
+        upstream_started = time.perf_counter()
+        try:
+            upstream, params['model'] = self._resilient_create(hedge=False, **params)
             
-        except openai.error.RateLimitError as e:
-            logger.error(f"Rate limit error: {str(e)}")
-            return {
-                'success': False,
-                'error': 'OpenAI API rate limit exceeded'
-            }
+            for chunk in upstream:
+                text = formatter.feed(chunk)
+                if text:
+                    yield {'type': 'delta', 'content': text}
+                    
+        except Exception as e:
+            logger.error("Streaming error: %s", e)
+            metrics.observe_upstream(params['model'], time.perf_counter() - upstream_started, outcome='error')
+            yield {'type': 'error', 'error': self._error_message(e)}
+            return
             
-        except openai.error.InvalidRequestError as e:
-            logger.error(f"Invalid request error: {str(e)}")
-            return {
-                'success': False,
-                'error': f'Invalid request: {str(e)}'
-            }
+        finally:
+            if upstream is not None and hasattr(upstream, 'close'):
+                upstream.close()
+                
+        yield self._stream_done(params, formatter, start_time, upstream_started, cache_key, context_tokens)
+
+    async def stream_request_async(
+        self,
+        query: str,
+        code_context: Optional[str] = '',
+        language: str = 'python',
+        use_cache: bool = True
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Bản async của stream_request (openai.ChatCompletion.acreate, stream=True)
+        """
+        if not query:
+            yield {'type': 'error', 'error': 'Query is required'}
+            return
             
+        start_time = datetime.now()
+        cache_key, cached = self._lookup_cache(query, code_context, language, use_cache, start_time)
+        if cached is not None:
+            yield {'type': 'delta', 'content': cached['response']}
+            yield dict(cached, type='done')
+            return
+            
+        params, context_tokens = self._completion_params(query, code_context, language, stream=True)
+        formatter = _DeltaFormatter()
+        upstream = None
+        upstream_started = time.perf_counter()
+        try:
+            upstream, params['model'] = await self._resilient_acreate(hedge=False, **params)
+            
+            async for chunk in upstream:
+                text = formatter.feed(chunk)
+                if text:
+                    yield {'type': 'delta', 'content': text}
+                    
         except Exception as e:
-            logger.error(f"Unexpected error: {str(e)}")
-            return {
-                'success': False,
-                'error': f'An unexpected error occurred: {str(e)}'
-            }
+            logger.error("Streaming error: %s", e)
+            metrics.observe_upstream(params['model'], time.perf_counter() - upstream_started, outcome='error')
+            yield {'type': 'error', 'error': self._error_message(e)}
+            return
+            
+        finally:
+            if upstream is not None and hasattr(upstream, 'aclose'):
+                await upstream.aclose()
+                
+        yield self._stream_done(params, formatter, start_time, upstream_started, cache_key, context_tokens)
+
+    def _stream_done(
+        self,
+        params: Dict[str, Any],
+        formatter: '_DeltaFormatter',
+        start_time: datetime,
+        upstream_started: float,
+        cache_key: Optional[str],
+        context_tokens: Dict[str, int]
+    ) -> Dict[str, Any]:
+        """
+        Event 'done' cuối stream: ước lượng token, ghi metrics và cache
+        """
+        formatted_response = formatter.text
+        # Stream không trả về usage: đây chỉ là ước lượng (cả system prompt và
+        # toàn bộ completion), dùng cho token budget / quota / usage rollup
+        prompt_tokens = self.count_message_tokens(params['messages'])
+        completion_tokens = estimate_tokens(formatted_response)
+        tokens_used = prompt_tokens + completion_tokens
+        model = params['model']
+        metrics.observe_upstream(
+            model, time.perf_counter() - upstream_started,
+            usage={'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens, 'total_tokens': tokens_used}
+        )
+        response_time = (datetime.now() - start_time).total_seconds()
+        logger.debug("OpenAI stream finished in %.2f seconds", response_time)
+        
+        if cache_key is not None and formatted_response:
+            self.cache.set(cache_key, {
+                'response': formatted_response,
+                'tokens_used': tokens_used,
+                'model': model
+            })
+            
+        return {
+            'type': 'done',
+            'response': formatted_response,
+            'tokens_used': tokens_used,
+            'response_time': response_time,
+            'model': model,
+            'cached': False,
+            'context_tokens': context_tokens
+        }
+
+    def _error_message(self, e: Exception) -> str:
+        """
+        Chuyển exception của OpenAI thành thông báo lỗi cho client
+        """
+        if isinstance(e, openai.error.AuthenticationError):
+            return 'Invalid OpenAI API key'
+        if isinstance(e, openai.error.RateLimitError):
+            return 'OpenAI API rate limit exceeded'
+        if isinstance(e, openai.error.Timeout):
+            return 'OpenAI API request timed out'
+        if isinstance(e, CircuitOpenError):
+            return 'OpenAI API temporarily unavailable, please retry later'
+        if isinstance(e, openai.error.InvalidRequestError):
+            return f'Invalid request: {str(e)}'
+        return f'An unexpected error occurred: {str(e)}'
 
     def validate_language(self, language: str) -> bool:
         """
@@ -0,0 +1,127 @@
+import json
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from .storage import backfill_sessions, delete_orphan_blobs, storage_report
+from .search import rebuild_search_index
+from .similarity import backfill_fingerprints
+from .usage import rebuild_rollups
+from .retention import retention_manager
+from .jwt_keys import ASYMMETRIC_ALGORITHMS, key_ring
+from .provisioning import import_users
+
+
+@click.command('storage-backfill')
+@click.option('--batch-size', default=500, show_default=True)
+@with_appcontext
+def storage_backfill_command(batch_size):
+    """Nén và khử trùng lặp nội dung của các CodeSession cũ."""
+    result = backfill_sessions(batch_size=batch_size)
+    deleted = delete_orphan_blobs(current_app.config.get('BLOB_GC_GRACE', 3600))
+    click.echo(f"Converted {result['converted']} sessions, removed {deleted} orphan blobs")
+    click.echo(json.dumps(storage_report(), indent=2))
+
+
+@click.command('storage-report')
+@with_appcontext
+def storage_report_command():
+    """In báo cáo dung lượng đã tiết kiệm được."""
+    click.echo(json.dumps(storage_report(), indent=2))
+
+
+@click.command('storage-gc')
+@click.option('--grace', type=int, default=None,
+              help='Chỉ xóa blob không được dùng trong số giây này (mặc định BLOB_GC_GRACE)')
+@with_appcontext
+def storage_gc_command(grace):
+    """Xóa các content blob không còn được tham chiếu."""
+    if grace is None:
+        grace = current_app.config.get('BLOB_GC_GRACE', 3600)
+    click.echo(f"Removed {delete_orphan_blobs(grace)} orphan blobs")
+
+
+@click.command('search-reindex')
+@with_appcontext
+def search_reindex_command():
+    """Dựng lại index full-text của lịch sử code session."""
+    click.echo(f"Indexed {rebuild_search_index()} sessions")
+
+
+@click.command('near-dup-backfill')
+@click.option('--batch-size', default=500, show_default=True)
+@with_appcontext
+def near_dup_backfill_command(batch_size):
+    """Tính fingerprint near-duplicate cho các code session cũ."""
+    click.echo(f"Fingerprinted {backfill_fingerprints(batch_size=batch_size)} sessions")
+
+
+@click.command('usage-rebuild')
+@with_appcontext
+def usage_rebuild_command():
+    """Tính lại bảng tổng hợp token usage từ lịch sử code session."""
+    click.echo(f"Rebuilt {rebuild_rollups()} usage rollup rows")
+
+
+@click.command('retention-run')
+@with_appcontext
+def retention_run_command():
+    """Xử lý các yêu cầu xóa lịch sử và áp dụng chính sách retention ngay."""
+    result = retention_manager.run_once()
+    click.echo(f"Deleted {result['deleted']} sessions")
+
+
+@click.command('jwt-rotate-key')
+@click.option('--algorithm', type=click.Choice(ASYMMETRIC_ALGORITHMS), default=None,
+              help='Mặc định theo JWT_ALGORITHM')
+@with_appcontext
+def jwt_rotate_key_command(algorithm):
+    """Tạo key ký JWT mới (công bố ngay, dùng để ký sau JWT_KEY_ACTIVATION_DELAY)."""
+    if not key_ring.enabled:
+        raise click.ClickException('JWT_ALGORITHM is symmetric, key rotation is disabled')
+    key = key_ring.rotate(algorithm)
+    click.echo(f"Generated key {key.kid} ({key.algorithm}), active key is {key_ring.active.kid}")
+
+
+@click.command('jwt-prune-keys')
+@with_appcontext
+def jwt_prune_keys_command():
+    """Xóa các key ký JWT đã thôi ký lâu hơn thời hạn token."""
+    if not key_ring.enabled:
+        raise click.ClickException('JWT_ALGORITHM is symmetric, key rotation is disabled')
+    removed = key_ring.prune(current_app.config['JWT_ACCESS_TOKEN_EXPIRES'].total_seconds())
+    click.echo(f"Removed {len(removed)} keys: {', '.join(removed) or '-'}")
+
+
+@click.command('users-import')
+@click.argument('path', type=click.File('r', encoding='utf-8-sig'))
+@click.option('--format', 'data_format', type=click.Choice(['csv', 'ndjson']), default=None,
+              help='Mặc định theo đuôi file')
+@click.option('--batch-size', default=None, type=int, help='Mặc định theo PROVISIONING_BATCH_SIZE')
+@with_appcontext
+def users_import_command(path, data_format, batch_size):
+    """Tạo user hàng loạt từ file CSV (username,email,password) hoặc NDJSON."""
+    data_format = data_format or ('csv' if path.name.lower().endswith('.csv') else 'ndjson')
+    batch_size = batch_size or current_app.config.get('PROVISIONING_BATCH_SIZE', 200)
+    for event in import_users(path, data_format, batch_size):
+        if event['type'] == 'error':
+            click.echo(f"line {event['line']} ({event['username'] or '-'}): {event['error']}", err=True)
+        else:
+            click.echo(
+                f"{event['type']}: {event['processed']} processed, {event['created']} created, "
+                f"{event['failed']} failed ({event['users_per_second']} users/s)"
+            )
+
+
+def register_commands(app):
+    app.cli.add_command(storage_backfill_command)
+    app.cli.add_command(storage_report_command)
+    app.cli.add_command(storage_gc_command)
+    app.cli.add_command(search_reindex_command)
+    app.cli.add_command(near_dup_backfill_command)
+    app.cli.add_command(usage_rebuild_command)
+    app.cli.add_command(retention_run_command)
+    app.cli.add_command(jwt_rotate_key_command)
+    app.cli.add_command(jwt_prune_keys_command)
+    app.cli.add_command(users_import_command)
\ No newline at end of file
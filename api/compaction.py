@@ -0,0 +1,201 @@
+import math
+import re
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+# Mỗi match xấp xỉ một token BPE: từ/số, hoặc một ký tự dấu câu
+_TOKEN_RE = re.compile(r'[A-Za-z_]+|\d+|[^\sA-Za-z_\d]')
+_IDENT_RE = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+_SUBWORD_RE = re.compile(r'[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+')
+
+# Dòng mở đầu một function / class ở các ngôn ngữ được hỗ trợ
+_DEFINITION_RE = re.compile(
+    r'^\s*(?:@\w|(?:export\s+)?(?:default\s+)?(?:async\s+)?'
+    r'(?:def|class|function|func|fn|interface|struct|impl|enum|trait|module)\b|'
+    r'(?:public|private|protected|internal|static)\s[\w<>\[\],\s]*\(|'
+    r'(?:const|let|var)\s+\w+\s*=\s*(?:async\s*)?(?:function|\())'
+)
+_NAME_RE = re.compile(r'(?:def|class|function|func|fn|interface|struct|impl|enum|trait|const|let|var)\s+([A-Za-z_]\w*)')
+
+_STOPWORDS = frozenset((
+    'the', 'a', 'an', 'to', 'of', 'in', 'on', 'for', 'and', 'or', 'is', 'it',
+    'how', 'do', 'i', 'my', 'this', 'that', 'what', 'why', 'with', 'can',
+    'self', 'return', 'def', 'class', 'function', 'import', 'from', 'if', 'else'
+))
+
+
+def estimate_tokens(text: Optional[str]) -> int:
+    """
+    Ước lượng số token không cần tokenizer: từ dài được tính thành nhiều
+    token (~6 ký tự/token), mỗi dấu câu là một token
+    """
+    if not text:
+        return 0
+    tokens = _TOKEN_RE.findall(text)
+    return len(tokens) + sum((len(t) - 1) // 6 for t in tokens if len(t) > 6)
+
+
+def _terms(text: str) -> List[str]:
+    """
+    Tách identifier thành từ con (camelCase, snake_case) để so khớp với query
+    """
+    terms = []
+    for ident in _IDENT_RE.findall(text):
+        lower = ident.lower()
+        if lower not in _STOPWORDS:
+            terms.append(lower)
+        parts = _SUBWORD_RE.findall(ident)
+        if len(parts) > 1:
+            terms.extend(p.lower() for p in parts if p.lower() not in _STOPWORDS and len(p) > 1)
+    return terms
+
+
+def split_chunks(code: str) -> List[str]:
+    """
+    Chia code thành các chunk theo function / class ở mức thụt lề ngoài cùng;
+    phần nằm giữa các definition (import, biến toàn cục) là chunk riêng.
+    Code không có definition nào được chia theo đoạn (dòng trống)
+    """
+    lines = code.splitlines(keepends=True)
+    indents = [len(l) - len(l.lstrip()) for l in lines if l.strip()]
+    base = min(indents) if indents else 0
+
+    starts = []
+    for i, line in enumerate(lines):
+        if not line.strip() or len(line) - len(line.lstrip()) != base:
+            continue
+        if _DEFINITION_RE.match(line):
+            # Decorator / comment ngay phía trên thuộc về definition
+            if starts and starts[-1] == i - 1 and lines[i - 1].lstrip().startswith('@'):
+                continue
+            starts.append(i)
+
+    if not starts:
+        chunks, current = [], []
+        for line in lines:
+            current.append(line)
+            if not line.strip() and any(l.strip() for l in current):
+                chunks.append(''.join(current))
+                current = []
+        if current:
+            chunks.append(''.join(current))
+        return chunks
+
+    bounds = ([0] if starts[0] > 0 else []) + starts + [len(lines)]
+    return [''.join(lines[a:b]) for a, b in zip(bounds, bounds[1:]) if a < b]
+
+
+def _rank(query: str, chunks: List[str]) -> List[float]:
+    """
+    Điểm BM25 của từng chunk theo các term trong query, cộng thêm điểm
+    khi tên function / class được nhắc trực tiếp trong query
+    """
+    query_terms = set(_terms(query))
+    chunk_terms = [Counter(_terms(c)) for c in chunks]
+    n = len(chunks)
+    avg_len = sum(sum(t.values()) for t in chunk_terms) / n if n else 0
+    query_lower = query.lower()
+    df = {term: sum(1 for t in chunk_terms if term in t) for term in query_terms}
+
+    scores = []
+    for chunk, terms in zip(chunks, chunk_terms):
+        length = sum(terms.values()) or 1
+        score = 0.0
+        for term in query_terms:
+            tf = terms.get(term)
+            if not tf:
+                continue
+            idf = math.log(1 + (n - df[term] + 0.5) / (df[term] + 0.5))
+            score += idf * tf * 2.2 / (tf + 1.2 * (0.25 + 0.75 * length / (avg_len or 1)))
+        name = _NAME_RE.search(chunk)
+        if name and name.group(1).lower() in query_lower:
+            score += 5.0
+        scores.append(score)
+    return scores
+
+
+def _truncate(chunk: str, budget: int) -> str:
+    """
+    Giữ các dòng đầu của chunk cho tới khi hết budget
+    """
+    kept, used = [], 0
+    for line in chunk.splitlines(keepends=True):
+        cost = estimate_tokens(line)
+        if used + cost > budget:
+            break
+        kept.append(line)
+        used += cost
+    return ''.join(kept)
+
+
+def _render(chunks: List[str], selected: Dict[int, str], comment: str) -> str:
+    """
+    Ghép các chunk được chọn theo thứ tự ban đầu, chỗ bị bỏ thay bằng một dòng đánh dấu
+    """
+    parts, omitted = [], 0
+    for i, chunk in enumerate(chunks):
+        if i in selected:
+            if omitted:
+                parts.append(f"{comment} ... {omitted} lines omitted ...\n")
+                omitted = 0
+            text = selected[i]
+            parts.append(text if text.endswith('\n') else text + '\n')
+        else:
+            omitted += chunk.count('\n') or 1
+    if omitted:
+        parts.append(f"{comment} ... {omitted} lines omitted ...\n")
+    return ''.join(parts)
+
+
+def compact_context(query: str, code_context: str, budget: int, comment: str = '#') -> Tuple[str, Dict[str, int]]:
+    """
+    Rút gọn code_context về tối đa `budget` token: giữ các chunk liên quan
+    nhất tới query (theo thứ tự xuất hiện ban đầu), chỗ bị bỏ được đánh dấu.
+    Trả về (context, {'original': ..., 'compacted': ..., 'chunks': ..., 'kept': ...})
+    """
+    original = estimate_tokens(code_context)
+    if original <= budget:
+        return code_context, {'original': original, 'compacted': original, 'chunks': 1, 'kept': 1}
+
+    chunks = split_chunks(code_context)
+    scores = _rank(query or '', chunks)
+    costs = [estimate_tokens(c) for c in chunks]
+
+    # Ưu tiên điểm cao, cùng điểm thì ưu tiên chunk đứng trước (import, header)
+    order = sorted(range(len(chunks)), key=lambda i: (-scores[i], i))
+    marker_cost = estimate_tokens(f"{comment} ... 999 lines omitted ...\n")
+    selected, used = {}, marker_cost
+    for i in order:
+        # Chunk nối tiếp chunk đã chọn không cần thêm dòng đánh dấu
+        cost = costs[i] + (0 if i - 1 in selected else marker_cost)
+        if used + cost <= budget:
+            selected[i] = chunks[i]
+            used += cost
+        elif not selected:
+            # Chunk liên quan nhất quá lớn -> giữ phần đầu
+            truncated = _truncate(chunks[i], budget - 2 * marker_cost)
+            if truncated:
+                selected[i] = truncated
+                used += estimate_tokens(truncated) + marker_cost
+
+    compacted = _render(chunks, selected, comment)
+    # Ước lượng ở trên có thể lệch (dòng đánh dấu) -> bỏ bớt chunk kém liên quan nhất
+    while selected and estimate_tokens(compacted) > budget:
+        del selected[min(selected, key=lambda i: (scores[i], -i))]
+        compacted = _render(chunks, selected, comment)
+
+    return compacted, {
+        'original': original,
+        'compacted': estimate_tokens(compacted),
+        'chunks': len(chunks),
+        'kept': len(selected)
+    }
+
+
+def comment_prefix(language: str) -> str:
+    """
+    Ký hiệu comment dòng của ngôn ngữ (dùng cho dòng đánh dấu phần bị bỏ)
+    """
+    if (language or '').lower() in ('python', 'ruby', 'shell', 'bash', 'r', 'perl', 'yaml'):
+        return '#'
+    return '//'
\ No newline at end of file
@@ -0,0 +1,26 @@
+import hashlib
+import zlib
+from typing import Optional
+
+from config import Config
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def compress_text(text: str) -> bytes:
+    return zlib.compress(text.encode('utf-8'), Config.SESSION_COMPRESSION_LEVEL)
+
+
+def decompress_text(data: Optional[bytes]) -> Optional[str]:
+    if data is None:
+        return None
+    return zlib.decompress(data).decode('utf-8')
+
+
+def should_compress(text: Optional[str]) -> bool:
+    """
+    Text ngắn không đáng nén (header zlib làm nó dài hơn)
+    """
+    return bool(text) and len(text) >= Config.SESSION_COMPRESSION_MIN_SIZE
\ No newline at end of file
@@ -1,4 +1,5 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import inspect
 from flask_login import LoginManager
 
 db = SQLAlchemy()
@@ -7,4 +8,30 @@ login_manager = LoginManager()
 @login_manager.user_loader
 def load_user(user_id):
     from .models import User
-    return User.query.get(int(user_id))
\ No newline at end of file
+    return User.query.get(int(user_id))
+
+def create_missing_indexes():
+    """
+    db.create_all() không thêm index mới vào bảng đã tồn tại -> tạo bổ sung
+    """
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+
+def add_missing_columns():
+    """
+    Thêm các cột mới (nullable) vào bảng đã tồn tại từ phiên bản cũ
+    """
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing or not column.nullable:
+                continue
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            with db.engine.begin() as conn:
+                conn.execute(
+                    f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'
+                )
\ No newline at end of file
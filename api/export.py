@@ -0,0 +1,128 @@
+import csv
+import io
+import json
+import zlib
+from datetime import datetime
+from typing import Any, Dict, Iterator, Optional
+
+from .database import db
+from .models import CodeSession, ContentBlob
+from .compression import decompress_text
+
+EXPORT_FIELDS = ['id', 'user_id', 'created_at', 'language', 'model', 'tokens_used', 'query', 'code_context', 'response']
+CHUNK_SIZE = 64 * 1024
+
+
+def session_rows_query():
+    """
+    Query chỉ lấy cột (không tạo ORM object), kèm dữ liệu blob của code_context
+    """
+    return db.session.query(
+        CodeSession.id,
+        CodeSession.user_id,
+        CodeSession.created_at,
+        CodeSession.language,
+        CodeSession.model,
+        CodeSession.tokens_used,
+        CodeSession.query,
+        CodeSession.raw_code_context,
+        ContentBlob.data.label('context_data'),
+        CodeSession.raw_response,
+        CodeSession.response_data
+    ).outerjoin(ContentBlob, ContentBlob.hash == CodeSession.context_hash)
+
+
+def row_to_dict(row) -> Dict[str, Any]:
+    return {
+        'id': row.id,
+        'user_id': row.user_id,
+        'created_at': row.created_at.isoformat() if row.created_at else None,
+        'language': row.language,
+        'model': row.model,
+        'tokens_used': row.tokens_used,
+        'query': row.query,
+        'code_context': decompress_text(row.context_data) if row.context_data is not None else row.raw_code_context,
+        'response': decompress_text(row.response_data) if row.response_data is not None else row.raw_response
+    }
+
+
+def iter_sessions(
+    user_id: int,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    batch_size: int = 500
+) -> Iterator[Dict[str, Any]]:
+    """
+    Duyệt session của user trong khoảng [start, end) theo từng trang keyset
+    (created_at, id), mỗi trang một transaction đọc ngắn: bộ nhớ không tăng
+    theo số session và download chậm không giữ transaction (chặn writer SQLite)
+    """
+    rows = session_rows_query().filter(CodeSession.user_id == user_id)
+    if start:
+        rows = rows.filter(CodeSession.created_at >= start)
+    if end:
+        rows = rows.filter(CodeSession.created_at < end)
+    rows = rows.order_by(CodeSession.created_at, CodeSession.id)
+
+    last = None
+    while True:
+        page = rows
+        if last is not None:
+            page = page.filter(db.or_(
+                CodeSession.created_at > last.created_at,
+                db.and_(
+                    CodeSession.created_at == last.created_at,
+                    CodeSession.id > last.id
+                )
+            ))
+        batch = page.limit(batch_size).all()
+        # Kết thúc transaction đọc trước khi yield cho client
+        db.session.rollback()
+        for row in batch:
+            yield row_to_dict(row)
+        if len(batch) < batch_size:
+            return
+        last = batch[-1]
+
+
+def ndjson_lines(sessions: Iterator[Dict[str, Any]]) -> Iterator[str]:
+    for session in sessions:
+        yield json.dumps(session, ensure_ascii=False) + '\n'
+
+
+def csv_lines(sessions: Iterator[Dict[str, Any]]) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+    writer.writeheader()
+    for session in sessions:
+        writer.writerow(session)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.getvalue():
+        yield buffer.getvalue()
+
+
+def chunked(lines: Iterator[str], gzip: bool = False) -> Iterator[bytes]:
+    """
+    Gom các dòng thành chunk ~64KB, nén gzip tăng dần nếu được yêu cầu
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if gzip else None
+    parts = []
+    size = 0
+    for line in lines:
+        data = line.encode('utf-8')
+        parts.append(data)
+        size += len(data)
+        if size >= CHUNK_SIZE:
+            chunk = b''.join(parts)
+            parts, size = [], 0
+            if compressor is not None:
+                chunk = compressor.compress(chunk)
+            if chunk:
+                yield chunk
+    chunk = b''.join(parts)
+    if compressor is not None:
+        chunk = compressor.compress(chunk) + compressor.flush()
+    if chunk:
+        yield chunk
\ No newline at end of file
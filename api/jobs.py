@@ -0,0 +1,224 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, Any
+
+from .database import db
+from .metrics import metrics
+from .models import CodeAssistJob, CodeSession
+from .ratelimit import charge_tokens
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueue:
+    """
+    Hàng đợi job code-assist với worker pool giới hạn,
+    trạng thái job được lưu trong bảng CodeAssistJob
+    """
+
+    def __init__(self):
+        self.app = None
+        self.executor = None
+        self.max_workers = 0
+        self.max_queue = 0
+        self.stale_after = 3600
+        self.ttl = 86400
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._abandoned = 0
+        self._expired = 0
+        self._total_wait = 0.0
+        self._total_run = 0.0
+        self._max_wait = 0.0
+        self._max_run = 0.0
+
+    def init_app(self, app):
+        self.app = app
+        self.max_workers = app.config.get('CODE_ASSIST_WORKERS', 4)
+        self.max_queue = app.config.get('CODE_ASSIST_QUEUE_SIZE', 100)
+        self.stale_after = app.config.get('CODE_ASSIST_JOB_STALE_AFTER', 3600)
+        self.ttl = app.config.get('CODE_ASSIST_JOB_TTL', 86400)
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.max_workers,
+            thread_name_prefix='code-assist-job'
+        )
+        metrics.register_stats('code_assist_jobs', self.stats)
+
+    def is_full(self) -> bool:
+        with self._lock:
+            return self._queued >= self.max_queue
+
+    def submit(self, job_id: str, assistant) -> bool:
+        """
+        Đưa job vào hàng đợi, trả về False nếu hàng đợi đã đầy
+        """
+        with self._lock:
+            if self._queued >= self.max_queue:
+                self._rejected += 1
+                return False
+            self._queued += 1
+        self.executor.submit(self._run, job_id, assistant, time.monotonic())
+        return True
+
+    def fail_stale(self) -> int:
+        """
+        Đánh dấu failed các job 'queued' / 'running' quá `stale_after` giây:
+        hàng đợi chỉ nằm trong memory nên job của process đã dừng (restart,
+        crash) không bao giờ chạy tiếp. Cần app context
+        """
+        stale_before = datetime.utcnow() - timedelta(seconds=self.stale_after)
+        failed = db.session.query(CodeAssistJob)\
+            .filter(db.or_(
+                db.and_(CodeAssistJob.status == 'queued', CodeAssistJob.created_at < stale_before),
+                db.and_(CodeAssistJob.status == 'running', CodeAssistJob.started_at < stale_before)
+            ))\
+            .update({
+                'status': 'failed',
+                'error': 'Job was interrupted by a server restart',
+                'finished_at': datetime.utcnow()
+            }, synchronize_session=False)
+        db.session.commit()
+        if failed:
+            logger.warning("Marked %d abandoned code-assist jobs as failed", failed)
+            with self._lock:
+                self._abandoned += failed
+        return failed
+
+    def delete_expired(self) -> int:
+        """
+        Xóa các job đã xong quá `ttl` giây (row giữ nguyên query / code_context).
+        Cần app context
+        """
+        if self.ttl <= 0:
+            return 0
+        cutoff = datetime.utcnow() - timedelta(seconds=self.ttl)
+        deleted = db.session.query(CodeAssistJob)\
+            .filter(
+                CodeAssistJob.status.in_(('succeeded', 'failed')),
+                CodeAssistJob.finished_at < cutoff
+            )\
+            .delete(synchronize_session=False)
+        db.session.commit()
+        with self._lock:
+            self._expired += deleted
+        return deleted
+
+    def delete_user_jobs(self, user_id: int, created_before: datetime) -> int:
+        """
+        Xóa các job đã xong của user tạo trước `created_before` (clear history).
+        Job chưa xong sẽ tạo session mới, giống session tạo sau yêu cầu xóa.
+        Không commit
+        """
+        return db.session.query(CodeAssistJob)\
+            .filter(
+                CodeAssistJob.user_id == user_id,
+                CodeAssistJob.status.in_(('succeeded', 'failed')),
+                CodeAssistJob.created_at <= created_before
+            )\
+            .delete(synchronize_session=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            finished = self._completed + self._failed
+            return {
+                'workers': self.max_workers,
+                'max_queue': self.max_queue,
+                'queue_depth': self._queued,
+                'running': self._running,
+                'completed': self._completed,
+                'failed': self._failed,
+                'rejected': self._rejected,
+                'abandoned': self._abandoned,
+                'expired': self._expired,
+                'avg_wait_time': self._total_wait / finished if finished else 0.0,
+                'max_wait_time': self._max_wait,
+                'avg_run_time': self._total_run / finished if finished else 0.0,
+                'max_run_time': self._max_run
+            }
+
+    def _run(self, job_id: str, assistant, enqueued_at: float) -> None:
+        started = time.monotonic()
+        wait_time = started - enqueued_at
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+
+        success = False
+        try:
+            with self.app.app_context():
+                success = self._process(job_id, assistant)
+        except Exception as e:
+            logger.error("Job %s crashed: %s", job_id, e)
+        finally:
+            run_time = time.monotonic() - started
+            with self._lock:
+                self._running -= 1
+                if success:
+                    self._completed += 1
+                else:
+                    self._failed += 1
+                self._total_wait += wait_time
+                self._total_run += run_time
+                self._max_wait = max(self._max_wait, wait_time)
+                self._max_run = max(self._max_run, run_time)
+
+    def _process(self, job_id: str, assistant) -> bool:
+        # Claim nguyên tử: job đã bị fail_stale đánh dấu failed thì không chạy nữa
+        claimed = db.session.query(CodeAssistJob)\
+            .filter(CodeAssistJob.id == job_id, CodeAssistJob.status == 'queued')\
+            .update({'status': 'running', 'started_at': datetime.utcnow()}, synchronize_session=False)
+        db.session.commit()
+        if not claimed:
+            logger.error("Job %s not found or no longer queued", job_id)
+            return False
+        job = db.session.query(CodeAssistJob).get(job_id)
+
+        try:
+            response = assistant.process_request(
+                query=job.query,
+                code_context=job.code_context,
+                language=job.language,
+                use_cache=job.use_cache
+            )
+            if not response.get('success'):
+                job.status = 'failed'
+                job.error = response.get('error')
+                return False
+
+            session = CodeSession(
+                user_id=job.user_id,
+                query=job.query,
+                code_context=job.code_context,
+                response=response['response'],
+                language=job.language,
+                tokens_used=response.get('tokens_used', 0),
+                model=response.get('model'),
+                created_at=datetime.utcnow()
+            )
+            db.session.add(session)
+            db.session.flush()
+            job.session_id = session.id
+            job.status = 'succeeded'
+            charge_tokens(job.user_id, session.tokens_used)
+            return True
+
+        except Exception as e:
+            logger.error("Job %s error: %s", job_id, e)
+            db.session.rollback()
+            job.status = 'failed'
+            job.error = str(e)
+            return False
+
+        finally:
+            job.finished_at = datetime.utcnow()
+            db.session.commit()
+
+
+job_queue = JobQueue()
\ No newline at end of file
@@ -0,0 +1,270 @@
+import hashlib
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import jwt as pyjwt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+from jwt.algorithms import ECAlgorithm, OKPAlgorithm, RSAAlgorithm
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+RSA_ALGORITHMS = ('RS256', 'RS384', 'RS512', 'PS256', 'PS384', 'PS512')
+ASYMMETRIC_ALGORITHMS = RSA_ALGORITHMS + ('ES256', 'EdDSA')
+
+
+class SigningKey:
+    """
+    Một cặp key ký JWT, định danh bằng kid (tên file PEM trong JWT_KEYS_DIR)
+    """
+
+    def __init__(self, kid: str, private_key, created: float, algorithm: Optional[str] = None):
+        self.kid = kid
+        self.private_key = private_key
+        self.public_key = private_key.public_key()
+        self.created = created
+        self.algorithm = algorithm or _default_algorithm(private_key)
+
+    def jwk(self) -> Dict[str, Any]:
+        if isinstance(self.public_key, rsa.RSAPublicKey):
+            data = json.loads(RSAAlgorithm.to_jwk(self.public_key))
+        elif isinstance(self.public_key, ec.EllipticCurvePublicKey):
+            data = json.loads(ECAlgorithm.to_jwk(self.public_key))
+        else:
+            data = json.loads(OKPAlgorithm.to_jwk(self.public_key))
+        data.update({'kid': self.kid, 'alg': self.algorithm, 'use': 'sig'})
+        return data
+
+
+def _default_algorithm(private_key) -> str:
+    if isinstance(private_key, rsa.RSAPrivateKey):
+        return 'RS256'
+    if isinstance(private_key, ec.EllipticCurvePrivateKey):
+        return 'ES256'
+    if isinstance(private_key, ed25519.Ed25519PrivateKey):
+        return 'EdDSA'
+    raise ValueError(f"Unsupported key type: {type(private_key).__name__}")
+
+
+def generate_private_key(algorithm: str, rsa_key_size: int = 2048):
+    if algorithm in RSA_ALGORITHMS:
+        return rsa.generate_private_key(public_exponent=65537, key_size=rsa_key_size)
+    if algorithm == 'ES256':
+        return ec.generate_private_key(ec.SECP256R1())
+    if algorithm == 'EdDSA':
+        return ed25519.Ed25519PrivateKey.generate()
+    raise ValueError(f"Unsupported JWT algorithm: {algorithm}")
+
+
+class KeyRing:
+    """
+    Tập key ký JWT có xoay vòng theo kid:
+    - mọi key trong thư mục đều được công bố ở JWKS và dùng để verify
+    - key ký là key mới nhất đã được công bố ít nhất JWT_KEY_ACTIVATION_DELAY
+      giây (để cache JWKS của các service khác kịp thấy nó)
+    - thư mục được đọc lại định kỳ, nên key xoay bằng CLI có hiệu lực ở mọi worker
+    Với JWT_ALGORITHM dạng HS* thì KeyRing tắt, dùng JWT_SECRET_KEY như cũ
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.algorithm = 'HS256'
+        self.directory = None
+        self.rsa_key_size = 2048
+        self.activation_delay = 300
+        self.refresh_interval = 60
+        self.legacy_secret = None
+        self.keys: Dict[str, SigningKey] = {}
+        self.active: Optional[SigningKey] = None
+        self.etag = None
+        self._jwks = {'keys': []}
+        self._checked_at = 0.0
+        self._forced_at = 0.0
+        self._dir_mtime = None
+        self._lock = threading.RLock()
+        self.reloads = 0
+        self.unknown_kid = 0
+
+    def init_app(self, app):
+        self.algorithm = app.config.get('JWT_ALGORITHM', 'HS256')
+        if self.algorithm not in ASYMMETRIC_ALGORITHMS:
+            self.enabled = False
+            return
+
+        self.enabled = True
+        self.directory = app.config.get('JWT_KEYS_DIR') or os.path.join(app.instance_path, 'jwt_keys')
+        self.rsa_key_size = app.config.get('JWT_RSA_KEY_SIZE', 2048)
+        self.activation_delay = app.config.get('JWT_KEY_ACTIVATION_DELAY', 300)
+        self.refresh_interval = app.config.get('JWT_KEYS_REFRESH_INTERVAL', 60)
+        self.legacy_secret = app.config.get('JWT_SECRET_KEY') if app.config.get('JWT_ACCEPT_HS256', True) else None
+
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        self.load()
+        if self.active is None:
+            logger.warning("No %s signing key found in %s, generating one", self.algorithm, self.directory)
+            self.rotate()
+
+        # Header alg của token phải nằm trong danh sách này (HS256 chỉ khi còn chấp nhận token cũ)
+        app.config['JWT_DECODE_ALGORITHMS'] = list(ASYMMETRIC_ALGORITHMS) + (['HS256'] if self.legacy_secret else [])
+        metrics.register_stats('jwt_keys', self.stats)
+
+    def load(self) -> None:
+        """
+        Đọc lại toàn bộ key PEM trong thư mục và chọn key ký
+        """
+        keys = {}
+        for name in os.listdir(self.directory):
+            if not name.endswith('.pem'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                with open(path, 'rb') as f:
+                    private_key = serialization.load_pem_private_key(f.read(), password=None)
+                key = SigningKey(name[:-len('.pem')], private_key, os.path.getmtime(path))
+            except (OSError, ValueError) as e:
+                logger.error("Cannot load JWT key %s: %s", name, e)
+                continue
+            # Key RSA dùng được cho mọi thuật toán RS*/PS*: gắn theo thuật toán đang cấu hình
+            if key.algorithm == 'RS256' and self.algorithm in RSA_ALGORITHMS:
+                key.algorithm = self.algorithm
+            keys[key.kid] = key
+
+        with self._lock:
+            self.keys = keys
+            self._dir_mtime = os.path.getmtime(self.directory)
+            self._checked_at = time.monotonic()
+            self._select_active()
+            self._jwks = {'keys': [key.jwk() for key in sorted(keys.values(), key=lambda k: k.created)]}
+            self.etag = hashlib.sha256(json.dumps(self._jwks, sort_keys=True).encode('utf-8')).hexdigest()[:32]
+            self.reloads += 1
+
+    def _select_active(self) -> None:
+        candidates = sorted(
+            (key for key in self.keys.values() if key.algorithm == self.algorithm),
+            key=lambda k: k.created
+        )
+        if not candidates:
+            self.active = None
+            return
+        now = time.time()
+        published = [key for key in candidates if now - key.created >= self.activation_delay]
+        # Chưa key nào đủ tuổi (lần chạy đầu) -> dùng key cũ nhất
+        self.active = published[-1] if published else candidates[0]
+
+    def _maybe_reload(self) -> None:
+        if time.monotonic() - self._checked_at < self.refresh_interval:
+            return
+        with self._lock:
+            if time.monotonic() - self._checked_at < self.refresh_interval:
+                return
+            self._checked_at = time.monotonic()
+            try:
+                changed = os.path.getmtime(self.directory) != self._dir_mtime
+            except OSError:
+                changed = False
+            if changed:
+                self.load()
+            else:
+                # Key mới có thể vừa đủ tuổi để thành key ký
+                self._select_active()
+
+    def rotate(self, algorithm: Optional[str] = None) -> SigningKey:
+        """
+        Tạo key mới và ghi vào thư mục (0600). Key được công bố ngay ở JWKS,
+        và dùng để ký sau JWT_KEY_ACTIVATION_DELAY giây
+        """
+        algorithm = algorithm or self.algorithm
+        private_key = generate_private_key(algorithm, self.rsa_key_size)
+        kid = f"{datetime.utcnow().strftime('%Y%m%d%H%M%S')}-{secrets.token_hex(4)}"
+        path = os.path.join(self.directory, f"{kid}.pem")
+        pem = private_key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption()
+        )
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(pem)
+        logger.info("Generated JWT signing key %s (%s)", kid, algorithm)
+        self.load()
+        return self.keys[kid]
+
+    def prune(self, token_lifetime: float) -> List[str]:
+        """
+        Xóa các key đã thôi ký quá token_lifetime giây (mọi token do chúng ký
+        đều đã hết hạn). Key thôi ký khi key kế tiếp được kích hoạt
+        """
+        self.load()
+        now = time.time()
+        ordered = sorted(self.keys.values(), key=lambda k: k.created)
+        removed = []
+        for key, successor in zip(ordered, ordered[1:]):
+            if key is self.active:
+                continue
+            retired_at = successor.created + self.activation_delay
+            if now - retired_at < token_lifetime:
+                continue
+            os.remove(os.path.join(self.directory, f"{key.kid}.pem"))
+            removed.append(key.kid)
+        if removed:
+            self.load()
+        return removed
+
+    def signing_key(self) -> SigningKey:
+        self._maybe_reload()
+        return self.active
+
+    def verification_key(self, jwt_header: Dict[str, Any]):
+        """
+        Key để verify token theo header: kid -> public key; token HS256 cũ
+        không có kid -> JWT_SECRET_KEY (nếu còn chấp nhận)
+        """
+        alg = jwt_header.get('alg')
+        kid = jwt_header.get('kid')
+        if kid is None:
+            if alg == 'HS256' and self.legacy_secret:
+                return self.legacy_secret
+            raise pyjwt.InvalidTokenError('Token has no key id')
+
+        self._maybe_reload()
+        key = self.keys.get(kid)
+        if key is None:
+            # Key vừa được xoay ở worker khác: đọc lại thư mục (tối đa 1 lần/giây)
+            with self._lock:
+                if time.monotonic() - self._forced_at >= 1.0:
+                    self._forced_at = time.monotonic()
+                    self.load()
+                key = self.keys.get(kid)
+        if key is None:
+            self.unknown_kid += 1
+            raise pyjwt.InvalidTokenError('Unknown signing key')
+        # Không cho đổi thuật toán (vd. HS256 với public key làm secret)
+        if alg != key.algorithm:
+            raise pyjwt.InvalidTokenError('Token algorithm does not match signing key')
+        return key.public_key
+
+    def jwks(self) -> Dict[str, Any]:
+        self._maybe_reload()
+        return self._jwks
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'keys': len(self.keys),
+                'active_kid': self.active.kid if self.active else None,
+                'active_age_seconds': time.time() - self.active.created if self.active else 0,
+                'reloads': self.reloads,
+                'unknown_kid': self.unknown_kid
+            }
+
+
+key_ring = KeyRing()
\ No newline at end of file
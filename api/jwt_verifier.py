@@ -0,0 +1,136 @@
+"""
+Verify access token của API này ở service khác mà không cần gọi lại API
+hay chia sẻ secret: public key được lấy từ /api/auth/.well-known/jwks.json
+và cache theo Cache-Control. Chỉ phụ thuộc PyJWT + cryptography.
+
+    verifier = JWKSVerifier('https://auth.example.com/api/auth/.well-known/jwks.json')
+    claims = verifier.verify(token)     # jwt.InvalidTokenError nếu không hợp lệ
+    user_id = claims['sub']
+
+Lưu ý: token bị thu hồi (logout / deactivate) chỉ được API này kiểm tra;
+service khác chỉ kiểm tra chữ ký và thời hạn.
+"""
+import json
+import logging
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+from typing import Any, Dict, Sequence
+
+import jwt
+from jwt.algorithms import ECAlgorithm, OKPAlgorithm, RSAAlgorithm
+
+logger = logging.getLogger(__name__)
+
+_MAX_AGE_RE = re.compile(r'max-age=(\d+)')
+
+_KEY_TYPES = {
+    'RSA': RSAAlgorithm,
+    'EC': ECAlgorithm,
+    'OKP': OKPAlgorithm
+}
+
+
+class JWKSVerifier:
+    """
+    Cache public key theo kid. JWKS được tải lại khi hết max-age, hoặc khi
+    gặp kid lạ (key vừa xoay) nhưng không quá một lần mỗi min_refresh_interval giây
+    """
+
+    def __init__(
+        self,
+        jwks_url: str,
+        algorithms: Sequence[str] = ('RS256', 'RS384', 'RS512', 'PS256', 'PS384', 'PS512', 'ES256', 'EdDSA'),
+        leeway: float = 0,
+        default_max_age: float = 300,
+        min_refresh_interval: float = 30,
+        timeout: float = 5
+    ):
+        self.jwks_url = jwks_url
+        self.algorithms = tuple(algorithms)
+        self.leeway = leeway
+        self.default_max_age = default_max_age
+        self.min_refresh_interval = min_refresh_interval
+        self.timeout = timeout
+        self._keys: Dict[str, Any] = {}
+        self._key_algorithms: Dict[str, str] = {}
+        self._expires_at = 0.0
+        self._fetched_at = 0.0
+        self._etag = None
+        self._lock = threading.Lock()
+        self.fetches = 0
+
+    def verify(self, token: str) -> Dict[str, Any]:
+        """
+        Kiểm tra chữ ký + exp của token, trả về claims
+        """
+        header = jwt.get_unverified_header(token)
+        kid = header.get('kid')
+        alg = header.get('alg')
+        if not kid:
+            raise jwt.InvalidTokenError('Token has no key id')
+        if alg not in self.algorithms:
+            raise jwt.InvalidAlgorithmError(f'Algorithm {alg} is not allowed')
+
+        key = self._get_key(kid)
+        if self._key_algorithms.get(kid, alg) != alg:
+            raise jwt.InvalidTokenError('Token algorithm does not match signing key')
+        return jwt.decode(token, key, algorithms=[alg], leeway=self.leeway)
+
+    def _get_key(self, kid: str):
+        now = time.monotonic()
+        key = self._keys.get(kid)
+        if key is not None and now < self._expires_at:
+            return key
+
+        with self._lock:
+            key = self._keys.get(kid)
+            expired = time.monotonic() >= self._expires_at
+            if expired or (key is None and time.monotonic() - self._fetched_at >= self.min_refresh_interval):
+                try:
+                    self._refresh()
+                except Exception as e:
+                    # JWKS tạm thời không tải được -> dùng tiếp key đã cache
+                    if not self._keys:
+                        raise jwt.InvalidTokenError(f'Cannot fetch JWKS: {e}') from e
+                    logger.warning("JWKS refresh failed, using cached keys: %s", e)
+                key = self._keys.get(kid)
+        if key is None:
+            raise jwt.InvalidTokenError('Unknown signing key')
+        return key
+
+    def _refresh(self) -> None:
+        request = urllib.request.Request(self.jwks_url, headers={'Accept': 'application/json'})
+        if self._etag and self._keys:
+            request.add_header('If-None-Match', self._etag)
+        self._fetched_at = time.monotonic()
+        self.fetches += 1
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                body = response.read()
+                headers = response.headers
+        except urllib.error.HTTPError as e:
+            if e.code != 304:
+                raise
+            self._expires_at = time.monotonic() + self._max_age(e.headers)
+            return
+
+        keys, algorithms = {}, {}
+        for jwk in json.loads(body).get('keys', []):
+            kid = jwk.get('kid')
+            key_type = _KEY_TYPES.get(jwk.get('kty'))
+            if not kid or key_type is None or jwk.get('use', 'sig') != 'sig':
+                continue
+            keys[kid] = key_type.from_jwk(json.dumps(jwk))
+            if jwk.get('alg'):
+                algorithms[kid] = jwk['alg']
+        self._keys = keys
+        self._key_algorithms = algorithms
+        self._etag = headers.get('ETag')
+        self._expires_at = time.monotonic() + self._max_age(headers)
+
+    def _max_age(self, headers) -> float:
+        match = _MAX_AGE_RE.search(headers.get('Cache-Control') or '')
+        return float(match.group(1)) if match else self.default_max_age
\ No newline at end of file
@@ -0,0 +1,184 @@
+import atexit
+import json
+import logging
+import queue
+import random
+import re
+import sys
+import uuid
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+from flask import g, has_app_context, request
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+
+# Token / mật khẩu không bao giờ được ghi ra log
+_REDACTIONS = [
+    (re.compile(r'(?i)(bearer\s+)[A-Za-z0-9\-_.=]+'), r'\1[REDACTED]'),
+    (re.compile(r'eyJ[A-Za-z0-9\-_=]+\.[A-Za-z0-9\-_=]+\.[A-Za-z0-9\-_.+/=]*'), '[REDACTED_JWT]'),
+    (re.compile(r'sk-[A-Za-z0-9]{8,}'), '[REDACTED_KEY]'),
+    (re.compile(
+        r'''(?i)(["']?(?:password|passwd|pwd|token|secret|api_key|authorization)["']?\s*[:=]\s*)(["']?)[^"',\s}]+'''
+    ), r'\1\2[REDACTED]'),
+]
+
+_listener: Optional[QueueListener] = None
+
+
+def redact(text: str) -> str:
+    for pattern, replacement in _REDACTIONS:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+class RequestContextFilter(logging.Filter):
+    """
+    Gắn request_id của request hiện tại vào record (chạy trên thread của
+    request, trước khi record được đưa vào queue). Worker thread chỉ có app
+    context (vd. item của batch) đọc request_id đã gắn lại vào g
+    """
+
+    def filter(self, record):
+        if not hasattr(record, 'request_id'):
+            record.request_id = g.get('request_id') if has_app_context() else None
+        return True
+
+
+class DebugSampler(logging.Filter):
+    """
+    Chỉ giữ lại một tỉ lệ các dòng DEBUG (hot path), mọi level khác giữ nguyên
+    """
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or self.rate >= 1.0:
+            return True
+        return random.random() < self.rate
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    QueueHandler không format trên thread gọi: message được ghép với args
+    (lazy %-format) ở thread của QueueListener. Queue đầy thì bỏ dòng log
+    thay vì chặn request
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    Một dòng JSON cho mỗi record, đã redact token / mật khẩu
+    """
+
+    def format(self, record):
+        payload = {
+            'timestamp': datetime.utcfromtimestamp(record.created).isoformat(timespec='milliseconds') + 'Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': redact(record.getMessage()),
+            'request_id': getattr(record, 'request_id', None),
+            'thread': record.threadName
+        }
+        if record.exc_info:
+            payload['exception'] = redact(self.formatException(record.exc_info))
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class RedactingFormatter(logging.Formatter):
+    """
+    Formatter dạng text (dùng khi dev), cũng redact token / mật khẩu
+    """
+
+    def format(self, record):
+        if not hasattr(record, 'request_id'):
+            record.request_id = None
+        return redact(super().format(record))
+
+
+def _assign_request_id():
+    g.request_id = request.headers.get(REQUEST_ID_HEADER) or uuid.uuid4().hex
+
+
+def _return_request_id(response):
+    request_id = g.get('request_id')
+    if request_id:
+        response.headers.setdefault(REQUEST_ID_HEADER, request_id)
+    return response
+
+
+def _stop_listener() -> None:
+    """
+    Ghi nốt các dòng còn trong queue khi tắt process
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def configure_logging(app) -> None:
+    """
+    Cấu hình logging tập trung từ Config: các module chỉ gọi
+    logging.getLogger(__name__), handler duy nhất là QueueHandler gắn vào
+    root logger, việc format / ghi ra stream do QueueListener đảm nhận
+    """
+    global _listener
+
+    level = logging.getLevelName(str(app.config.get('LOG_LEVEL', 'INFO')).upper())
+    if not isinstance(level, int):
+        level = logging.INFO
+
+    if app.config.get('LOG_FORMAT', 'json') == 'json':
+        formatter = JSONFormatter()
+    else:
+        formatter = RedactingFormatter(
+            '%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s'
+        )
+
+    stream_handler = logging.StreamHandler(sys.stderr)
+    stream_handler.setFormatter(formatter)
+
+    queue_handler = NonBlockingQueueHandler(queue.Queue(app.config.get('LOG_QUEUE_SIZE', 10000)))
+    queue_handler.addFilter(RequestContextFilter())
+    queue_handler.addFilter(DebugSampler(app.config.get('LOG_DEBUG_SAMPLE_RATE', 1.0)))
+
+    if _listener is None:
+        atexit.register(_stop_listener)
+    else:
+        _listener.stop()
+    _listener = QueueListener(queue_handler.queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, NonBlockingQueueHandler):
+            root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    # app.logger (tên 'api') là logger cha của mọi module trong package:
+    # đặt level tường minh để Flask không tự hạ xuống DEBUG khi DEBUG=True,
+    # và bỏ default handler để không ghi mỗi dòng hai lần
+    from flask.logging import default_handler
+    app.logger.removeHandler(default_handler)
+    app.logger.setLevel(level)
+
+    app.before_request(_assign_request_id)
+    app.after_request(_return_request_id)
\ No newline at end of file
@@ -0,0 +1,338 @@
+import bisect
+import hmac
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+HTTP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SQL_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+UPSTREAM_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 15.0, 30.0, 60.0)
+TOKEN_BUCKETS = (16, 64, 256, 512, 1024, 2048, 4096, 8192, 16384)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[Any]) -> str:
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    """
+    Counter có label, chỉ tăng
+    """
+
+    type = 'counter'
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            values = list(self._values.items())
+        for labelvalues, value in values:
+            yield f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}"
+
+
+class Histogram:
+    """
+    Histogram có label với bucket cố định. observe() chỉ tốn một bisect và
+    cộng vài số dưới lock, đủ rẻ để bật thường trực
+    """
+
+    type = 'histogram'
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = HTTP_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labelvalues -> [count theo bucket (không cộng dồn), sum, count]
+        self._values: Dict[Tuple, List] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labelvalues) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labelvalues)
+            if state is None:
+                state = self._values[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            values = [(labels, list(state[0]), state[1], state[2]) for labels, state in self._values.items()]
+        names = self.labelnames + ('le',)
+        for labelvalues, counts, total, count in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(names, labelvalues + (_format_value(bound),))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, labelvalues)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {count}"
+
+
+class Gauge:
+    """
+    Gauge đọc giá trị qua callback lúc scrape (không tốn gì trên hot path).
+    Callback trả về một số, hoặc dict {labelvalues tuple: số}
+    """
+
+    type = 'gauge'
+
+    def __init__(self, name: str, help: str, func: Callable[[], Any], labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.func = func
+        self.labelnames = tuple(labelnames)
+
+    def samples(self) -> Iterable[str]:
+        value = self.func()
+        if isinstance(value, dict):
+            for labelvalues, item in value.items():
+                if not isinstance(labelvalues, tuple):
+                    labelvalues = (labelvalues,)
+                yield f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(item)}"
+        elif value is not None:
+            yield f"{self.name} {_format_value(value)}"
+
+
+class Metrics:
+    """
+    Registry metrics + Flask hooks, xuất ra /metrics theo định dạng text của Prometheus
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.token = ''
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, Any] = {}
+        self._stats: Dict[str, Tuple[str, Callable[[], Dict[str, Any]]]] = {}
+
+        self.http_requests = self.counter(
+            'http_requests_total', 'HTTP requests by route and status',
+            ('method', 'route', 'status')
+        )
+        self.http_latency = self.histogram(
+            'http_request_duration_seconds', 'HTTP request latency by route',
+            ('method', 'route'), HTTP_BUCKETS
+        )
+        self.db_latency = self.histogram(
+            'db_query_duration_seconds', 'SQL statement latency by route',
+            ('route',), SQL_BUCKETS
+        )
+        self.db_request_time = self.histogram(
+            'http_request_db_seconds', 'Total SQL time spent per HTTP request',
+            ('route',), SQL_BUCKETS + (2.5, 5.0)
+        )
+        self.upstream_latency = self.histogram(
+            'openai_request_duration_seconds', 'OpenAI ChatCompletion latency by model',
+            ('model', 'outcome'), UPSTREAM_BUCKETS
+        )
+        self.upstream_tokens = self.histogram(
+            'openai_tokens', 'OpenAI tokens per request by model',
+            ('model', 'kind'), TOKEN_BUCKETS
+        )
+
+    def init_app(self, app):
+        self.enabled = app.config.get('METRICS_ENABLED', False)
+        if not self.enabled:
+            return
+        self.token = app.config.get('METRICS_TOKEN') or ''
+        if not self.token:
+            logger.warning("Metrics endpoint is enabled without METRICS_TOKEN; restrict access to it")
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.add_url_rule(
+            app.config.get('METRICS_PATH', '/metrics'), 'metrics',
+            self._metrics_view, methods=['GET']
+        )
+
+        if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+            event.listen(Engine, 'handle_error', _handle_error)
+
+        from .database import db
+        with app.app_context():
+            pool = db.engine.pool
+        self.register_gauge('db_pool_checked_out', 'DB connections currently checked out',
+                            lambda: pool.checkedout() if hasattr(pool, 'checkedout') else None)
+        self.register_gauge('db_pool_size', 'DB connection pool size',
+                            lambda: pool.size() if hasattr(pool, 'size') else None)
+
+    def _register(self, metric):
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = HTTP_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def register_gauge(self, name: str, help: str, func: Callable[[], Any], labelnames: Sequence[str] = ()) -> Gauge:
+        """
+        Đăng ký gauge đọc qua callback (gọi lại với cùng name sẽ thay thế gauge cũ)
+        """
+        return self._register(Gauge(name, help, func, labelnames))
+
+    def register_stats(self, prefix: str, func: Callable[[], Dict[str, Any]], help: Optional[str] = None) -> None:
+        """
+        Xuất mọi field dạng số trong dict của func() (vd. cache.stats) thành
+        gauge <prefix>_<field>. Dùng cho cache, hàng đợi, pool của các component
+        """
+        with self._lock:
+            self._stats[prefix] = (help or f"{prefix} stats", func)
+
+    def observe_upstream(self, model: str, elapsed: float, outcome: str = 'success', usage: Any = None) -> None:
+        """
+        Ghi latency (và token nếu có) của một lời gọi OpenAI
+        """
+        self.upstream_latency.observe(elapsed, model, outcome)
+        if usage is None:
+            return
+        for kind in ('prompt_tokens', 'completion_tokens', 'total_tokens'):
+            value = usage.get(kind) if isinstance(usage, dict) else getattr(usage, kind, None)
+            if value is not None:
+                self.upstream_tokens.observe(value, model, kind[:-len('_tokens')])
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+            stats = list(self._stats.items())
+
+        for metric in metrics:
+            try:
+                samples = list(metric.samples())
+            except Exception as e:
+                logger.error("Metric %s collection failed: %s", metric.name, e)
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(samples)
+
+        for prefix, (help, func) in stats:
+            try:
+                values = func()
+            except Exception as e:
+                logger.error("Stats %s collection failed: %s", prefix, e)
+                continue
+            for key, value in values.items():
+                if isinstance(value, bool):
+                    value = int(value)
+                if not isinstance(value, (int, float)):
+                    continue
+                name = f"{prefix}_{key}"
+                lines.append(f"# HELP {name} {help}: {key}")
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {_format_value(value)}")
+
+        return '\n'.join(lines) + '\n'
+
+    def _metrics_view(self):
+        if self.token:
+            expected = f'Bearer {self.token}'
+            provided = request.headers.get('Authorization', '')
+            if not hmac.compare_digest(provided.encode(), expected.encode()):
+                return Response('Unauthorized\n', status=401, content_type=CONTENT_TYPE,
+                                headers={'WWW-Authenticate': 'Bearer'})
+        return Response(self.render(), content_type=CONTENT_TYPE)
+
+    def _before_request(self):
+        g._metrics_start = time.perf_counter()
+        # List để generator của response stream vẫn cộng dồn được sau after_request
+        g._metrics_db_time = [0.0]
+
+    def _after_request(self, response):
+        start = g.pop('_metrics_start', None)
+        if start is None:
+            return response
+        method = request.method
+        route = _route()
+        status = str(response.status_code)
+        db_time = g.get('_metrics_db_time') or [0.0]
+
+        def record():
+            self.http_latency.observe(time.perf_counter() - start, method, route)
+            self.http_requests.inc(method, route, status)
+            self.db_request_time.observe(db_time[0], route)
+
+        # Response stream: đo tới khi gửi xong body
+        if response.is_streamed:
+            response.call_on_close(record)
+        else:
+            record()
+        return response
+
+
+def _route() -> str:
+    """
+    Label route theo URL rule (vd. /api/history/<int:session_id>) để giới hạn cardinality
+    """
+    if not has_request_context():
+        return 'background'
+    rule = request.url_rule
+    return rule.rule if rule is not None else 'unmatched'
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('_metrics_query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('_metrics_query_start')
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    metrics.db_latency.observe(elapsed, _route())
+    if has_request_context() and '_metrics_db_time' in g:
+        g._metrics_db_time[0] += elapsed
+
+
+def _handle_error(exception_context):
+    # Statement lỗi không tới after_cursor_execute -> bỏ thời điểm bắt đầu
+    conn = exception_context.connection
+    if conn is not None:
+        starts = conn.info.get('_metrics_query_start')
+        if starts:
+            starts.pop()
+
+
+metrics = Metrics()
\ No newline at end of file
@@ -1,6 +1,8 @@
 from .database import db
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import event
+from .passwords import password_hasher
+from .compression import content_hash, compress_text, decompress_text, should_compress
 from datetime import datetime
 
 class User(UserMixin, db.Model):
@@ -11,20 +13,247 @@ class User(UserMixin, db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     is_active = db.Column(db.Boolean, default=True)
     last_login = db.Column(db.DateTime)
+    # Retention riêng cho user (None = dùng cấu hình chung)
+    retention_days = db.Column(db.Integer)
+    max_sessions = db.Column(db.Integer)
     code_sessions = db.relationship('CodeSession', backref='user', lazy=True)
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return password_hasher.verify(self.password_hash, password)
+
+    def password_needs_rehash(self):
+        return password_hasher.needs_rehash(self.password_hash)
+
+class ContentBlob(db.Model):
+    """
+    Nội dung (code_context) lưu theo hash, nén zlib, mỗi nội dung chỉ lưu một lần
+    """
+    hash = db.Column(db.String(64), primary_key=True)
+    data = db.Column(db.LargeBinary, nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Lần cuối một session mới tham chiếu blob: GC chỉ xóa blob không dùng quá BLOB_GC_GRACE
+    last_used_at = db.Column(db.DateTime)
 
 class CodeSession(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     query = db.Column(db.Text, nullable=False)
+    # Cột text cũ: chỉ dùng cho dữ liệu chưa backfill hoặc nội dung ngắn
+    raw_code_context = db.Column('code_context', db.Text)
+    raw_response = db.Column('response', db.Text)
+    context_hash = db.Column(db.String(64), db.ForeignKey('content_blob.hash'), index=True)
+    response_data = db.Column(db.LargeBinary)
+    response_size = db.Column(db.Integer)
+    language = db.Column(db.String(50))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    tokens_used = db.Column(db.Integer)
+    model = db.Column(db.String(50))
+    # SimHash 64 bit (có dấu) của query / code_context cho index near-duplicate
+    query_simhash = db.Column(db.BigInteger)
+    context_simhash = db.Column(db.BigInteger)
+    context_blob = db.relationship('ContentBlob', lazy=True)
+
+    @property
+    def code_context(self):
+        pending = getattr(self, '_pending_context', None)
+        if pending is not None:
+            return pending
+        if self.context_hash:
+            return decompress_text(self.context_blob.data)
+        return self.raw_code_context
+
+    @code_context.setter
+    def code_context(self, value):
+        self._pending_context = None
+        if not should_compress(value):
+            self.raw_code_context = value
+            self.context_hash = None
+            return
+        # Blob được tạo (nếu chưa có) trong before_flush
+        self.raw_code_context = None
+        self.context_hash = content_hash(value)
+        self._pending_context = value
+
+    @property
+    def response(self):
+        if self.response_data is not None:
+            return decompress_text(self.response_data)
+        return self.raw_response
+
+    @response.setter
+    def response(self, value):
+        if not should_compress(value):
+            self.raw_response = value
+            self.response_data = None
+            self.response_size = None
+            return
+        self.raw_response = None
+        self.response_data = compress_text(value)
+        self.response_size = len(value.encode('utf-8'))
+
+# Index phục vụ keyset pagination của /history (và quét theo user của export / retention)
+db.Index(
+    'ix_code_session_user_created',
+    CodeSession.user_id,
+    CodeSession.created_at.desc(),
+    CodeSession.id.desc()
+)
+
+@event.listens_for(db.session, 'before_flush')
+def _store_context_blobs(session, flush_context, instances):
+    """
+    Tạo ContentBlob cho các code_context mới, mỗi hash chỉ một lần
+    """
+    pending = {}
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, CodeSession) and getattr(obj, '_pending_context', None) is not None:
+            pending.setdefault(obj.context_hash, obj._pending_context)
+            obj._pending_context = None
+    if not pending:
+        return
+
+    now = datetime.utcnow()
+    existing = {
+        row.hash for row in session.query(ContentBlob.hash)
+        .filter(ContentBlob.hash.in_(list(pending)))
+    }
+    if existing:
+        # Đánh dấu blob đang được dùng lại (cùng transaction với insert session):
+        # delete_orphan_blobs kiểm tra lại last_used_at nên không xóa blob này
+        session.execute(
+            ContentBlob.__table__.update()
+            .where(ContentBlob.__table__.c.hash.in_(list(existing)))
+            .values(last_used_at=now)
+        )
+    rows = [
+        {
+            'hash': blob_hash,
+            'data': compress_text(text),
+            'size': len(text.encode('utf-8')),
+            'created_at': now,
+            'last_used_at': now
+        }
+        for blob_hash, text in pending.items() if blob_hash not in existing
+    ]
+    if rows:
+        # OR IGNORE: worker khác có thể vừa lưu cùng nội dung
+        session.execute(
+            ContentBlob.__table__.insert().prefix_with('OR IGNORE', dialect='sqlite'),
+            rows
+        )
+
+class ResponseCacheEntry(db.Model):
+    """
+    Tầng cache dùng chung (persistent) cho response của CodeAssistant
+    """
+    cache_key = db.Column(db.String(64), primary_key=True)
+    model = db.Column(db.String(50))
+    response = db.Column(db.Text, nullable=False)
+    tokens_used = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, index=True)
+
+class CodeAssistJob(db.Model):
+    """
+    Job xử lý code-assist bất đồng bộ (chạy trong worker pool)
+    """
+    id = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    status = db.Column(db.String(20), default='queued', nullable=False)
+    query = db.Column(db.Text, nullable=False)
     code_context = db.Column(db.Text)
-    response = db.Column(db.Text)
     language = db.Column(db.String(50))
+    use_cache = db.Column(db.Boolean, default=True)
+    session_id = db.Column(db.Integer, db.ForeignKey('code_session.id'))
+    error = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    tokens_used = db.Column(db.Integer)
\ No newline at end of file
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'language': self.language,
+            'session_id': self.session_id,
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+class RevokedToken(db.Model):
+    """
+    Token đã bị thu hồi (logout / vô hiệu hóa tài khoản), khóa theo jti
+    """
+    jti = db.Column(db.String(64), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
+    revoked_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, index=True)
+
+class AuthInvalidation(db.Model):
+    """
+    Log các thay đổi trạng thái auth để các worker khác đồng bộ cache
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)
+    user_id = db.Column(db.Integer)
+    jti = db.Column(db.String(64))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+class RateLimitBucket(db.Model):
+    """
+    Token bucket dùng chung giữa các worker (rate limit)
+    """
+    key = db.Column(db.String(255), primary_key=True)
+    tokens = db.Column(db.Float, nullable=False)
+    updated_at = db.Column(db.Float, nullable=False)
+
+class UsageRollup(db.Model):
+    """
+    Tổng token / số request theo (user, ngày, model), cập nhật cùng transaction
+    với việc insert CodeSession
+    """
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    model = db.Column(db.String(50), primary_key=True, default='')
+    tokens = db.Column(db.Integer, nullable=False, default=0)
+    requests = db.Column(db.Integer, nullable=False, default=0)
+
+class PurgeRequest(db.Model):
+    """
+    Yêu cầu xóa lịch sử, được xử lý nền theo từng batch (có thể chạy tiếp sau khi restart)
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    max_session_id = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(20), default='pending', nullable=False, index=True)
+    deleted = db.Column(db.Integer, default=0, nullable=False)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    # Cập nhật sau mỗi batch: purge đang chạy lâu không bị coi là bị bỏ dở
+    heartbeat_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'deleted': self.deleted,
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+class IdAllocator(db.Model):
+    """
+    Cấp phát id theo block cho các bảng cần biết id trước khi insert (write-behind)
+    """
+    name = db.Column(db.String(50), primary_key=True)
+    next_id = db.Column(db.Integer, nullable=False)
\ No newline at end of file
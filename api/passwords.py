@@ -0,0 +1,107 @@
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Optional
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+def _hash_password(password: str, method: str) -> str:
+    return generate_password_hash(password, method=method)
+
+
+def _verify_password(pwhash: str, password: str) -> bool:
+    return check_password_hash(pwhash, password)
+
+
+class PasswordHasher:
+    """
+    Hash / verify password trong process pool riêng để login burst
+    không chiếm hết CPU của worker xử lý request
+    """
+
+    def __init__(self):
+        self.algorithm = Config.PASSWORD_HASH_ALGORITHM
+        self.iterations = Config.PASSWORD_HASH_ITERATIONS
+        self.workers = 0
+        self.executor = None
+        self._dummy_hash = None
+        self._lock = threading.Lock()
+
+    @property
+    def method(self) -> str:
+        return f"{self.algorithm}:{self.iterations}"
+
+    def init_app(self, app):
+        self.algorithm = app.config.get('PASSWORD_HASH_ALGORITHM', self.algorithm)
+        self.iterations = app.config.get('PASSWORD_HASH_ITERATIONS', self.iterations)
+        self.workers = app.config.get('PASSWORD_HASH_WORKERS', 0)
+        self._dummy_hash = None
+        if self.workers > 0 and self.executor is None:
+            # Start method mặc định của nền tảng (fork / spawn trên Windows, macOS),
+            # hàm chạy trong pool là hàm cấp module nên pickle được với mọi method
+            start_method = app.config.get('PASSWORD_HASH_START_METHOD') or None
+            try:
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context(start_method)
+                )
+                # Khởi động worker ngay, trước khi app tạo thêm thread
+                self.executor.submit(int).result()
+            except (OSError, ValueError, BrokenProcessPool) as e:
+                logger.warning("Password hashing pool unavailable, hashing in-process: %s", e)
+                if self.executor is not None:
+                    self.executor.shutdown(wait=False)
+                self.executor = None
+        self._dummy_hash = self.hash('dummy-password')
+
+    def hash(self, password: str) -> str:
+        if self.executor is None:
+            return _hash_password(password, self.method)
+        return self.executor.submit(_hash_password, password, self.method).result()
+
+    def hash_many(self, passwords: List[str]) -> List[str]:
+        """
+        Hash nhiều password song song trên mọi worker của pool (import user hàng loạt)
+        """
+        if self.executor is None or len(passwords) < 2:
+            return [_hash_password(password, self.method) for password in passwords]
+        chunksize = max(1, len(passwords) // (self.workers * 4))
+        return list(self.executor.map(
+            _hash_password, passwords, [self.method] * len(passwords), chunksize=chunksize
+        ))
+
+    def verify(self, pwhash: Optional[str], password: str) -> bool:
+        if not pwhash:
+            self.dummy_verify(password)
+            return False
+        if self.executor is None:
+            return _verify_password(pwhash, password)
+        return self.executor.submit(_verify_password, pwhash, password).result()
+
+    def needs_rehash(self, pwhash: Optional[str]) -> bool:
+        """
+        Hash được tạo bằng thuật toán / cost cũ thì cần hash lại
+        """
+        if not pwhash:
+            return True
+        return pwhash.split('$', 1)[0] != self.method
+
+    def dummy_verify(self, password: str) -> None:
+        """
+        Verify với hash giả để username không tồn tại tốn cùng thời gian
+        """
+        with self._lock:
+            if self._dummy_hash is None:
+                self._dummy_hash = _hash_password('dummy-password', self.method)
+            dummy_hash = self._dummy_hash
+        self.verify(dummy_hash, password)
+
+
+password_hasher = PasswordHasher()
\ No newline at end of file
@@ -0,0 +1,211 @@
+import codecs
+import csv
+import json
+import logging
+import time
+from datetime import datetime
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy.exc import IntegrityError
+
+from .database import db
+from .models import User
+from .passwords import password_hasher
+
+logger = logging.getLogger(__name__)
+
+USER_FIELDS = ('username', 'email', 'password')
+CHUNK_SIZE = 64 * 1024
+_MAX_LENGTHS = {
+    'username': User.__table__.c.username.type.length,
+    'email': User.__table__.c.email.type.length
+}
+
+
+def duplicate_user_error(e: IntegrityError) -> str:
+    """
+    Thông báo lỗi cho vi phạm unique constraint của bảng user
+    (SQLite / PostgreSQL / MySQL đều có tên cột trong message)
+    """
+    message = str(getattr(e, 'orig', e)).lower()
+    if 'username' in message:
+        return 'Username already exists'
+    if 'email' in message:
+        return 'Email already exists'
+    return 'User already exists'
+
+
+def iter_lines(stream: BinaryIO, chunk_size: int = CHUNK_SIZE) -> Iterator[str]:
+    """
+    Đọc stream nhị phân (UTF-8) theo chunk cố định và yield từng dòng (giữ ký tự xuống dòng),
+    bộ nhớ chỉ phụ thuộc độ dài dòng chứ không phải kích thước upload
+    """
+    decoder = codecs.getincrementaldecoder('utf-8-sig')(errors='replace')
+    pending = ''
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        lines = (pending + decoder.decode(chunk)).split('\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line + '\n'
+    pending += decoder.decode(b'', final=True)
+    if pending:
+        yield pending
+
+
+def parse_users(lines: Iterable[str], data_format: str) -> Iterator[Tuple[int, Optional[Dict[str, Any]], Optional[str]]]:
+    """
+    Đọc user từ các dòng CSV (có header) hoặc NDJSON (file text, iter_lines(...)).
+    Yield (số dòng, record, lỗi) với record = None nếu dòng không đọc được
+    """
+    if data_format == 'csv':
+        reader = csv.DictReader(lines)
+        for record in reader:
+            yield reader.line_num, record, None
+        return
+
+    for line_no, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield line_no, None, f'Invalid JSON: {e}'
+            continue
+        if not isinstance(record, dict):
+            yield line_no, None, 'Each line must be a JSON object'
+            continue
+        yield line_no, record, None
+
+
+def _validate(record: Dict[str, Any]) -> Optional[str]:
+    for field in USER_FIELDS:
+        value = record.get(field)
+        if not isinstance(value, str) or not value.strip():
+            return f'{field} is required'
+    for field, length in _MAX_LENGTHS.items():
+        if len(record[field]) > length:
+            return f'{field} is longer than {length} characters'
+    return None
+
+
+class UserImport:
+    """
+    Tạo user hàng loạt: mỗi batch kiểm tra username / email đã tồn tại bằng
+    một query, hash password song song trên process pool rồi insert một lần.
+    Batch lỗi (vd. bị worker khác insert trùng) được insert lại từng dòng
+    """
+
+    def __init__(self, batch_size: int = 200):
+        self.batch_size = batch_size
+        self.processed = 0
+        self.created = 0
+        self.failed = 0
+        self._usernames = set()
+        self._emails = set()
+
+    def run(self, rows: Iterable[Tuple[int, Optional[Dict[str, Any]], Optional[str]]]) -> Iterator[Dict[str, Any]]:
+        """
+        Yield event: 'error' cho từng dòng lỗi, 'progress' sau mỗi batch, 'done' ở cuối
+        """
+        started = time.monotonic()
+        batch = []
+        for line_no, record, error in rows:
+            self.processed += 1
+            error = error or _validate(record)
+            if error is None:
+                error = self._check_duplicate_in_file(record)
+            if error is not None:
+                yield self._error(line_no, record, error)
+                continue
+            batch.append((line_no, record))
+            if len(batch) >= self.batch_size:
+                yield from self._import_batch(batch)
+                batch = []
+                yield self._progress('progress', started)
+        if batch:
+            yield from self._import_batch(batch)
+        yield self._progress('done', started)
+
+    def _check_duplicate_in_file(self, record: Dict[str, Any]) -> Optional[str]:
+        if record['username'] in self._usernames:
+            return 'Duplicate username in import'
+        if record['email'] in self._emails:
+            return 'Duplicate email in import'
+        self._usernames.add(record['username'])
+        self._emails.add(record['email'])
+        return None
+
+    def _import_batch(self, batch: List[Tuple[int, Dict[str, Any]]]) -> Iterator[Dict[str, Any]]:
+        # User đã có sẵn: báo lỗi trước khi tốn CPU hash password
+        usernames = {record['username'] for _, record in batch}
+        emails = {record['email'] for _, record in batch}
+        existing = db.session.query(User.username, User.email)\
+            .filter(db.or_(User.username.in_(usernames), User.email.in_(emails)))\
+            .all()
+        # Không giữ transaction đọc trong lúc hash (có thể mất vài giây)
+        db.session.rollback()
+        taken_usernames = {row.username for row in existing}
+        taken_emails = {row.email for row in existing}
+
+        pending = []
+        for line_no, record in batch:
+            if record['username'] in taken_usernames:
+                yield self._error(line_no, record, 'Username already exists')
+            elif record['email'] in taken_emails:
+                yield self._error(line_no, record, 'Email already exists')
+            else:
+                pending.append((line_no, record))
+        if not pending:
+            return
+
+        hashes = password_hasher.hash_many([record['password'] for _, record in pending])
+        now = datetime.utcnow()
+        values = [{
+            'username': record['username'],
+            'email': record['email'],
+            'password_hash': pwhash,
+            'created_at': now,
+            'is_active': True
+        } for (_, record), pwhash in zip(pending, hashes)]
+
+        insert = User.__table__.insert()
+        try:
+            db.session.execute(insert, values)
+            db.session.commit()
+            self.created += len(values)
+            return
+        except IntegrityError as e:
+            logger.warning("User import batch conflicted, retrying rows one by one: %s", e)
+            db.session.rollback()
+
+        for (line_no, record), row in zip(pending, values):
+            try:
+                db.session.execute(insert, row)
+                db.session.commit()
+                self.created += 1
+            except IntegrityError as e:
+                db.session.rollback()
+                yield self._error(line_no, record, duplicate_user_error(e))
+
+    def _error(self, line_no: int, record: Optional[Dict[str, Any]], error: str) -> Dict[str, Any]:
+        self.failed += 1
+        username = record.get('username') if isinstance(record, dict) else None
+        return {'type': 'error', 'line': line_no, 'username': username, 'error': error}
+
+    def _progress(self, event_type: str, started: float) -> Dict[str, Any]:
+        elapsed = time.monotonic() - started
+        return {
+            'type': event_type,
+            'processed': self.processed,
+            'created': self.created,
+            'failed': self.failed,
+            'elapsed': round(elapsed, 3),
+            'users_per_second': round(self.created / elapsed, 1) if elapsed else 0.0
+        }
+
+
+def import_users(lines: Iterable[str], data_format: str, batch_size: int = 200) -> Iterator[Dict[str, Any]]:
+    return UserImport(batch_size=batch_size).run(parse_users(lines, data_format))
\ No newline at end of file
@@ -0,0 +1,306 @@
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from typing import Callable, Dict, Optional, Tuple
+
+from flask import current_app, has_app_context, jsonify, request
+
+from .database import db
+from .metrics import metrics
+from .models import RateLimitBucket
+
+logger = logging.getLogger(__name__)
+
+PERIODS = {
+    'second': 1,
+    'minute': 60,
+    'hour': 3600,
+    'day': 86400
+}
+
+
+def parse_limit(spec: str) -> Tuple[float, float]:
+    """
+    Chuyển '20/minute' thành (capacity, rate token/giây)
+    """
+    amount, _, period = spec.partition('/')
+    capacity = float(amount)
+    seconds = PERIODS[period.strip().lower().rstrip('s') or 'second']
+    return capacity, capacity / seconds
+
+
+class RateLimiter:
+    """
+    Rate limit theo token bucket. Mặc định lưu trong process (memory),
+    storage='database' dùng bảng RateLimitBucket với UPDATE nguyên tử
+    để chia sẻ giữa nhiều worker.
+    Key có thể do client chọn (username khi login) nên bucket trong memory
+    giới hạn theo LRU: bucket bị đẩy ra coi như đầy token trở lại
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self.storage = 'memory'
+        self.max_keys = 100000
+        self._buckets = OrderedDict()
+        # Key bị từ chối gần đây -> từ chối luôn tại chỗ, không cần hỏi DB
+        self._blocked_until = OrderedDict()
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.denied = 0
+
+    def init_app(self, app):
+        self.enabled = app.config.get('RATE_LIMIT_ENABLED', True)
+        self.storage = app.config.get('RATE_LIMIT_STORAGE', 'memory')
+        self.max_keys = app.config.get('RATE_LIMIT_MAX_KEYS', 100000)
+        metrics.register_stats('rate_limiter', self.stats)
+
+    def hit(self, key: str, spec: str, cost: float = 1) -> Tuple[bool, float]:
+        """
+        Lấy `cost` token từ bucket. Trả về (allowed, retry_after giây).
+        Cost lớn hơn capacity được tính bằng capacity (cần bucket đầy),
+        nếu không request đó sẽ không bao giờ qua được
+        """
+        capacity, rate = parse_limit(spec)
+        cost = min(cost, capacity)
+        now = time.time()
+        with self._lock:
+            blocked_until = self._blocked_until.get(key)
+            if blocked_until is not None:
+                if blocked_until > now:
+                    self.denied += 1
+                    return False, blocked_until - now
+                del self._blocked_until[key]
+
+        if self._use_database():
+            allowed, retry_after = self._hit_database(key, capacity, rate, cost, now)
+        else:
+            allowed, retry_after = self._hit_memory(key, capacity, rate, cost, now)
+
+        with self._lock:
+            if allowed:
+                self.allowed += 1
+            else:
+                self.denied += 1
+                self._remember(self._blocked_until, key, now + retry_after)
+        return allowed, retry_after
+
+    def peek(self, key: str, spec: str) -> Tuple[bool, float]:
+        """
+        Kiểm tra bucket còn token (> 0) mà không tiêu thụ
+        """
+        capacity, rate = parse_limit(spec)
+        tokens = self._tokens(key, capacity, rate, time.time())
+        if tokens > 0:
+            return True, 0.0
+        return False, (1 - tokens) / rate
+
+    def charge(self, key: str, spec: str, cost: float) -> None:
+        """
+        Trừ `cost` token vô điều kiện (bucket có thể âm, dùng cho token budget)
+        """
+        if cost <= 0:
+            return
+        capacity, rate = parse_limit(spec)
+        now = time.time()
+        if self._use_database():
+            self._charge_database(key, capacity, rate, cost, now)
+            return
+        with self._lock:
+            tokens = self._refill_memory(key, capacity, rate, now)
+            self._remember(self._buckets, key, (tokens - cost, now))
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'storage': self.storage,
+                'buckets': len(self._buckets),
+                'blocked': len(self._blocked_until),
+                'allowed': self.allowed,
+                'denied': self.denied
+            }
+
+    def _use_database(self) -> bool:
+        return self.storage == 'database' and has_app_context()
+
+    def _remember(self, store: OrderedDict, key: str, value) -> None:
+        """
+        Ghi vào store (giữ _lock) và bỏ các key lâu không dùng nhất khi vượt max_keys
+        """
+        store[key] = value
+        store.move_to_end(key)
+        while len(store) > self.max_keys:
+            store.popitem(last=False)
+
+    def _refill_memory(self, key: str, capacity: float, rate: float, now: float) -> float:
+        tokens, updated_at = self._buckets.get(key, (capacity, now))
+        return min(capacity, tokens + (now - updated_at) * rate)
+
+    def _hit_memory(self, key, capacity, rate, cost, now) -> Tuple[bool, float]:
+        with self._lock:
+            tokens = self._refill_memory(key, capacity, rate, now)
+            if tokens >= cost:
+                self._remember(self._buckets, key, (tokens - cost, now))
+                return True, 0.0
+            self._remember(self._buckets, key, (tokens, now))
+            return False, (cost - tokens) / rate
+
+    def _tokens(self, key: str, capacity: float, rate: float, now: float) -> float:
+        if self._use_database():
+            table = RateLimitBucket.__table__
+            with db.engine.connect() as conn:
+                row = conn.execute(
+                    table.select().where(table.c.key == key)
+                ).first()
+            if row is None:
+                return capacity
+            return min(capacity, row.tokens + (now - row.updated_at) * rate)
+        with self._lock:
+            return self._refill_memory(key, capacity, rate, now)
+
+    def _refilled(self, table, capacity: float, rate: float, now: float):
+        # CASE thay cho min(a, b): min 2 tham số chỉ có trên SQLite,
+        # PostgreSQL / MySQL dùng least() -> CASE chạy được trên mọi dialect
+        tokens = table.c.tokens + (now - table.c.updated_at) * rate
+        return db.case((tokens > capacity, capacity), else_=tokens)
+
+    def _hit_database(self, key, capacity, rate, cost, now) -> Tuple[bool, float]:
+        table = RateLimitBucket.__table__
+        refilled = self._refilled(table, capacity, rate, now)
+        try:
+            with db.engine.begin() as conn:
+                # Refill + trừ token trong một câu UPDATE duy nhất (nguyên tử)
+                result = conn.execute(
+                    table.update()
+                    .where(table.c.key == key)
+                    .where(refilled >= cost)
+                    .values(tokens=refilled - cost, updated_at=now)
+                )
+                if result.rowcount:
+                    return True, 0.0
+
+                row = conn.execute(
+                    table.select().where(table.c.key == key)
+                ).first()
+                if row is None:
+                    allowed = capacity >= cost
+                    conn.execute(table.insert().values(
+                        key=key,
+                        tokens=capacity - cost if allowed else capacity,
+                        updated_at=now
+                    ))
+                    return allowed, 0.0 if allowed else (cost - capacity) / rate
+
+            tokens = min(capacity, row.tokens + (now - row.updated_at) * rate)
+            return False, (cost - tokens) / rate
+        except Exception as e:
+            # Lỗi storage không được chặn request
+            logger.error("Rate limit storage error: %s", e)
+            return True, 0.0
+
+    def _charge_database(self, key, capacity, rate, cost, now) -> None:
+        table = RateLimitBucket.__table__
+        refilled = self._refilled(table, capacity, rate, now)
+        try:
+            with db.engine.begin() as conn:
+                result = conn.execute(
+                    table.update()
+                    .where(table.c.key == key)
+                    .values(tokens=refilled - cost, updated_at=now)
+                )
+                if not result.rowcount:
+                    conn.execute(table.insert().values(
+                        key=key,
+                        tokens=capacity - cost,
+                        updated_at=now
+                    ))
+        except Exception as e:
+            logger.error("Rate limit storage error: %s", e)
+
+
+rate_limiter = RateLimiter()
+
+
+def too_many_requests(retry_after: float, error: str = 'Rate limit exceeded'):
+    retry_after = max(1, math.ceil(retry_after))
+    response = jsonify({
+        'error': error,
+        'retry_after': retry_after
+    })
+    response.status_code = 429
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+def _scope_key(scope: str) -> Optional[str]:
+    if scope == 'ip':
+        return request.remote_addr
+    if scope == 'user':
+        user_id = getattr(request, 'user_id', None)
+        if user_id is not None:
+            return str(user_id)
+        data = request.get_json(silent=True) or {}
+        username = data.get('username')
+        return str(username) if username else None
+    return None
+
+
+def token_budget_key(user_id) -> str:
+    return f"code_assist:tokens:{user_id}"
+
+
+def check_token_budget(user_id) -> Tuple[bool, float]:
+    """
+    Kiểm tra user còn token budget cho code-assist (chưa tiêu thụ)
+    """
+    spec = current_app.config.get('CODE_ASSIST_TOKEN_BUDGET')
+    if not rate_limiter.enabled or not spec:
+        return True, 0.0
+    return rate_limiter.peek(token_budget_key(user_id), spec)
+
+
+def charge_tokens(user_id, tokens_used: int) -> None:
+    """
+    Trừ số token thực tế đã dùng (tokens_used) khỏi budget của user
+    """
+    spec = current_app.config.get('CODE_ASSIST_TOKEN_BUDGET')
+    if not rate_limiter.enabled or not spec or not tokens_used:
+        return
+    rate_limiter.charge(token_budget_key(user_id), spec, tokens_used)
+
+
+def rate_limit(name: str, token_budget: bool = False, cost: Optional[Callable[[], float]] = None):
+    """
+    Decorator áp dụng các limit cấu hình trong Config.RATE_LIMITS[name].
+    Đặt sau @jwt_required để có request.user_id.
+    `cost` (tùy chọn) tính số token cần cho request hiện tại, vd. số item của batch
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            if not rate_limiter.enabled:
+                return f(*args, **kwargs)
+
+            limits = current_app.config.get('RATE_LIMITS', {}).get(name, {})
+            hit_cost = max(1, cost()) if cost is not None else 1
+            for scope, spec in limits.items():
+                key = _scope_key(scope)
+                if not key or not spec:
+                    continue
+                allowed, retry_after = rate_limiter.hit(f"{name}:{scope}:{key}", spec, hit_cost)
+                if not allowed:
+                    logger.debug("Rate limit exceeded for %s:%s:%s", name, scope, key)
+                    return too_many_requests(retry_after)
+
+            if token_budget and getattr(request, 'user_id', None) is not None:
+                allowed, retry_after = check_token_budget(request.user_id)
+                if not allowed:
+                    logger.debug("Token budget exceeded for user %s", request.user_id)
+                    return too_many_requests(retry_after)
+
+            return f(*args, **kwargs)
+        return decorated
+    return decorator
\ No newline at end of file
@@ -0,0 +1,401 @@
+import asyncio
+import contextvars
+import logging
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+import openai
+
+from .upstream_http import DeadlineExceeded, remaining
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Giá trị số của trạng thái breaker cho gauge
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(openai.error.OpenAIError):
+    """
+    Mọi model trong chuỗi fallback đều đang bị circuit breaker chặn
+    """
+
+
+def is_retryable(e: Exception) -> bool:
+    """
+    Lỗi tạm thời của upstream (rate limit, timeout, mất kết nối, 5xx)
+    """
+    if isinstance(e, (
+        openai.error.RateLimitError,
+        openai.error.Timeout,
+        openai.error.APIConnectionError,
+        openai.error.ServiceUnavailableError,
+        openai.error.TryAgain
+    )):
+        return True
+    if isinstance(e, openai.error.APIError):
+        status = getattr(e, 'http_status', None)
+        return status is None or status >= 500
+    return False
+
+
+def retry_after(e: Exception) -> Optional[float]:
+    """
+    Số giây trong header Retry-After của response lỗi (nếu có)
+    """
+    headers = getattr(e, 'headers', None) or {}
+    value = headers.get('Retry-After') or headers.get('retry-after')
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker cho một model: mở sau `failure_threshold` lỗi liên tiếp,
+    sau `recovery_timeout` giây cho một request thử (half-open), thành công
+    thì đóng lại, lỗi thì mở tiếp
+    """
+
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opened = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.recovery_timeout:
+                self.state = HALF_OPEN
+                self._probing = False
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.opened += 1
+                    logger.warning("Circuit opened after %d consecutive failures", self.failures)
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self._probing = False
+
+    def release(self) -> None:
+        """
+        Trả lại lượt thử half-open khi request thử kết thúc mà không ghi nhận
+        thành công / lỗi (hết deadline của client, bị hủy)
+        """
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probing = False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self.failures,
+                'opened': self.opened
+            }
+
+
+class Resilience:
+    """
+    Bọc lời gọi ChatCompletion: retry với exponential backoff có jitter
+    (tôn trọng Retry-After), circuit breaker theo model, hedged request khi
+    request đầu chậm quá `hedge_after` giây và chuỗi model fallback.
+    Hedging chạy trên pool riêng tối đa `hedge_workers` thread
+    """
+
+    def __init__(
+        self,
+        max_retries: int = 3,
+        base_delay: float = 0.5,
+        max_delay: float = 8.0,
+        failure_threshold: int = 5,
+        recovery_timeout: float = 30.0,
+        hedge_after: float = 0.0,
+        hedge_workers: int = 16,
+        fallback_models: Sequence[str] = ()
+    ):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.hedge_after = hedge_after
+        self.hedge_workers = max(1, hedge_workers)
+        self.fallback_models = list(fallback_models)
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._executor = None
+        # Slot trống của pool hedging: không xếp hàng chờ thread
+        self._hedge_slots = threading.BoundedSemaphore(self.hedge_workers)
+        self._lock = threading.Lock()
+
+        self.calls = 0
+        self.attempts = 0
+        self.retries = 0
+        self.failures = 0
+        self.short_circuits = 0
+        self.fallbacks = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.hedges_skipped = 0
+
+    def _inc(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def breaker(self, model: str) -> CircuitBreaker:
+        with self._lock:
+            breaker = self._breakers.get(model)
+            if breaker is None:
+                breaker = self._breakers[model] = CircuitBreaker(
+                    self.failure_threshold, self.recovery_timeout
+                )
+            return breaker
+
+    def models(self, model: str) -> List[str]:
+        return [model] + [m for m in self.fallback_models if m != model]
+
+    def backoff(self, attempt: int, e: Exception) -> Optional[float]:
+        """
+        Thời gian chờ trước lần retry thứ `attempt` (full jitter, có trần).
+        None nếu Retry-After dài hơn trần -> chuyển sang model fallback luôn
+        """
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        hint = retry_after(e)
+        if hint is not None:
+            if hint > self.max_delay:
+                return None
+            delay = max(delay, hint)
+        return delay
+
+    def call(self, fn: Callable[[str], Any], model: str, hedge: bool = True) -> Tuple[Any, str]:
+        """
+        Gọi fn(model) với retry / breaker / hedging, lần lượt qua các model
+        fallback. Trả về (kết quả, model đã trả lời).
+        hedge=False cho request stream (không mở hai stream song song)
+        """
+        self._inc('calls')
+        last_error = None
+        for index, current in enumerate(self.models(model)):
+            breaker = self.breaker(current)
+            if index:
+                self._inc('fallbacks')
+                logger.warning("Falling back to model %s", current)
+            for attempt in range(self.max_retries + 1):
+                if not breaker.allow():
+                    self._inc('short_circuits')
+                    last_error = last_error or CircuitOpenError(f"Circuit open for model {current}")
+                    break
+                probe = breaker.state == HALF_OPEN
+                try:
+                    response = self._hedged(fn, current, hedge)
+                except Exception as e:
+                    last_error = e
+                    if isinstance(e, DeadlineExceeded):
+                        raise
+                    if not is_retryable(e):
+                        # Upstream vẫn trả lời (vd. request sai) -> không tính là lỗi của breaker
+                        breaker.record_success()
+                        raise
+                    breaker.record_failure()
+                    self._inc('failures')
+                    delay = self.backoff(attempt, e) if attempt < self.max_retries else None
+                    if delay is None:
+                        break
+                    left = remaining()
+                    if left is not None and left <= delay:
+                        # Không đủ thời gian cho lần retry -> trả lỗi ngay
+                        raise
+                    self._inc('retries')
+                    logger.info("Upstream error on %s (%s), retrying in %.2fs", current, e, delay)
+                    time.sleep(delay)
+                    continue
+                else:
+                    breaker.record_success()
+                    return response, current
+                finally:
+                    if probe:
+                        # Không để breaker kẹt ở half-open nếu lần thử không được ghi nhận
+                        breaker.release()
+        raise last_error
+
+    async def acall(self, fn: Callable[[str], Awaitable[Any]], model: str, hedge: bool = True) -> Tuple[Any, str]:
+        """
+        Bản async của call (asyncio.sleep, hedging bằng task)
+        """
+        self._inc('calls')
+        last_error = None
+        for index, current in enumerate(self.models(model)):
+            breaker = self.breaker(current)
+            if index:
+                self._inc('fallbacks')
+                logger.warning("Falling back to model %s", current)
+            for attempt in range(self.max_retries + 1):
+                if not breaker.allow():
+                    self._inc('short_circuits')
+                    last_error = last_error or CircuitOpenError(f"Circuit open for model {current}")
+                    break
+                probe = breaker.state == HALF_OPEN
+                try:
+                    response = await self._ahedged(fn, current, hedge)
+                except Exception as e:
+                    last_error = e
+                    if isinstance(e, DeadlineExceeded):
+                        raise
+                    if not is_retryable(e):
+                        # Upstream vẫn trả lời (vd. request sai) -> không tính là lỗi của breaker
+                        breaker.record_success()
+                        raise
+                    breaker.record_failure()
+                    self._inc('failures')
+                    delay = self.backoff(attempt, e) if attempt < self.max_retries else None
+                    if delay is None:
+                        break
+                    left = remaining()
+                    if left is not None and left <= delay:
+                        # Không đủ thời gian cho lần retry -> trả lỗi ngay
+                        raise
+                    self._inc('retries')
+                    logger.info("Upstream error on %s (%s), retrying in %.2fs", current, e, delay)
+                    await asyncio.sleep(delay)
+                    continue
+                else:
+                    breaker.record_success()
+                    return response, current
+                finally:
+                    if probe:
+                        # Không để breaker kẹt ở half-open nếu lần thử không được ghi nhận
+                        breaker.release()
+        raise last_error
+
+    def _hedged(self, fn: Callable[[str], Any], model: str, hedge: bool) -> Any:
+        """
+        Một lần gọi; nếu quá hedge_after giây chưa xong thì gửi thêm một
+        request song song và lấy kết quả thành công đầu tiên
+        """
+        self._inc('attempts')
+        if not hedge or self.hedge_after <= 0:
+            return fn(model)
+
+        first = self._submit(fn, model)
+        if first is None:
+            # Pool đầy: gọi thẳng trên thread hiện tại, không hedge
+            self._inc('hedges_skipped')
+            return fn(model)
+        done, _ = wait([first], timeout=self.hedge_after)
+        if done:
+            return first.result()
+
+        hedge = self._submit(fn, model)
+        if hedge is None:
+            self._inc('hedges_skipped')
+            return first.result()
+        self._inc('hedges')
+        self._inc('attempts')
+        pending = {first, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        self._inc('hedge_wins')
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def _submit(self, fn: Callable[[str], Any], model: str):
+        """
+        Chạy fn(model) trên pool hedging nếu còn slot trống, không thì trả về None
+        """
+        if not self._hedge_slots.acquire(blocking=False):
+            return None
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.hedge_workers, thread_name_prefix='hedge'
+                )
+        # Thread của executor không kế thừa contextvars (deadline) -> chạy trong bản copy
+        future = self._executor.submit(contextvars.copy_context().run, fn, model)
+        future.add_done_callback(lambda _: self._hedge_slots.release())
+        return future
+
+    async def _ahedged(self, fn: Callable[[str], Awaitable[Any]], model: str, hedge: bool) -> Any:
+        self._inc('attempts')
+        if not hedge or self.hedge_after <= 0:
+            return await fn(model)
+
+        first = asyncio.ensure_future(fn(model))
+        done, _ = await asyncio.wait({first}, timeout=self.hedge_after)
+        if done:
+            return first.result()
+
+        self._inc('hedges')
+        self._inc('attempts')
+        hedge = asyncio.ensure_future(fn(model))
+        pending = {first, hedge}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self._inc('hedge_wins')
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # Request thua (hoặc khi bị hủy) không cần chạy tiếp
+            for task in pending:
+                task.cancel()
+
+    def breaker_states(self) -> Dict[str, int]:
+        with self._lock:
+            breakers = list(self._breakers.items())
+        return {model: STATE_VALUES[breaker.stats()['state']] for model, breaker in breakers}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            breakers = list(self._breakers.items())
+            stats = {
+                'calls': self.calls,
+                'attempts': self.attempts,
+                'retries': self.retries,
+                'failures': self.failures,
+                'short_circuits': self.short_circuits,
+                'fallbacks': self.fallbacks,
+                'hedges': self.hedges,
+                'hedge_wins': self.hedge_wins,
+                'hedges_skipped': self.hedges_skipped
+            }
+        stats['circuits_open'] = sum(1 for _, b in breakers if b.stats()['state'] != CLOSED)
+        stats['breakers'] = {model: breaker.stats() for model, breaker in breakers}
+        return stats
\ No newline at end of file
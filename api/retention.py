@@ -0,0 +1,296 @@
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List
+
+from .database import db
+from .metrics import metrics
+from .models import User, CodeSession, CodeAssistJob, PurgeRequest
+from .export import session_rows_query, row_to_dict
+from .jobs import job_queue
+from .search import remove_sessions
+from .similarity import near_duplicates
+from .storage import delete_orphan_blobs
+
+logger = logging.getLogger(__name__)
+
+
+class RetentionManager:
+    """
+    Xóa dữ liệu CodeSession theo từng batch nhỏ ở background thread:
+    các yêu cầu clear history (PurgeRequest) và chính sách retention
+    (tuổi tối đa / số session tối đa, cấu hình chung hoặc theo user)
+    """
+
+    # PurgeRequest 'running' quá lâu (process bị dừng giữa chừng) được chạy tiếp
+    STALE_AFTER = timedelta(minutes=10)
+
+    def __init__(self):
+        self.app = None
+        self.max_age_days = 0
+        self.max_sessions = 0
+        self.interval = 3600
+        self.batch_size = 500
+        self.batch_pause = 0.05
+        self.archive_dir = ''
+        self.blob_gc = False
+        self.blob_gc_grace = 3600
+        self._wake = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._run_lock = threading.Lock()
+        self.deleted = 0
+        self.archived = 0
+        self.purges_completed = 0
+        self.runs = 0
+        self.errors = 0
+        self.last_run = None
+
+    def init_app(self, app):
+        self.app = app
+        self.max_age_days = app.config.get('RETENTION_MAX_AGE_DAYS', 0)
+        self.max_sessions = app.config.get('RETENTION_MAX_SESSIONS_PER_USER', 0)
+        self.interval = app.config.get('RETENTION_INTERVAL', 3600)
+        self.batch_size = app.config.get('RETENTION_BATCH_SIZE', 500)
+        self.batch_pause = app.config.get('RETENTION_BATCH_PAUSE', 0.05)
+        self.archive_dir = app.config.get('RETENTION_ARCHIVE_DIR', '')
+        self.blob_gc = app.config.get('BLOB_GC_ENABLED', False)
+        self.blob_gc_grace = app.config.get('BLOB_GC_GRACE', 3600)
+        if app.config.get('RETENTION_WORKER_ENABLED', True) and self._thread is None:
+            self._thread = threading.Thread(
+                target=self._loop, name='retention-worker', daemon=True
+            )
+            self._thread.start()
+        metrics.register_stats('retention', self.stats)
+
+    def wake(self) -> None:
+        """
+        Báo cho worker có PurgeRequest mới
+        """
+        self._wake.set()
+
+    def run_once(self, enforce_policy: bool = True) -> Dict[str, int]:
+        """
+        Xử lý các PurgeRequest đang chờ và (tùy chọn) áp dụng chính sách retention,
+        kèm dọn các job code-assist bị bỏ dở / hết hạn. Cần app context
+        """
+        with self._run_lock:
+            deleted = self.process_purges()
+            if enforce_policy:
+                deleted += self.enforce_max_age()
+                deleted += self.enforce_max_sessions()
+                job_queue.fail_stale()
+                job_queue.delete_expired()
+            if deleted and self.blob_gc:
+                delete_orphan_blobs(self.blob_gc_grace)
+            with self._lock:
+                self.runs += 1
+                self.last_run = datetime.utcnow()
+            return {'deleted': deleted}
+
+    def process_purges(self) -> int:
+        deleted = 0
+        stale_before = datetime.utcnow() - self.STALE_AFTER
+        last_seen = db.func.coalesce(PurgeRequest.heartbeat_at, PurgeRequest.started_at)
+        purge_ids = [row.id for row in db.session.query(PurgeRequest.id).filter(
+            db.or_(
+                PurgeRequest.status == 'pending',
+                db.and_(PurgeRequest.status == 'running', last_seen < stale_before)
+            )
+        ).order_by(PurgeRequest.id)]
+
+        for purge_id in purge_ids:
+            # Claim nguyên tử để nhiều worker không xử lý cùng một yêu cầu
+            claimed = db.session.query(PurgeRequest)\
+                .filter(
+                    PurgeRequest.id == purge_id,
+                    db.or_(
+                        PurgeRequest.status == 'pending',
+                        db.and_(PurgeRequest.status == 'running', last_seen < stale_before)
+                    )
+                )\
+                .update({
+                    'status': 'running',
+                    'started_at': datetime.utcnow(),
+                    'heartbeat_at': datetime.utcnow()
+                }, synchronize_session=False)
+            db.session.commit()
+            if not claimed:
+                continue
+
+            purge = db.session.query(PurgeRequest).get(purge_id)
+            try:
+                sessions = db.session.query(CodeSession.id)\
+                    .filter(
+                        CodeSession.user_id == purge.user_id,
+                        CodeSession.id <= purge.max_session_id
+                    )\
+                    .order_by(CodeSession.id)
+                deleted += self._purge(sessions, purge=purge)
+                # Job chứa nguyên query / code_context, kể cả job failed không có session
+                job_queue.delete_user_jobs(purge.user_id, purge.created_at)
+                purge.status = 'completed'
+                with self._lock:
+                    self.purges_completed += 1
+            except Exception as e:
+                logger.error("Purge %s failed: %s", purge_id, e)
+                db.session.rollback()
+                purge.status = 'failed'
+                purge.error = str(e)
+                with self._lock:
+                    self.errors += 1
+            purge.finished_at = datetime.utcnow()
+            db.session.commit()
+        return deleted
+
+    def enforce_max_age(self) -> int:
+        deleted = 0
+        now = datetime.utcnow()
+        overrides = db.session.query(User.id, User.retention_days)\
+            .filter(User.retention_days != None)  # noqa: E711
+
+        if self.max_age_days > 0:
+            cutoff = now - timedelta(days=self.max_age_days)
+            sessions = db.session.query(CodeSession.id)\
+                .filter(
+                    CodeSession.created_at < cutoff,
+                    ~CodeSession.user_id.in_(overrides.with_entities(User.id))
+                )\
+                .order_by(CodeSession.created_at)
+            deleted += self._purge(sessions)
+
+        for user in overrides.all():
+            if not user.retention_days or user.retention_days <= 0:
+                continue
+            cutoff = now - timedelta(days=user.retention_days)
+            sessions = db.session.query(CodeSession.id)\
+                .filter(CodeSession.user_id == user.id, CodeSession.created_at < cutoff)\
+                .order_by(CodeSession.created_at)
+            deleted += self._purge(sessions)
+        return deleted
+
+    def enforce_max_sessions(self) -> int:
+        deleted = 0
+        limits = {
+            user.id: user.max_sessions
+            for user in db.session.query(User.id, User.max_sessions)
+            .filter(User.max_sessions != None)  # noqa: E711
+        }
+        if self.max_sessions > 0:
+            over_limit = db.session.query(CodeSession.user_id)\
+                .group_by(CodeSession.user_id)\
+                .having(db.func.count(CodeSession.id) > self.max_sessions)
+            for row in over_limit:
+                limits.setdefault(row.user_id, self.max_sessions)
+
+        for user_id, limit in limits.items():
+            if not limit or limit <= 0:
+                continue
+            # Session cũ nhất còn được giữ lại
+            boundary = db.session.query(CodeSession.created_at, CodeSession.id)\
+                .filter(CodeSession.user_id == user_id)\
+                .order_by(CodeSession.created_at.desc(), CodeSession.id.desc())\
+                .offset(limit - 1)\
+                .first()
+            if boundary is None:
+                continue
+            sessions = db.session.query(CodeSession.id)\
+                .filter(
+                    CodeSession.user_id == user_id,
+                    db.or_(
+                        CodeSession.created_at < boundary.created_at,
+                        db.and_(
+                            CodeSession.created_at == boundary.created_at,
+                            CodeSession.id < boundary.id
+                        )
+                    )
+                )\
+                .order_by(CodeSession.created_at)
+            deleted += self._purge(sessions)
+        return deleted
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'worker_running': self._thread is not None and self._thread.is_alive(),
+                'max_age_days': self.max_age_days,
+                'max_sessions_per_user': self.max_sessions,
+                'deleted': self.deleted,
+                'archived': self.archived,
+                'purges_completed': self.purges_completed,
+                'runs': self.runs,
+                'errors': self.errors,
+                'last_run': self.last_run.isoformat() if self.last_run else None
+            }
+
+    def _purge(self, id_query, purge: PurgeRequest = None) -> int:
+        """
+        Xóa các session trả về bởi id_query, mỗi lần một batch, commit sau mỗi batch
+        """
+        total = 0
+        while True:
+            ids = [row.id for row in id_query.limit(self.batch_size)]
+            if not ids:
+                return total
+            self._delete_batch(ids)
+            total += len(ids)
+            if purge is not None:
+                purge.deleted = (purge.deleted or 0) + len(ids)
+                purge.heartbeat_at = datetime.utcnow()
+            db.session.commit()
+            with self._lock:
+                self.deleted += len(ids)
+            if self.batch_pause:
+                time.sleep(self.batch_pause)
+
+    def _delete_batch(self, ids: List[int]) -> None:
+        if self.archive_dir:
+            self._archive(ids)
+        remove_sessions(ids)
+        near_duplicates.remove_sessions(ids)
+        # Job giữ bản sao query / code_context của session -> xóa cùng session
+        db.session.query(CodeAssistJob)\
+            .filter(CodeAssistJob.session_id.in_(ids))\
+            .delete(synchronize_session=False)
+        db.session.query(CodeSession)\
+            .filter(CodeSession.id.in_(ids))\
+            .delete(synchronize_session=False)
+
+    def _archive(self, ids: List[int]) -> None:
+        """
+        Ghi các session sắp xóa ra file NDJSON nén gzip trên đĩa
+        """
+        folder = os.path.join(self.archive_dir, datetime.utcnow().strftime('%Y%m%d'))
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f"sessions-{min(ids)}-{max(ids)}-{int(time.time() * 1000)}.ndjson.gz")
+        rows = session_rows_query().filter(CodeSession.id.in_(ids)).order_by(CodeSession.id)
+        with gzip.open(path + '.tmp', 'wt', encoding='utf-8') as f:
+            for row in rows:
+                f.write(json.dumps(row_to_dict(row), ensure_ascii=False) + '\n')
+        os.replace(path + '.tmp', path)
+        with self._lock:
+            self.archived += len(ids)
+
+    def _loop(self) -> None:
+        next_policy_run = time.monotonic()
+        while True:
+            self._wake.clear()
+            now = time.monotonic()
+            enforce_policy = now >= next_policy_run
+            if enforce_policy:
+                next_policy_run = now + self.interval
+            try:
+                with self.app.app_context():
+                    self.run_once(enforce_policy=enforce_policy)
+            except Exception as e:
+                logger.error("Retention worker error: %s", e)
+                with self._lock:
+                    self.errors += 1
+            self._wake.wait(max(0.0, next_policy_run - time.monotonic()))
+
+
+retention_manager = RetentionManager()
\ No newline at end of file
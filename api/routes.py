@@ -1,23 +1,109 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, Response, stream_with_context, current_app, g
 from .auth import jwt_required
-from .models import db, User, CodeSession
+from .models import db, User, CodeSession, CodeAssistJob, PurgeRequest
 from .code_assistant import CodeAssistant
+from .jobs import job_queue
+from .ratelimit import rate_limit, charge_tokens, too_many_requests
+from .search import search_sessions
+from .similarity import near_duplicates
+from .usage import check_quota, enforce_quota, get_usage
+from .export import iter_sessions, ndjson_lines, csv_lines, chunked
+from .retention import retention_manager
+from .writebehind import write_behind
+import base64
+import contextvars
+import json
 import logging
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
-# Thiết lập logging
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-handler = logging.StreamHandler()
-handler.setFormatter(formatter)
-logger.addHandler(handler)
 
 api = Blueprint('api', __name__)
 code_assistant = CodeAssistant()
 
+def code_assist_params(data, cache_control=''):
+    """
+    Lấy (query, code_context, language, use_cache) từ body JSON.
+    use_cache=False khi body có use_cache=false hoặc header Cache-Control: no-cache
+    """
+    query = data.get('query')
+    code_context = data.get('code_context', '')
+    language = data.get('language', 'python')
+    
+    # Cho phép bỏ qua cache theo từng request
+    use_cache = data.get('use_cache', True) is not False and \
+        'no-cache' not in (cache_control or '')
+    return query, code_context, language, use_cache
+
+def use_near_duplicate(data, use_cache):
+    """
+    Có tra index near-duplicate không: tắt khi bỏ qua cache hoặc body có near_duplicate=false
+    """
+    return near_duplicates.enabled and use_cache and data.get('near_duplicate', True) is not False
+
+def batch_item_key(item):
+    """
+    Khóa chuẩn hóa (query, code_context, language) của một item batch, None nếu item không hợp lệ
+    """
+    if not isinstance(item, dict) or not isinstance(item.get('query'), str) \
+            or not item['query']:
+        return None
+    return (
+        item['query'],
+        item.get('code_context', '') or '',
+        item.get('language', 'python')
+    )
+
+def batch_cost():
+    """
+    Số token rate limit cho một batch: mỗi item duy nhất tính một lần
+    """
+    data = request.get_json(silent=True) or {}
+    items = data.get('items') if isinstance(data, dict) else None
+    if not isinstance(items, list):
+        return 1
+    items = items[:current_app.config['CODE_ASSIST_BATCH_MAX_ITEMS'] + 1]
+    return len({key for key in map(batch_item_key, items) if key is not None})
+
+def save_code_session(user_id, query, code_context, language, result):
+    """
+    Lưu CodeSession cho một kết quả code assist và trừ token vào budget.
+    Lỗi khi lưu chỉ được log (client vẫn nhận response), trả về session_id hoặc None
+    """
+    try:
+        session_fields = dict(
+            user_id=user_id,
+            query=query,
+            code_context=code_context,
+            response=result['response'],
+            language=language,
+            tokens_used=result.get('tokens_used', 0),
+            model=result.get('model'),
+            created_at=datetime.utcnow()
+        )
+        if write_behind.enabled:
+            # Ghi theo batch ở background, id đã được cấp phát trước
+            session_id = write_behind.enqueue(**session_fields)
+        else:
+            session = CodeSession(**session_fields)
+            db.session.add(session)
+            db.session.commit()
+            session_id = session.id
+        logger.debug("Saved code session for user %s", user_id)
+        charge_tokens(user_id, session_fields['tokens_used'])
+        return session_id
+        
+    except Exception as e:
+        logger.error("Error saving code session: %s", e)
+        db.session.rollback()
+        return None
+
 @api.route('/code-assist', methods=['POST'])
 @jwt_required
+@rate_limit('code_assist', token_budget=True)
+@enforce_quota
 def code_assistance():
     """
     Endpoint để xử lý yêu cầu hỗ trợ code
@@ -29,22 +115,29 @@ def code_assistance():
             return jsonify({'error': 'No data provided'}), 400
 
         # Validate và lấy các trường dữ liệu
-        query = data.get('query')
-        code_context = data.get('code_context', '')
-        language = data.get('language', 'python')
+        query, code_context, language, use_cache = code_assist_params(
+            data, request.headers.get('Cache-Control', '')
+        )
         
         # Kiểm tra query bắt buộc
         if not query:
             return jsonify({'error': 'Query is required'}), 400
             
-        logger.debug(f"Processing code assist request: {query[:100]}...")
+        logger.debug("Processing code assist request: %s...", query[:100])
         
+        # Câu hỏi gần giống một session trước đó -> dùng lại câu trả lời
+        response = None
+        if use_near_duplicate(data, use_cache):
+            response = near_duplicates.answer(request.user_id, query, code_context, language)
+            
         # Gọi code assistant để xử lý
-        response = code_assistant.process_request(
-            query=query,
-            code_context=code_context,
-            language=language
-        )
+        if response is None:
+            response = code_assistant.process_request(
+                query=query,
+                code_context=code_context,
+                language=language,
+                use_cache=use_cache
+            )
         
         if not response.get('success'):
             return jsonify({
@@ -53,36 +146,430 @@ def code_assistance():
             }), 500
 
         # Lưu session vào database
+        session_id = save_code_session(request.user_id, query, code_context, language, response)
+            
+        return jsonify({
+            'success': True,
+            'response': response['response'],
+            'tokens_used': response.get('tokens_used', 0),
+            'cached': response.get('cached', False),
+            'coalesced': response.get('coalesced', False),
+            'context_tokens': response.get('context_tokens'),
+            'near_duplicate': response.get('near_duplicate'),
+            'session_id': session_id
+        })
+        
+    except Exception as e:
+        logger.error("Code assist error: %s", e)
+        return jsonify({
+            'error': 'Code assist failed',
+            'details': str(e)
+        }), 500
+
+def _sse(data, event=None):
+    """
+    Đóng gói một event theo định dạng Server-Sent Events
+    """
+    message = f"data: {json.dumps(data)}\n\n"
+    return f"event: {event}\n{message}" if event else message
+
+@api.route('/code-assist/stream', methods=['POST'])
+@jwt_required
+@rate_limit('code_assist', token_budget=True)
+@enforce_quota
+def code_assistance_stream():
+    """
+    Endpoint hỗ trợ code dạng streaming (Server-Sent Events)
+    """
+    data = request.get_json()
+    if not data:
+        return jsonify({'error': 'No data provided'}), 400
+        
+    query, code_context, language, use_cache = code_assist_params(
+        data, request.headers.get('Cache-Control', '')
+    )
+    
+    if not query:
+        return jsonify({'error': 'Query is required'}), 400
+        
+    user_id = request.user_id
+    logger.debug("Streaming code assist request: %s...", query[:100])
+    
+    def generate():
+        events = code_assistant.stream_request(
+            query=query,
+            code_context=code_context,
+            language=language,
+            use_cache=use_cache
+        )
         try:
+            for event in events:
+                if event['type'] == 'delta':
+                    yield _sse({'content': event['content']})
+                    continue
+                    
+                if event['type'] == 'error':
+                    yield _sse({
+                        'error': 'Code assistant processing failed',
+                        'details': event['error']
+                    }, event='error')
+                    return
+                    
+                # Lưu session một lần duy nhất sau khi stream kết thúc
+                session_id = save_code_session(user_id, query, code_context, language, event)
+                    
+                yield _sse({
+                    'success': True,
+                    'tokens_used': event['tokens_used'],
+                    'cached': event['cached'],
+                    'context_tokens': event.get('context_tokens'),
+                    'session_id': session_id
+                }, event='done')
+        finally:
+            # Client ngắt kết nối -> đóng generator để hủy request upstream
+            events.close()
+            
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+@api.route('/code-assist/batch', methods=['POST'])
+@jwt_required
+@rate_limit('code_assist', token_budget=True, cost=batch_cost)
+@enforce_quota
+def code_assistance_batch():
+    """
+    Endpoint để xử lý nhiều yêu cầu hỗ trợ code trong một lần gọi.
+    Các item giống nhau chỉ được xử lý một lần, kết quả giữ đúng thứ tự
+    """
+    try:
+        data = request.get_json()
+        if not data or not isinstance(data.get('items'), list):
+            return jsonify({'error': 'items list is required'}), 400
+            
+        items = data['items']
+        max_items = current_app.config['CODE_ASSIST_BATCH_MAX_ITEMS']
+        if not items:
+            return jsonify({'error': 'items list is empty'}), 400
+        if len(items) > max_items:
+            return jsonify({'error': f'Batch size exceeds limit of {max_items} items'}), 400
+            
+        use_cache = data.get('use_cache', True) is not False
+        
+        # Chuẩn hóa và gom các item giống nhau
+        keys = []
+        unique = {}
+        errors = {}
+        for index, item in enumerate(items):
+            key = batch_item_key(item)
+            keys.append(key)
+            if key is None:
+                errors[index] = 'Query is required'
+                continue
+            unique.setdefault(key, index)
+            
+        logger.debug("Batch code assist: %s items, %s unique", len(items), len(unique))
+        
+        # enforce_quota chỉ chặn khi quota đã hết: cả batch phải vừa phần quota còn lại
+        estimated = sum(code_assistant.estimate_request_tokens(key[0], key[1]) for key in unique)
+        allowed, reason, retry_after = check_quota(int(request.user_id), estimated)
+        if not allowed:
+            logger.debug("Batch of %s items (~%s tokens) exceeds quota for user %s",
+                         len(unique), estimated, request.user_id)
+            return too_many_requests(retry_after, error=reason)
+            
+        app = current_app._get_current_object()
+        request_id = g.get('request_id')
+        
+        def process(key):
+            with app.app_context():
+                # App context mới có g riêng -> gắn lại request_id cho log của worker
+                g.request_id = request_id
+                query, code_context, language = key
+                return code_assistant.process_request(
+                    query=query,
+                    code_context=code_context,
+                    language=language,
+                    use_cache=use_cache
+                )
+                
+        unique_keys = list(unique)
+        outcomes = {}
+        if unique_keys:
+            workers = min(current_app.config['CODE_ASSIST_BATCH_CONCURRENCY'], len(unique_keys))
+            with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+                # Thread của executor không kế thừa contextvars (deadline) -> mỗi item chạy trong bản copy
+                futures = [executor.submit(contextvars.copy_context().run, process, key)
+                           for key in unique_keys]
+                for key, future in zip(unique_keys, futures):
+                    outcomes[key] = future.result()
+                    
+        # Lưu tất cả session trong một transaction
+        results = []
+        sessions = []
+        for index, key in enumerate(keys):
+            if key is None:
+                results.append({'success': False, 'error': errors[index]})
+                continue
+                
+            outcome = outcomes[key]
+            if not outcome.get('success'):
+                results.append({
+                    'success': False,
+                    'error': 'Code assistant processing failed',
+                    'details': outcome.get('error')
+                })
+                continue
+                
+            # Item trùng lặp không bị tính token lần nữa
+            tokens_used = outcome.get('tokens_used', 0) if unique[key] == index else 0
             session = CodeSession(
                 user_id=request.user_id,
-                query=query,
-                code_context=code_context,
-                response=response['response'],
-                language=language,
-                tokens_used=response.get('tokens_used', 0),
+                query=key[0],
+                code_context=key[1],
+                response=outcome['response'],
+                language=key[2],
+                tokens_used=tokens_used,
+                model=outcome.get('model'),
                 created_at=datetime.utcnow()
             )
-            db.session.add(session)
-            db.session.commit()
-            logger.debug(f"Saved code session for user {request.user_id}")
+            sessions.append(session)
+            results.append({
+                'success': True,
+                'response': outcome['response'],
+                'tokens_used': tokens_used,
+                'cached': outcome.get('cached', False),
+                'context_tokens': outcome.get('context_tokens'),
+                'deduplicated': unique[key] != index,
+                '_session': session
+            })
             
+        try:
+            db.session.add_all(sessions)
+            db.session.commit()
+            charge_tokens(request.user_id, sum(session.tokens_used for session in sessions))
         except Exception as e:
-            logger.error(f"Error saving code session: {str(e)}")
+            logger.error("Error saving batch code sessions: %s", e)
             db.session.rollback()
-            # Vẫn trả về response nhưng log lỗi lưu session
+            sessions = []
             
+        for result in results:
+            session = result.pop('_session', None)
+            if session is not None:
+                result['session_id'] = session.id if sessions else None
+                
         return jsonify({
             'success': True,
-            'response': response['response'],
-            'tokens_used': response.get('tokens_used', 0),
-            'session_id': session.id if session else None
+            'total': len(items),
+            'unique': len(unique),
+            'results': results
         })
         
     except Exception as e:
-        logger.error(f"Code assist error: {str(e)}")
+        logger.error("Batch code assist error: %s", e)
         return jsonify({
-            'error': 'Code assist failed',
+            'error': 'Batch code assist failed',
+            'details': str(e)
+        }), 500
+
+@api.route('/code-assist/jobs', methods=['POST'])
+@jwt_required
+@rate_limit('code_assist', token_budget=True)
+@enforce_quota
+def create_code_assist_job():
+    """
+    Endpoint để đưa yêu cầu hỗ trợ code vào hàng đợi, trả về job id ngay
+    """
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({'error': 'No data provided'}), 400
+            
+        query = data.get('query')
+        if not query:
+            return jsonify({'error': 'Query is required'}), 400
+            
+        if job_queue.is_full():
+            return jsonify({'error': 'Job queue is full, try again later'}), 503
+            
+        job = CodeAssistJob(
+            id=uuid.uuid4().hex,
+            user_id=request.user_id,
+            status='queued',
+            query=query,
+            code_context=data.get('code_context', ''),
+            language=data.get('language', 'python'),
+            use_cache=data.get('use_cache', True) is not False,
+            created_at=datetime.utcnow()
+        )
+        db.session.add(job)
+        db.session.commit()
+        
+        if not job_queue.submit(job.id, code_assistant):
+            job.status = 'failed'
+            job.error = 'Job queue is full'
+            job.finished_at = datetime.utcnow()
+            db.session.commit()
+            return jsonify({'error': 'Job queue is full, try again later'}), 503
+            
+        logger.debug("Queued code assist job %s for user %s", job.id, request.user_id)
+        
+        return jsonify({
+            'success': True,
+            'job_id': job.id,
+            'status': job.status
+        }), 202
+        
+    except Exception as e:
+        logger.error("Create job error: %s", e)
+        db.session.rollback()
+        return jsonify({
+            'error': 'Failed to create job',
+            'details': str(e)
+        }), 500
+
+@api.route('/code-assist/jobs/stats', methods=['GET'])
+@jwt_required
+def code_assist_job_stats():
+    """
+    Endpoint để xem độ sâu hàng đợi, thời gian chờ và thời gian chạy của job
+    """
+    return jsonify({
+        'success': True,
+        'stats': job_queue.stats()
+    })
+
+@api.route('/code-assist/jobs/<job_id>', methods=['GET'])
+@jwt_required
+def get_code_assist_job(job_id):
+    """
+    Endpoint để lấy trạng thái và kết quả của một job
+    """
+    try:
+        job = db.session.query(CodeAssistJob)\
+            .filter(
+                CodeAssistJob.id == job_id,
+                CodeAssistJob.user_id == request.user_id
+            ).first()
+            
+        if not job:
+            return jsonify({
+                'error': 'Job not found'
+            }), 404
+            
+        result = job.to_dict()
+        if job.status == 'succeeded' and job.session_id:
+            session = db.session.query(CodeSession).get(job.session_id)
+            if session:
+                result['response'] = session.response
+                result['tokens_used'] = session.tokens_used
+                
+        return jsonify({
+            'success': True,
+            'job': result
+        })
+        
+    except Exception as e:
+        logger.error("Get job error: %s", e)
+        return jsonify({
+            'error': 'Failed to fetch job',
+            'details': str(e)
+        }), 500
+
+@api.route('/code-assist/cache', methods=['GET'])
+@jwt_required
+def cache_stats():
+    """
+    Endpoint để xem thống kê hit/miss của response cache
+    """
+    if code_assistant.cache is None:
+        return jsonify({
+            'success': True,
+            'enabled': False
+        })
+        
+    return jsonify({
+        'success': True,
+        'enabled': True,
+        'stats': code_assistant.cache.stats()
+    })
+
+@api.route('/code-assist/coalescing', methods=['GET'])
+@jwt_required
+def coalescing_stats():
+    """
+    Endpoint để xem số request leader / được gộp (single-flight)
+    """
+    if code_assistant.single_flight is None:
+        return jsonify({
+            'success': True,
+            'enabled': False
+        })
+        
+    return jsonify({
+        'success': True,
+        'enabled': True,
+        'stats': code_assistant.single_flight.stats()
+    })
+
+HISTORY_FIELDS = ('id', 'query', 'language', 'created_at', 'tokens_used')
+
+def _encode_cursor(session):
+    """
+    Cursor dạng opaque cho keyset pagination: (created_at, id) của dòng cuối
+    """
+    raw = f"{session.created_at.isoformat()}|{session.id}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+def _decode_cursor(cursor):
+    raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+    created_at, session_id = raw.split('|')
+    return datetime.fromisoformat(created_at), int(session_id)
+
+def _serialize_history(rows, fields):
+    """
+    Chuyển các row (chỉ gồm cột đã chọn) thành list dict cho response
+    """
+    history = []
+    for row in rows:
+        item = {}
+        for field in fields:
+            value = getattr(row, field)
+            if field == 'created_at':
+                value = value.isoformat() if value else None
+            item[field] = value
+        history.append(item)
+    return history
+
+@api.route('/usage', methods=['GET'])
+@jwt_required
+def usage():
+    """
+    Endpoint để xem lượng token đã dùng (hôm nay, tháng này, theo ngày và theo model)
+    """
+    write_behind.wait_for_user(request.user_id)
+    
+    try:
+        try:
+            days = int(request.args.get('days', 30))
+        except ValueError:
+            return jsonify({'error': 'days must be an integer'}), 400
+        days = max(1, min(days, 366))
+        
+        return jsonify({
+            'success': True,
+            'usage': get_usage(int(request.user_id), days=days)
+        })
+        
+    except Exception as e:
+        logger.error("Usage error: %s", e)
+        return jsonify({
+            'error': 'Failed to fetch usage',
             'details': str(e)
         }), 500
 
@@ -90,50 +577,184 @@ def code_assistance():
 @jwt_required
 def get_history():
     """
-    Endpoint để lấy lịch sử code sessions của user
+    Endpoint để lấy lịch sử code sessions của user (phân trang theo cursor).
+    Query params: limit, before (cursor), fields (danh sách cột, phân cách bằng dấu phẩy).
+    Nội dung đầy đủ (code_context, response) lấy qua /history/<id>
     """
+    # Đọc được các session vừa ghi (còn trong buffer write-behind)
+    write_behind.wait_for_user(request.user_id)
+    
     try:
-        logger.debug(f"Getting history for user_id: {request.user_id}")
+        logger.debug("Getting history for user_id: %s", request.user_id)
         
-        # Truy vấn database
-        sessions = db.session.query(CodeSession)\
-            .filter(CodeSession.user_id == request.user_id)\
-            .order_by(CodeSession.created_at.desc())\
+        max_limit = current_app.config['HISTORY_MAX_PAGE_SIZE']
+        try:
+            limit = int(request.args.get('limit', current_app.config['HISTORY_PAGE_SIZE']))
+        except ValueError:
+            return jsonify({'error': 'limit must be an integer'}), 400
+        limit = max(1, min(limit, max_limit))
+        
+        fields = request.args.get('fields')
+        fields = [f.strip() for f in fields.split(',') if f.strip()] if fields else list(HISTORY_FIELDS)
+        invalid = [f for f in fields if f not in HISTORY_FIELDS]
+        if invalid:
+            return jsonify({
+                'error': f"Invalid fields: {', '.join(invalid)}",
+                'allowed_fields': list(HISTORY_FIELDS)
+            }), 400
+            
+        # Chỉ load các cột cần thiết, query bị cắt ngắn ngay trong SQL
+        truncate = current_app.config['HISTORY_QUERY_PREVIEW_LENGTH']
+        columns = {
+            'id': CodeSession.id,
+            'query': db.func.substr(CodeSession.query, 1, truncate).label('query'),
+            'language': CodeSession.language,
+            'created_at': CodeSession.created_at,
+            'tokens_used': CodeSession.tokens_used
+        }
+        selected = [columns[f] for f in fields]
+        for key in ('id', 'created_at'):
+            if key not in fields:
+                selected.append(columns[key])
+                
+        # Truy vấn database theo index (user_id, created_at DESC, id DESC)
+        history_query = db.session.query(*selected)\
+            .filter(CodeSession.user_id == request.user_id)
+            
+        before = request.args.get('before')
+        if before:
+            try:
+                cursor_created_at, cursor_id = _decode_cursor(before)
+            except Exception:
+                return jsonify({'error': 'Invalid cursor'}), 400
+            history_query = history_query.filter(db.or_(
+                CodeSession.created_at < cursor_created_at,
+                db.and_(
+                    CodeSession.created_at == cursor_created_at,
+                    CodeSession.id < cursor_id
+                )
+            ))
+            
+        rows = history_query\
+            .order_by(CodeSession.created_at.desc(), CodeSession.id.desc())\
+            .limit(limit + 1)\
             .all()
             
-        # Format response
-        history = [{
-            'id': session.id,
-            'query': session.query,
-            'code_context': session.code_context,
-            'response': session.response,
-            'language': session.language,
-            'created_at': session.created_at.isoformat() if session.created_at else None,
-            'tokens_used': session.tokens_used
-        } for session in sessions]
+        has_more = len(rows) > limit
+        rows = rows[:limit]
         
-        logger.debug(f"Found {len(history)} sessions for user {request.user_id}")
+        # Format response
+        history = _serialize_history(rows, fields)
+            
+        logger.debug("Found %s sessions for user %s", len(history), request.user_id)
         
         return jsonify({
             'success': True,
-            'sessions': history
+            'sessions': history,
+            'has_more': has_more,
+            'next_cursor': _encode_cursor(rows[-1]) if has_more else None
         })
         
     except Exception as e:
-        logger.error(f"History error: {str(e)}")
+        logger.error("History error: %s", e)
         return jsonify({
             'error': 'Failed to fetch history',
             'details': str(e)
         }), 500
 
+@api.route('/history/search', methods=['GET'])
+@jwt_required
+def search_history():
+    """
+    Endpoint để tìm kiếm full-text trong lịch sử (query và response).
+    Không có FTS5 (database khác SQLite) chỉ tìm trong query.
+    Kết quả query / snippet là HTML đã escape, từ khớp nằm trong <mark>.
+    Query params: q, limit, page
+    """
+    write_behind.wait_for_user(request.user_id)
+    
+    try:
+        q = request.args.get('q', '').strip()
+        if not q:
+            return jsonify({'error': 'q is required'}), 400
+            
+        try:
+            limit = int(request.args.get('limit', current_app.config['HISTORY_PAGE_SIZE']))
+            page = int(request.args.get('page', 1))
+        except ValueError:
+            return jsonify({'error': 'limit and page must be integers'}), 400
+        limit = max(1, min(limit, current_app.config['HISTORY_MAX_PAGE_SIZE']))
+        page = max(1, page)
+        
+        logger.debug("Searching history for user %s: %s", request.user_id, q[:100])
+        
+        results, has_more = search_sessions(
+            int(request.user_id), q, limit=limit, offset=(page - 1) * limit
+        )
+        
+        return jsonify({
+            'success': True,
+            'results': results,
+            'page': page,
+            'has_more': has_more
+        })
+        
+    except Exception as e:
+        logger.error("Search history error: %s", e)
+        return jsonify({
+            'error': 'Failed to search history',
+            'details': str(e)
+        }), 500
+
+@api.route('/history/export', methods=['GET'])
+@jwt_required
+def export_history():
+    """
+    Endpoint để export toàn bộ lịch sử dạng stream (NDJSON hoặc CSV).
+    Query params: format=ndjson|csv, gzip=1, from/to (ISO date/datetime).
+    Khoảng thời gian là nửa mở [from, to): to=2024-02-01 lấy hết ngày 31/01
+    """
+    write_behind.wait_for_user(request.user_id)
+    
+    export_format = request.args.get('format', 'ndjson').lower()
+    if export_format not in ('ndjson', 'csv'):
+        return jsonify({'error': 'format must be ndjson or csv'}), 400
+        
+    try:
+        start = datetime.fromisoformat(request.args['from']) if request.args.get('from') else None
+        end = datetime.fromisoformat(request.args['to']) if request.args.get('to') else None
+    except ValueError:
+        return jsonify({'error': 'from/to must be ISO dates'}), 400
+        
+    use_gzip = request.args.get('gzip', '').lower() in ('1', 'true')
+    user_id = int(request.user_id)
+    logger.debug("Exporting history for user %s as %s", user_id, export_format)
+    
+    sessions = iter_sessions(user_id, start=start, end=end)
+    lines = ndjson_lines(sessions) if export_format == 'ndjson' else csv_lines(sessions)
+    
+    filename = f"history-{user_id}.{export_format}"
+    mimetype = 'application/x-ndjson' if export_format == 'ndjson' else 'text/csv'
+    if use_gzip:
+        filename += '.gz'
+        mimetype = 'application/gzip'
+        
+    return Response(
+        stream_with_context(chunked(lines, gzip=use_gzip)),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
 @api.route('/history/<int:session_id>', methods=['GET'])
 @jwt_required
 def get_session(session_id):
     """
     Endpoint để lấy chi tiết một session cụ thể
     """
+    write_behind.wait_for_user(request.user_id)
+    
     try:
-        logger.debug(f"Getting session {session_id} for user {request.user_id}")
+        logger.debug("Getting session %s for user %s", session_id, request.user_id)
         
         # Truy vấn session
         session = db.session.query(CodeSession)\
@@ -162,7 +783,7 @@ def get_session(session_id):
         })
         
     except Exception as e:
-        logger.error(f"Get session error: {str(e)}")
+        logger.error("Get session error: %s", e)
         return jsonify({
             'error': 'Failed to fetch session',
             'details': str(e)
@@ -174,8 +795,11 @@ def delete_session(session_id):
     """
     Endpoint để xóa một session
     """
+    # Session có thể vẫn nằm trong buffer write-behind
+    write_behind.wait_for_user(request.user_id)
+    
     try:
-        logger.debug(f"Deleting session {session_id} for user {request.user_id}")
+        logger.debug("Deleting session %s for user %s", session_id, request.user_id)
         
         # Truy vấn session
         session = db.session.query(CodeSession)\
@@ -189,7 +813,11 @@ def delete_session(session_id):
                 'error': 'Session not found'
             }), 404
             
-        # Xóa session
+        # Xóa session cùng job đã tạo ra nó (FK code_assist_job.session_id,
+        # job cũng giữ bản sao query / code_context)
+        db.session.query(CodeAssistJob)\
+            .filter(CodeAssistJob.session_id == session.id)\
+            .delete(synchronize_session=False)
         db.session.delete(session)
         db.session.commit()
         
@@ -199,7 +827,7 @@ def delete_session(session_id):
         })
         
     except Exception as e:
-        logger.error(f"Delete session error: {str(e)}")
+        logger.error("Delete session error: %s", e)
         db.session.rollback()
         return jsonify({
             'error': 'Failed to delete session',
@@ -210,27 +838,69 @@ def delete_session(session_id):
 @jwt_required
 def clear_history():
     """
-    Endpoint để xóa toàn bộ lịch sử của user
+    Endpoint để xóa toàn bộ lịch sử của user.
+    Việc xóa được thực hiện nền theo từng batch, trả về purge id để theo dõi
     """
+    # Flush các session đang chờ ghi trước khi lấy max_session_id, nếu không
+    # chúng sẽ được ghi sau khi purge xong và lịch sử "đã xóa" xuất hiện lại
+    write_behind.wait_for_user(request.user_id)
+    
     try:
-        logger.debug(f"Clearing history for user {request.user_id}")
+        logger.debug("Clearing history for user %s", request.user_id)
         
-        # Xóa tất cả sessions của user
-        db.session.query(CodeSession)\
+        max_session_id = db.session.query(db.func.max(CodeSession.id))\
             .filter(CodeSession.user_id == request.user_id)\
-            .delete()
+            .scalar()
+        if max_session_id is None:
+            # Không có session nào: chỉ còn các job đã xong cần xóa
+            job_queue.delete_user_jobs(request.user_id, datetime.utcnow())
+            db.session.commit()
+            return jsonify({
+                'success': True,
+                'message': 'History cleared successfully'
+            })
             
+        purge = PurgeRequest(
+            user_id=request.user_id,
+            max_session_id=max_session_id,
+            status='pending'
+        )
+        db.session.add(purge)
         db.session.commit()
+        retention_manager.wake()
         
         return jsonify({
             'success': True,
-            'message': 'History cleared successfully'
-        })
+            'message': 'History clear scheduled',
+            'purge': purge.to_dict()
+        }), 202
         
     except Exception as e:
-        logger.error(f"Clear history error: {str(e)}")
+        logger.error("Clear history error: %s", e)
         db.session.rollback()
         return jsonify({
             'error': 'Failed to clear history',
             'details': str(e)
-        }), 500
\ No newline at end of file
+        }), 500
+
+@api.route('/history/clear/<int:purge_id>', methods=['GET'])
+@jwt_required
+def get_clear_status(purge_id):
+    """
+    Endpoint để xem tiến độ của một yêu cầu xóa lịch sử
+    """
+    purge = db.session.query(PurgeRequest)\
+        .filter(
+            PurgeRequest.id == purge_id,
+            PurgeRequest.user_id == request.user_id
+        ).first()
+        
+    if not purge:
+        return jsonify({
+            'error': 'Purge request not found'
+        }), 404
+        
+    return jsonify({
+        'success': True,
+        'purge': purge.to_dict()
+    })
\ No newline at end of file
@@ -0,0 +1,208 @@
+import html
+import logging
+import re
+from typing import Any, Dict, List, Tuple
+
+from sqlalchemy import event, text
+
+from .database import db
+from .models import CodeSession
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = 'code_session_fts'
+
+# Marker tạm cho highlight()/snippet() của FTS5: escape HTML phần text trước
+# rồi mới đổi marker thành <mark>, để nội dung session không chèn được HTML
+_MARK_START = '\x02'
+_MARK_END = '\x03'
+
+# Response được nén trong code_session nên FTS5 giữ bản text riêng của nó,
+# được đồng bộ bằng ORM event thay vì trigger SQL
+_enabled = False
+
+
+def fts_enabled() -> bool:
+    return _enabled
+
+
+def create_search_index() -> None:
+    """
+    Tạo bảng FTS5 (chỉ với SQLite) và index các session hiện có nếu bảng mới được tạo
+    """
+    global _enabled
+    if db.engine.dialect.name != 'sqlite':
+        _enabled = False
+        return
+
+    with db.engine.begin() as conn:
+        exists = conn.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+            {'name': FTS_TABLE}
+        ).first()
+        if not exists:
+            conn.execute(text(
+                f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+                "query, response, tokenize = 'unicode61 remove_diacritics 2')"
+            ))
+    _enabled = True
+    if not exists:
+        rebuild_search_index()
+
+
+def rebuild_search_index(batch_size: int = 500) -> int:
+    """
+    Index lại toàn bộ CodeSession theo từng batch
+    """
+    if not _enabled:
+        return 0
+    db.session.execute(text(f"DELETE FROM {FTS_TABLE}"))
+    indexed = 0
+    last_id = 0
+    while True:
+        sessions = db.session.query(CodeSession)\
+            .filter(CodeSession.id > last_id)\
+            .order_by(CodeSession.id)\
+            .limit(batch_size)\
+            .all()
+        if not sessions:
+            break
+        db.session.execute(
+            text(f"INSERT INTO {FTS_TABLE} (rowid, query, response) VALUES (:id, :query, :response)"),
+            [{'id': s.id, 'query': s.query, 'response': s.response or ''} for s in sessions]
+        )
+        last_id = sessions[-1].id
+        indexed += len(sessions)
+    db.session.commit()
+    return indexed
+
+
+def remove_sessions(session_ids: List[int]) -> None:
+    if not _enabled or not session_ids:
+        return
+    db.session.execute(
+        text(f"DELETE FROM {FTS_TABLE} WHERE rowid = :id"),
+        [{'id': session_id} for session_id in session_ids]
+    )
+
+
+@event.listens_for(CodeSession, 'after_insert')
+def _index_session(mapper, connection, target):
+    if _enabled:
+        connection.execute(
+            text(f"INSERT INTO {FTS_TABLE} (rowid, query, response) VALUES (:id, :query, :response)"),
+            {'id': target.id, 'query': target.query, 'response': target.response or ''}
+        )
+
+
+@event.listens_for(CodeSession, 'after_update')
+def _reindex_session(mapper, connection, target):
+    if _enabled:
+        connection.execute(text(f"DELETE FROM {FTS_TABLE} WHERE rowid = :id"), {'id': target.id})
+        _index_session(mapper, connection, target)
+
+
+@event.listens_for(CodeSession, 'after_delete')
+def _unindex_session(mapper, connection, target):
+    if _enabled:
+        connection.execute(text(f"DELETE FROM {FTS_TABLE} WHERE rowid = :id"), {'id': target.id})
+
+
+def _fts_query(q: str) -> str:
+    """
+    Chuyển input của user thành biểu thức MATCH an toàn (các từ nối bằng AND)
+    """
+    terms = re.findall(r'\w+', q, flags=re.UNICODE)
+    return ' '.join('"' + term.replace('"', '""') + '"' for term in terms)
+
+
+def _render_marks(value: str) -> str:
+    """
+    Escape HTML output của FTS5 rồi đổi marker thành <mark>
+    """
+    return html.escape(value or '').replace(_MARK_START, '<mark>').replace(_MARK_END, '</mark>')
+
+
+def _highlight(value: str, terms: List[str], width: int = 160) -> str:
+    """
+    Tạo snippet có đánh dấu <mark> cho fallback không dùng FTS5 (text đã escape HTML)
+    """
+    if not value:
+        return ''
+    lowered = value.lower()
+    positions = [lowered.find(term.lower()) for term in terms]
+    positions = [p for p in positions if p >= 0]
+    start = max(0, min(positions) - width // 3) if positions and len(value) > width else 0
+    snippet = value[start:start + width]
+    pattern = re.compile('|'.join(re.escape(term) for term in terms), flags=re.IGNORECASE)
+    parts = []
+    last = 0
+    for match in pattern.finditer(snippet):
+        parts.append(html.escape(snippet[last:match.start()]))
+        parts.append('<mark>' + html.escape(match.group()) + '</mark>')
+        last = match.end()
+    parts.append(html.escape(snippet[last:]))
+    return ('…' if start else '') + ''.join(parts) + ('…' if start + width < len(value) else '')
+
+
+def _like_pattern(term: str) -> str:
+    # '_' thuộc \w nhưng là wildcard của LIKE
+    return '%' + term.replace('_', '\\_') + '%'
+
+
+def search_sessions(user_id: int, q: str, limit: int, offset: int) -> Tuple[List[Dict[str, Any]], bool]:
+    """
+    Tìm kiếm session của user, trả về (kết quả theo thứ tự relevance, has_more)
+    """
+    if _enabled:
+        match = _fts_query(q)
+        if not match:
+            return [], False
+        rows = db.session.execute(text(
+            f"SELECT s.id, s.language, s.created_at, s.tokens_used, "
+            f"highlight({FTS_TABLE}, 0, :start, :end) AS query, "
+            f"snippet({FTS_TABLE}, 1, :start, :end, '…', 24) AS snippet, "
+            f"bm25({FTS_TABLE}) AS rank "
+            f"FROM {FTS_TABLE} JOIN code_session s ON s.id = {FTS_TABLE}.rowid "
+            f"WHERE {FTS_TABLE} MATCH :match AND s.user_id = :user_id "
+            f"ORDER BY rank LIMIT :limit OFFSET :offset"
+        ), {
+            'match': match, 'user_id': user_id, 'limit': limit + 1, 'offset': offset,
+            'start': _MARK_START, 'end': _MARK_END
+        }).fetchall()
+        results = [{
+            'id': row.id,
+            'query': _render_marks(row.query),
+            'snippet': _render_marks(row.snippet),
+            'language': row.language,
+            'created_at': row.created_at.replace(' ', 'T') if row.created_at else None,
+            'tokens_used': row.tokens_used,
+            'rank': row.rank
+        } for row in rows[:limit]]
+        return results, len(rows) > limit
+
+    # Fallback (không phải SQLite): LIKE chỉ trên cột query, mới nhất trước.
+    # Response được nén và code_context nằm trong content blob nên không LIKE được:
+    # khác FTS5 (query + response), fallback không tìm thấy từ chỉ có trong response
+    terms = re.findall(r'\w+', q, flags=re.UNICODE)
+    if not terms:
+        return [], False
+    search_query = db.session.query(CodeSession)\
+        .filter(CodeSession.user_id == user_id)
+    for term in terms:
+        search_query = search_query.filter(CodeSession.query.ilike(_like_pattern(term), escape='\\'))
+    sessions = search_query\
+        .order_by(CodeSession.created_at.desc(), CodeSession.id.desc())\
+        .offset(offset)\
+        .limit(limit + 1)\
+        .all()
+    results = [{
+        'id': session.id,
+        'query': _highlight(session.query, terms, width=len(session.query)),
+        'snippet': _highlight(session.response, terms),
+        'language': session.language,
+        'created_at': session.created_at.isoformat() if session.created_at else None,
+        'tokens_used': session.tokens_used,
+        'rank': None
+    } for session in sessions[:limit]]
+    return results, len(sessions) > limit
\ No newline at end of file
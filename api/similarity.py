@@ -0,0 +1,509 @@
+import hashlib
+import logging
+import re
+import threading
+import time
+from array import array
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import bindparam, event
+from sqlalchemy.orm import object_session
+
+from .database import db
+from .metrics import metrics
+from .models import CodeSession
+
+logger = logging.getLogger(__name__)
+
+_WORD_RE = re.compile(r'\w+', flags=re.UNICODE)
+
+# _BIT_TABLES[b][v] = bit b của byte v: đếm bit theo từng cột bằng bytes.translate
+# + bytes.count (chạy trong C) thay vì lặp 64 bit cho mỗi feature
+_BIT_TABLES = [bytes((value >> bit) & 1 for value in range(256)) for bit in range(8)]
+
+LOOKUP_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05)
+
+# Số (user, language) được nhớ hash partition; quá số này thì xóa cache
+_MAX_PARTITION_KEYS = 100000
+
+# Đồng bộ lại các session mới hơn mốc này (session của worker khác, write-behind
+# có created_at sớm hơn lúc được flush)
+_SYNC_SLACK = timedelta(minutes=1)
+
+
+def simhash(features: List[str]) -> int:
+    """
+    SimHash 64 bit: mỗi bit là đa số phiếu của bit tương ứng trong hash các feature
+    """
+    if not features:
+        return 0
+    data = b''.join(
+        hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest() for feature in features
+    )
+    half = len(features) / 2
+    value = 0
+    for byte in range(8):
+        column = data[byte::8]
+        for bit in range(8):
+            if column.translate(_BIT_TABLES[bit]).count(1) > half:
+                value |= 1 << (byte * 8 + bit)
+    return value
+
+
+def query_fingerprint(query: Optional[str]) -> int:
+    """
+    Câu hỏi: chữ thường, bỏ dấu câu / khoảng trắng, feature = từ + cặp từ liền nhau
+    """
+    words = _WORD_RE.findall((query or '').lower())
+    return simhash(words + [f"{a} {b}" for a, b in zip(words, words[1:])])
+
+
+def context_fingerprint(code_context: Optional[str]) -> int:
+    """
+    Code: feature = từng dòng không rỗng đã bỏ hết khoảng trắng, nên thụt lề /
+    định dạng lại không ảnh hưởng; giữ hoa / thường của identifier
+    """
+    lines = (''.join(line.split()) for line in (code_context or '').splitlines())
+    return simhash([line for line in lines if line])
+
+
+def _popcount(value: int) -> int:
+    # int.bit_count chỉ có từ Python 3.10
+    return bin(value).count('1')
+
+
+def _signed(value: int) -> int:
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _unsigned(value: int) -> int:
+    return value & 0xFFFFFFFFFFFFFFFF
+
+
+def similarity(distance: int) -> float:
+    return 1 - distance / 64
+
+
+class NearDuplicateIndex:
+    """
+    Index SimHash trong bộ nhớ trên các CodeSession đã lưu, để trả lời lại
+    các câu hỏi gần giống mà không gọi OpenAI.
+
+    - fingerprint của query và code_context được tính lúc insert và lưu trong
+      code_session (query_simhash / context_simhash), khởi động chỉ cần đọc 2 cột số
+    - tìm kiếm bằng LSH banding: fingerprint của query chia thành
+      max_distance + 1 dải bit, hai fingerprint lệch <= max_distance bit chắc
+      chắn trùng ít nhất một dải (nguyên lý Dirichlet) nên chỉ cần xét các
+      session cùng bucket -> thời gian tra cứu gần như không đổi khi index lớn lên
+    - bucket được tách theo partition (user, language): câu hỏi phổ biến của
+      user khác không dồn vào bucket của mình, và được thu gọn khi gỡ session
+    - cả query lẫn code_context đều phải đạt ngưỡng: cùng đoạn code nhưng hỏi
+      khác không được dùng lại câu trả lời
+    - mặc định chỉ tìm trong session của chính user (NEAR_DUP_SCOPE='user')
+    """
+
+    def __init__(self):
+        self.app = None
+        self.enabled = False
+        self.threshold = 0.95
+        self.scope = 'user'
+        self.sync_interval = 5.0
+        self.max_distance = 3
+        self._bands: List[Tuple[int, int]] = []
+        # Dữ liệu theo vị trí (array thay cho object để giữ được hàng triệu session)
+        self._ids = array('q')
+        self._partitions = array('q')
+        self._query_fps = array('Q')
+        self._context_fps = array('Q')
+        # (partition, dải, giá trị bit của dải) -> vị trí còn sống
+        self._buckets: Dict[int, array] = {}
+        self._partition_keys: Dict[Tuple[int, str], int] = {}
+        self._lock = threading.RLock()
+        self._synced_at: Optional[datetime] = None
+        self._checked_at = 0.0
+        self.size = 0
+        self.removed = 0
+        self.lookups = 0
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.candidates = 0
+        self.tokens_saved = 0
+        self.total_lookup_time = 0.0
+        self.max_lookup_time = 0.0
+        self.latency = metrics.histogram(
+            'near_duplicate_lookup_seconds', 'Near-duplicate index lookup latency (fingerprint + probe)',
+            ('outcome',), LOOKUP_BUCKETS
+        )
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config.get('NEAR_DUP_ENABLED', False)
+        self.threshold = app.config.get('NEAR_DUP_THRESHOLD', 0.95)
+        self.scope = app.config.get('NEAR_DUP_SCOPE', 'user')
+        self.sync_interval = app.config.get('NEAR_DUP_SYNC_INTERVAL', 5.0)
+        self.max_distance = max(0, min(63, int((1 - self.threshold) * 64 + 1e-9)))
+        self._bands = _split_bands(self.max_distance + 1)
+        if not self.enabled:
+            return
+
+        with app.app_context():
+            started = time.monotonic()
+            loaded = self.rebuild()
+        logger.info("Near-duplicate index loaded %s sessions in %.2fs", loaded, time.monotonic() - started)
+        metrics.register_stats('near_duplicate', self.stats)
+
+    def _partition(self, user_id, language: Optional[str]) -> int:
+        key = (int(user_id) if self.scope == 'user' else 0, (language or '').strip().lower())
+        with self._lock:
+            partition = self._partition_keys.get(key)
+        if partition is not None:
+            return partition
+        digest = hashlib.blake2b(repr(key).encode('utf-8'), digest_size=8).digest()
+        partition = _signed(int.from_bytes(digest, 'little'))
+        with self._lock:
+            if len(self._partition_keys) >= _MAX_PARTITION_KEYS:
+                self._partition_keys.clear()
+            self._partition_keys[key] = partition
+        return partition
+
+    def _bucket_keys(self, query_fp: int, partition: int):
+        prefix = _unsigned(partition) << 72
+        for band, (shift, mask) in enumerate(self._bands):
+            yield prefix | band << 64 | (query_fp >> shift) & mask
+
+    def add(self, session_id: int, user_id, language: Optional[str], query_fp: int, context_fp: int) -> None:
+        partition = self._partition(user_id, language)
+        keys = list(self._bucket_keys(query_fp, partition))
+        with self._lock:
+            # Session có thể đã được thêm (after_insert rồi đồng bộ lại)
+            if any(self._ids[position] == session_id for position in self._buckets.get(keys[0], ())):
+                return
+            position = len(self._ids)
+            self._ids.append(session_id)
+            self._partitions.append(partition)
+            self._query_fps.append(query_fp)
+            self._context_fps.append(context_fp)
+            for key in keys:
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    bucket = self._buckets[key] = array('I')
+                bucket.append(position)
+            self.size += 1
+
+    def _remove_position(self, position: int) -> None:
+        """
+        Gỡ vị trí khỏi mọi bucket của nó (bucket rỗng bị xóa). Slot trong các
+        array theo vị trí chỉ được thu hồi khi rebuild
+        """
+        with self._lock:
+            if not self._ids[position]:
+                return
+            self._ids[position] = 0
+            self.size -= 1
+            self.removed += 1
+            for key in self._bucket_keys(self._query_fps[position], self._partitions[position]):
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    continue
+                try:
+                    bucket.remove(position)
+                except ValueError:
+                    pass
+                if not bucket:
+                    del self._buckets[key]
+
+    def remove(self, session_id: int, user_id, language: Optional[str], query_fp: int) -> None:
+        key = next(self._bucket_keys(query_fp, self._partition(user_id, language)))
+        with self._lock:
+            for position in list(self._buckets.get(key, ())):
+                if self._ids[position] == session_id:
+                    self._remove_position(position)
+
+    def remove_sessions(self, session_ids: List[int]) -> None:
+        """
+        Gỡ các session sắp bị xóa hàng loạt (retention), gọi trước khi DELETE
+        """
+        if not self.enabled or not session_ids:
+            return
+        rows = db.session.query(
+            CodeSession.id, CodeSession.user_id, CodeSession.language, CodeSession.query_simhash
+        )\
+            .filter(CodeSession.id.in_(session_ids))\
+            .filter(CodeSession.query_simhash.isnot(None))\
+            .all()
+        for row in rows:
+            self.remove(row.id, row.user_id, row.language, _unsigned(row.query_simhash))
+
+    def rebuild(self, batch_size: int = 5000) -> int:
+        """
+        Đọc lại toàn bộ fingerprint từ code_session
+        """
+        with self._lock:
+            self._ids = array('q')
+            self._partitions = array('q')
+            self._query_fps = array('Q')
+            self._context_fps = array('Q')
+            self._buckets = {}
+            self.size = 0
+            self._synced_at = datetime.utcnow()
+            self._checked_at = time.monotonic()
+
+        last_id = 0
+        while True:
+            rows = self._fingerprint_rows()\
+                .filter(CodeSession.id > last_id)\
+                .order_by(CodeSession.id)\
+                .limit(batch_size)\
+                .all()
+            if not rows:
+                break
+            self._add_rows(rows)
+            last_id = rows[-1].id
+        return self.size
+
+    def _fingerprint_rows(self):
+        return db.session.query(
+            CodeSession.id,
+            CodeSession.user_id,
+            CodeSession.language,
+            CodeSession.query_simhash,
+            CodeSession.context_simhash
+        ).filter(CodeSession.query_simhash.isnot(None))
+
+    def _add_rows(self, rows) -> None:
+        for row in rows:
+            self.add(
+                row.id, row.user_id, row.language,
+                _unsigned(row.query_simhash), _unsigned(row.context_simhash or 0)
+            )
+
+    def _maybe_sync(self) -> None:
+        """
+        Thêm các session do worker khác insert (mỗi sync_interval giây)
+        """
+        if time.monotonic() - self._checked_at < self.sync_interval:
+            return
+        with self._lock:
+            if time.monotonic() - self._checked_at < self.sync_interval:
+                return
+            self._checked_at = time.monotonic()
+            since = self._synced_at - _SYNC_SLACK
+            self._synced_at = datetime.utcnow()
+        self._add_rows(
+            self._fingerprint_rows()
+            .filter(CodeSession.created_at >= since)
+            .all()
+        )
+
+    def find(self, user_id, query: str, code_context: Optional[str], language: Optional[str]) -> List[Tuple[int, int, float]]:
+        """
+        Các session gần giống nhất: [(position, session_id, similarity)], tốt nhất trước
+        """
+        query_fp = query_fingerprint(query)
+        context_fp = context_fingerprint(code_context)
+        partition = self._partition(user_id, language)
+        limit = self.max_distance
+        matches = []
+        with self._lock:
+            seen = set()
+            for key in self._bucket_keys(query_fp, partition):
+                for position in self._buckets.get(key, ()):
+                    if position in seen:
+                        continue
+                    seen.add(position)
+                    session_id = self._ids[position]
+                    # Hash partition có thể trùng (rất hiếm) -> vẫn so lại
+                    if not session_id or self._partitions[position] != partition:
+                        continue
+                    query_distance = _popcount(query_fp ^ self._query_fps[position])
+                    if query_distance > limit:
+                        continue
+                    stored_context = self._context_fps[position]
+                    # Code rỗng chỉ khớp với code rỗng
+                    if bool(context_fp) != bool(stored_context):
+                        continue
+                    distance = max(query_distance, _popcount(context_fp ^ stored_context))
+                    if distance <= limit:
+                        matches.append((distance, -session_id, position))
+            self.candidates += len(seen)
+        matches.sort()
+        return [(position, -negative_id, similarity(distance)) for distance, negative_id, position in matches[:5]]
+
+    def answer(self, user_id, query: str, code_context: Optional[str], language: Optional[str]) -> Optional[Dict[str, Any]]:
+        """
+        Kết quả dạng CodeAssistant.process_request lấy từ session gần giống
+        nhất đạt ngưỡng, hoặc None (cần app context)
+        """
+        if not self.enabled or not query:
+            return None
+        started = time.perf_counter()
+        self._maybe_sync()
+        lookup_started = time.perf_counter()
+        matches = self.find(user_id, query, code_context, language)
+        elapsed = time.perf_counter() - lookup_started
+        partition = self._partition(user_id, language)
+
+        for position, session_id, score in matches:
+            candidate = db.session.query(CodeSession)\
+                .filter(CodeSession.id == session_id)
+            if self.scope == 'user':
+                candidate = candidate.filter(CodeSession.user_id == int(user_id))
+            session = candidate.first()
+            # Kiểm tra lại trên row thật: id trong index có thể đã thuộc về row khác
+            if session is not None and self._partition(session.user_id, session.language) != partition:
+                session = None
+            response = session.response if session is not None else None
+            if not response:
+                # Đã bị xóa ở worker khác, hoặc transaction insert bị rollback
+                self._remove_position(position)
+                with self._lock:
+                    self.stale += 1
+                continue
+            self._record(elapsed, 'hit', session.tokens_used or 0)
+            logger.debug("Near-duplicate of session %s (similarity %.3f)", session_id, score)
+            return {
+                'success': True,
+                'response': response,
+                'tokens_used': 0,
+                'response_time': time.perf_counter() - started,
+                'model': session.model,
+                'cached': True,
+                'near_duplicate': {
+                    'session_id': session_id,
+                    'similarity': score
+                }
+            }
+        self._record(elapsed, 'miss')
+        return None
+
+    def _record(self, elapsed: float, outcome: str, tokens_saved: int = 0) -> None:
+        self.latency.observe(elapsed, outcome)
+        with self._lock:
+            self.lookups += 1
+            if outcome == 'hit':
+                self.hits += 1
+                self.tokens_saved += tokens_saved
+            else:
+                self.misses += 1
+            self.total_lookup_time += elapsed
+            self.max_lookup_time = max(self.max_lookup_time, elapsed)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'threshold': self.threshold,
+                'max_distance': self.max_distance,
+                'bands': len(self._bands),
+                'size': self.size,
+                'removed': self.removed,
+                'buckets': len(self._buckets),
+                'lookups': self.lookups,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / self.lookups if self.lookups else 0.0,
+                'stale': self.stale,
+                'avg_candidates': self.candidates / self.lookups if self.lookups else 0.0,
+                'tokens_saved': self.tokens_saved,
+                'avg_lookup_time': self.total_lookup_time / self.lookups if self.lookups else 0.0,
+                'max_lookup_time': self.max_lookup_time
+            }
+
+
+def _split_bands(count: int) -> List[Tuple[int, int]]:
+    """
+    Chia 64 bit thành count dải gần bằng nhau: [(shift, mask)]
+    """
+    count = max(1, min(64, count))
+    bands = []
+    shift = 0
+    for band in range(count):
+        width = 64 // count + (1 if band < 64 % count else 0)
+        bands.append((shift, (1 << width) - 1))
+        shift += width
+    return bands
+
+
+near_duplicates = NearDuplicateIndex()
+
+
+def backfill_fingerprints(batch_size: int = 500) -> int:
+    """
+    Tính fingerprint cho các session cũ (trước khi bật NEAR_DUP_ENABLED).
+    Các worker đang chạy chỉ thấy chúng sau khi khởi động lại
+    """
+    table = CodeSession.__table__
+    statement = table.update()\
+        .where(table.c.id == bindparam('session_id'))\
+        .values(query_simhash=bindparam('query_fp'), context_simhash=bindparam('context_fp'))
+    updated = 0
+    last_id = 0
+    while True:
+        sessions = db.session.query(CodeSession)\
+            .filter(CodeSession.query_simhash.is_(None))\
+            .filter(CodeSession.id > last_id)\
+            .order_by(CodeSession.id)\
+            .limit(batch_size)\
+            .all()
+        if not sessions:
+            break
+        # Core UPDATE: không kích hoạt after_update (index FTS không cần làm lại)
+        db.session.execute(statement, [{
+            'session_id': s.id,
+            'query_fp': _signed(query_fingerprint(s.query)),
+            'context_fp': _signed(context_fingerprint(s.code_context))
+        } for s in sessions])
+        db.session.commit()
+        last_id = sessions[-1].id
+        updated += len(sessions)
+    return updated
+
+
+def _fingerprint_new_sessions(session, flush_context, instances):
+    """
+    Tính fingerprint cho CodeSession mới trước khi models._store_context_blobs
+    chuyển code_context sang ContentBlob (nên được đăng ký với insert=True)
+    """
+    if not near_duplicates.enabled:
+        return
+    for obj in session.new:
+        if isinstance(obj, CodeSession) and obj.query_simhash is None:
+            pending = getattr(obj, '_pending_context', None)
+            obj.query_simhash = _signed(query_fingerprint(obj.query))
+            obj.context_simhash = _signed(context_fingerprint(
+                pending if pending is not None else obj.raw_code_context
+            ))
+
+
+event.listen(db.session, 'before_flush', _fingerprint_new_sessions, insert=True)
+
+
+@event.listens_for(CodeSession, 'after_insert')
+def _index_session(mapper, connection, target):
+    # Chỉ thêm vào index sau khi commit: row bị rollback không được để lại id
+    # (SQLite có thể cấp lại rowid đó cho session của user khác)
+    session = object_session(target)
+    if near_duplicates.enabled and target.query_simhash is not None and session is not None:
+        session.info.setdefault('near_duplicate_pending', []).append((
+            target.id, target.user_id, target.language,
+            _unsigned(target.query_simhash), _unsigned(target.context_simhash or 0)
+        ))
+
+
+@event.listens_for(db.session, 'after_commit')
+def _index_committed(session):
+    for entry in session.info.pop('near_duplicate_pending', ()):
+        near_duplicates.add(*entry)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_rolled_back(session):
+    session.info.pop('near_duplicate_pending', None)
+
+
+@event.listens_for(CodeSession, 'after_delete')
+def _unindex_session(mapper, connection, target):
+    if near_duplicates.enabled and target.query_simhash is not None:
+        near_duplicates.remove(target.id, target.user_id, target.language, _unsigned(target.query_simhash))
\ No newline at end of file
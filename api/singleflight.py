@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import threading
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Gộp các lời gọi giống hệt nhau đang chạy đồng thời (giữa các thread
+    trong cùng process): thread đầu tiên (leader) thực hiện lời gọi,
+    các thread sau (follower) chờ và dùng chung kết quả
+    """
+
+    def __init__(self, timeout: float = 60.0):
+        self.timeout = timeout
+        self._calls = {}
+        # Lời gọi async: key -> asyncio.Future (chỉ truy cập từ event loop)
+        self._async_calls = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+        self.timeouts = 0
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Thực hiện fn() một lần cho mỗi key đang in-flight.
+        Trả về (kết quả, shared) với shared=True nếu dùng lại kết quả của leader
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self.leaders += 1
+
+        if leader:
+            try:
+                call.result = fn()
+                return call.result, False
+            except Exception as e:
+                call.error = e
+                raise
+            finally:
+                with self._lock:
+                    self._calls.pop(key, None)
+                call.event.set()
+
+        # Follower: chờ leader, hết timeout thì tự gọi để không bị treo mãi
+        if not call.event.wait(self.timeout):
+            with self._lock:
+                self.timeouts += 1
+            logger.warning("Single-flight leader timed out after %ss, calling directly", self.timeout)
+            return fn(), False
+
+        with self._lock:
+            self.coalesced += 1
+        if call.error is not None:
+            raise call.error
+        return call.result, True
+
+    async def do_async(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Bản async của do(): follower await future của leader thay vì chặn thread
+        """
+        call = self._async_calls.get(key)
+        if call is None:
+            call = asyncio.get_running_loop().create_future()
+            self._async_calls[key] = call
+            with self._lock:
+                self.leaders += 1
+            try:
+                result = await fn()
+                call.set_result(result)
+                return result, False
+            except asyncio.CancelledError:
+                call.cancel()
+                raise
+            except Exception as e:
+                call.set_exception(e)
+                # Đánh dấu đã đọc để asyncio không cảnh báo khi không có follower
+                call.exception()
+                raise
+            finally:
+                self._async_calls.pop(key, None)
+
+        try:
+            result = await asyncio.wait_for(asyncio.shield(call), self.timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self.timeouts += 1
+            logger.warning("Single-flight leader timed out after %ss, calling directly", self.timeout)
+            return await fn(), False
+        except asyncio.CancelledError:
+            if not call.cancelled():
+                raise
+            # Leader bị hủy (client ngắt kết nối) -> tự gọi
+            return await fn(), False
+
+        with self._lock:
+            self.coalesced += 1
+        return result, True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'in_flight': len(self._calls) + len(self._async_calls),
+                'leaders': self.leaders,
+                'coalesced': self.coalesced,
+                'timeouts': self.timeouts,
+                'timeout': self.timeout
+            }
\ No newline at end of file
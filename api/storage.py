@@ -0,0 +1,111 @@
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict
+
+from .database import db
+from .models import CodeSession, ContentBlob
+from .compression import should_compress
+
+logger = logging.getLogger(__name__)
+
+
+def backfill_sessions(batch_size: int = 500) -> Dict[str, int]:
+    """
+    Chuyển các CodeSession cũ (text thô) sang dạng nén / content-addressed.
+    Chạy theo từng batch và commit sau mỗi batch nên có thể dừng và chạy lại
+    """
+    converted = 0
+    last_id = 0
+    while True:
+        sessions = db.session.query(CodeSession)\
+            .filter(
+                CodeSession.id > last_id,
+                db.or_(
+                    CodeSession.raw_code_context != None,  # noqa: E711
+                    CodeSession.raw_response != None  # noqa: E711
+                )
+            )\
+            .order_by(CodeSession.id)\
+            .limit(batch_size)\
+            .all()
+        if not sessions:
+            break
+
+        for session in sessions:
+            last_id = session.id
+            changed = False
+            if should_compress(session.raw_code_context):
+                session.code_context = session.raw_code_context
+                changed = True
+            if should_compress(session.raw_response):
+                session.response = session.raw_response
+                changed = True
+            if changed:
+                converted += 1
+        db.session.commit()
+        logger.info("Backfilled sessions up to id %s (%s converted)", last_id, converted)
+
+    return {'converted': converted}
+
+
+def delete_orphan_blobs(grace: float = 3600) -> int:
+    """
+    Xóa các ContentBlob không còn CodeSession nào tham chiếu và không được
+    dùng lại trong grace giây gần nhất. Session mới dùng lại blob cập nhật
+    last_used_at trong transaction insert của nó, nên DELETE (kiểm tra lại
+    điều kiện trên row đó) không xóa blob sắp được tham chiếu
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=grace)
+    referenced = db.session.query(CodeSession.context_hash)\
+        .filter(CodeSession.context_hash != None)  # noqa: E711
+    deleted = db.session.query(ContentBlob)\
+        .filter(
+            db.func.coalesce(ContentBlob.last_used_at, ContentBlob.created_at) < cutoff,
+            ~ContentBlob.hash.in_(referenced)
+        )\
+        .delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
+
+
+def storage_report() -> Dict[str, Any]:
+    """
+    Báo cáo dung lượng: kích thước gốc so với kích thước thực tế đang lưu
+    """
+    length = db.func.length
+    coalesce = db.func.coalesce
+
+    raw_context, raw_response = db.session.query(
+        coalesce(db.func.sum(length(CodeSession.raw_code_context)), 0),
+        coalesce(db.func.sum(length(CodeSession.raw_response)), 0)
+    ).one()
+    compressed_response, original_response = db.session.query(
+        coalesce(db.func.sum(length(CodeSession.response_data)), 0),
+        coalesce(db.func.sum(CodeSession.response_size), 0)
+    ).one()
+    # Kích thước gốc của context = tổng size của blob theo số lần được tham chiếu
+    logical_context = db.session.query(
+        coalesce(db.func.sum(ContentBlob.size), 0)
+    ).join(CodeSession, CodeSession.context_hash == ContentBlob.hash).scalar()
+    blob_count, blob_stored, blob_original = db.session.query(
+        db.func.count(ContentBlob.hash),
+        coalesce(db.func.sum(length(ContentBlob.data)), 0),
+        coalesce(db.func.sum(ContentBlob.size), 0)
+    ).one()
+    session_count = db.session.query(db.func.count(CodeSession.id)).scalar()
+
+    original = raw_context + raw_response + original_response + logical_context
+    stored = raw_context + raw_response + compressed_response + blob_stored
+    return {
+        'sessions': session_count,
+        'blobs': blob_count,
+        'context_original_bytes': raw_context + logical_context,
+        'context_unique_bytes': raw_context + blob_original,
+        'context_stored_bytes': raw_context + blob_stored,
+        'response_original_bytes': raw_response + original_response,
+        'response_stored_bytes': raw_response + compressed_response,
+        'original_bytes': original,
+        'stored_bytes': stored,
+        'saved_bytes': original - stored,
+        'saved_ratio': (original - stored) / original if original else 0.0
+    }
\ No newline at end of file
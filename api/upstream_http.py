@@ -0,0 +1,166 @@
+import contextvars
+import logging
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import openai
+import requests
+from flask import request
+from openai import api_requestor
+
+logger = logging.getLogger(__name__)
+
+# Thời điểm (time.monotonic) phải trả lời xong request hiện tại; contextvar
+# nên đúng cho cả thread của Flask lẫn task asyncio của AsyncApp
+_deadline: contextvars.ContextVar = contextvars.ContextVar('upstream_deadline', default=None)
+
+
+class DeadlineExceeded(openai.error.Timeout):
+    """
+    Request đến đã hết thời gian, không gọi OpenAI nữa
+    """
+
+
+def set_deadline(seconds: Optional[float]) -> contextvars.Token:
+    """
+    Đặt deadline cho context hiện tại (None hoặc <= 0 = không giới hạn)
+    """
+    return _deadline.set(time.monotonic() + seconds if seconds and seconds > 0 else None)
+
+
+def reset_deadline(token: contextvars.Token) -> None:
+    _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """
+    Số giây còn lại của request hiện tại, None nếu không có deadline
+    """
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def request_budget(header_value: Optional[str], default: float) -> float:
+    """
+    Budget của request: giá trị client gửi trong header (giây) nhưng không
+    vượt quá budget mặc định của server
+    """
+    try:
+        requested = float(header_value) if header_value else 0
+    except ValueError:
+        requested = 0
+    if requested > 0 and (default <= 0 or requested < default):
+        return requested
+    return default
+
+
+def init_deadlines(app) -> None:
+    """
+    Mỗi request Flask có một deadline (REQUEST_DEADLINE, client có thể rút
+    ngắn qua header REQUEST_DEADLINE_HEADER); lời gọi OpenAI lấy timeout từ đó
+    """
+    default = app.config.get('REQUEST_DEADLINE', 0)
+    header = app.config.get('REQUEST_DEADLINE_HEADER', 'X-Request-Timeout')
+
+    def start_deadline():
+        request.environ['upstream_http.deadline_token'] = set_deadline(
+            request_budget(request.headers.get(header), default)
+        )
+
+    def clear_deadline(exc=None):
+        token = request.environ.pop('upstream_http.deadline_token', None)
+        if token is not None:
+            try:
+                reset_deadline(token)
+            except ValueError:
+                # Token tạo ở context khác (vd. generator stream) -> chỉ xóa giá trị
+                _deadline.set(None)
+
+    app.before_request(start_deadline)
+    app.teardown_request(clear_deadline)
+
+
+class PooledSession:
+    """
+    requests.Session dùng chung cho mọi lời gọi OpenAI đồng bộ: connection
+    pool có kích thước cố định, keep-alive, timeout connect / read tường minh.
+    openai 0.27 giữ một session riêng cho mỗi thread (api_requestor._thread_context),
+    install() gán session dùng chung vào đó trước mỗi lời gọi
+    """
+
+    def __init__(
+        self,
+        pool_connections: int = 4,
+        pool_maxsize: int = 64,
+        pool_block: bool = False,
+        keepalive: bool = True,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 60.0,
+        max_retries: int = 0
+    ):
+        self.pool_maxsize = pool_maxsize
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.deadline_exceeded = 0
+        self._lock = threading.Lock()
+
+        self.session = requests.Session()
+        self.adapter = requests.adapters.HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=pool_block,
+            max_retries=max_retries
+        )
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+        if not keepalive:
+            self.session.headers['Connection'] = 'close'
+        if openai.proxy:
+            self.session.proxies = api_requestor._requests_proxies_arg(openai.proxy)
+
+    def install(self) -> None:
+        if hasattr(openai, 'requestssession'):
+            openai.requestssession = self.session
+        else:
+            api_requestor._thread_context.session = self.session
+
+    def request_timeout(self) -> Tuple[float, float]:
+        """
+        (connect, read) timeout cho một lời gọi, read bị cắt theo thời gian
+        còn lại của request đến. Hết deadline -> DeadlineExceeded
+        """
+        left = remaining()
+        if left is None:
+            return self.connect_timeout, self.read_timeout
+        if left <= 0:
+            with self._lock:
+                self.deadline_exceeded += 1
+            raise DeadlineExceeded('Request deadline exceeded before calling OpenAI')
+        return min(self.connect_timeout, left), min(self.read_timeout, left)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Số connection đã mở / số request đã gửi qua pool: reuse_ratio gần 1
+        nghĩa là hầu hết request dùng lại connection keep-alive
+        """
+        pools = self.adapter.poolmanager.pools
+        connections = requests_sent = idle = 0
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            connections += pool.num_connections
+            requests_sent += pool.num_requests
+            idle += sum(1 for conn in list(pool.pool.queue) if conn is not None)
+        return {
+            'pools': len(pools),
+            'pool_maxsize': self.pool_maxsize,
+            'connections_opened': connections,
+            'requests': requests_sent,
+            'idle_connections': idle,
+            'reuse_ratio': 1 - connections / requests_sent if requests_sent else 0.0,
+            'deadline_exceeded': self.deadline_exceeded
+        }
\ No newline at end of file
@@ -0,0 +1,175 @@
+import logging
+from datetime import date, datetime, timedelta
+from functools import wraps
+from typing import Any, Dict, Tuple
+
+from flask import current_app, request
+from sqlalchemy import event
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from .database import db
+from .models import CodeSession, UsageRollup
+from .ratelimit import too_many_requests
+
+logger = logging.getLogger(__name__)
+
+
+def record_usage(connection, user_id: int, model: str, tokens: int, day: date, requests: int = 1) -> None:
+    """
+    Cộng dồn token / request vào UsageRollup bằng connection của transaction hiện tại
+    """
+    table = UsageRollup.__table__
+    model = model or ''
+    tokens = tokens or 0
+    if connection.dialect.name == 'sqlite':
+        statement = sqlite_insert(table).values(
+            user_id=user_id, day=day, model=model, tokens=tokens, requests=requests
+        )
+        connection.execute(statement.on_conflict_do_update(
+            index_elements=[table.c.user_id, table.c.day, table.c.model],
+            set_={
+                'tokens': table.c.tokens + statement.excluded.tokens,
+                'requests': table.c.requests + statement.excluded.requests
+            }
+        ))
+        return
+
+    result = connection.execute(
+        table.update()
+        .where(table.c.user_id == user_id)
+        .where(table.c.day == day)
+        .where(table.c.model == model)
+        .values(tokens=table.c.tokens + tokens, requests=table.c.requests + requests)
+    )
+    if not result.rowcount:
+        connection.execute(table.insert().values(
+            user_id=user_id, day=day, model=model, tokens=tokens, requests=requests
+        ))
+
+
+@event.listens_for(CodeSession, 'after_insert')
+def _rollup_session(mapper, connection, target):
+    created_at = target.created_at or datetime.utcnow()
+    record_usage(connection, target.user_id, target.model, target.tokens_used, created_at.date())
+
+
+def rebuild_rollups() -> int:
+    """
+    Tính lại toàn bộ UsageRollup từ CodeSession (dùng cho dữ liệu cũ)
+    """
+    day = db.func.date(CodeSession.created_at)
+    rows = db.session.query(
+        CodeSession.user_id,
+        day.label('day'),
+        db.func.coalesce(CodeSession.model, '').label('model'),
+        db.func.coalesce(db.func.sum(CodeSession.tokens_used), 0).label('tokens'),
+        db.func.count(CodeSession.id).label('requests')
+    ).group_by(CodeSession.user_id, day, db.func.coalesce(CodeSession.model, '')).all()
+
+    db.session.query(UsageRollup).delete()
+    db.session.bulk_insert_mappings(UsageRollup, [{
+        'user_id': row.user_id,
+        'day': date.fromisoformat(row.day) if isinstance(row.day, str) else row.day,
+        'model': row.model,
+        'tokens': row.tokens,
+        'requests': row.requests
+    } for row in rows if row.day])
+    db.session.commit()
+    return len(rows)
+
+
+def get_usage_totals(user_id: int, since: date) -> Tuple[int, int]:
+    """
+    Tổng (tokens, requests) từ ngày `since`; chỉ đọc tối đa (số ngày x số model) dòng
+    """
+    tokens, requests = db.session.query(
+        db.func.coalesce(db.func.sum(UsageRollup.tokens), 0),
+        db.func.coalesce(db.func.sum(UsageRollup.requests), 0)
+    ).filter(
+        UsageRollup.user_id == user_id,
+        UsageRollup.day >= since
+    ).one()
+    return tokens, requests
+
+
+def get_usage(user_id: int, days: int = 30) -> Dict[str, Any]:
+    today = datetime.utcnow().date()
+    month_start = today.replace(day=1)
+    since = min(today - timedelta(days=days - 1), month_start)
+
+    rows = db.session.query(UsageRollup)\
+        .filter(UsageRollup.user_id == user_id, UsageRollup.day >= since)\
+        .order_by(UsageRollup.day.desc())\
+        .all()
+
+    daily = {}
+    models = {}
+    month_tokens = month_requests = today_tokens = today_requests = 0
+    for row in rows:
+        if row.day >= today - timedelta(days=days - 1):
+            item = daily.setdefault(row.day.isoformat(), {'tokens': 0, 'requests': 0})
+            item['tokens'] += row.tokens
+            item['requests'] += row.requests
+            model = models.setdefault(row.model or 'unknown', {'tokens': 0, 'requests': 0})
+            model['tokens'] += row.tokens
+            model['requests'] += row.requests
+        if row.day >= month_start:
+            month_tokens += row.tokens
+            month_requests += row.requests
+        if row.day == today:
+            today_tokens += row.tokens
+            today_requests += row.requests
+
+    config = current_app.config
+    return {
+        'today': {'tokens': today_tokens, 'requests': today_requests},
+        'month': {'tokens': month_tokens, 'requests': month_requests},
+        'daily': [{'day': day, **values} for day, values in daily.items()],
+        'models': models,
+        'quota': {
+            'daily_tokens': config.get('USAGE_QUOTA_DAILY_TOKENS') or None,
+            'monthly_tokens': config.get('USAGE_QUOTA_MONTHLY_TOKENS') or None
+        }
+    }
+
+
+def check_quota(user_id: int, estimated: int = 0) -> Tuple[bool, str, float]:
+    """
+    Kiểm tra quota trước khi gọi OpenAI. Trả về (allowed, lý do, retry_after giây).
+    `estimated` là số token dự kiến sẽ dùng (vd. cả batch), bị từ chối nếu vượt phần quota còn lại
+    """
+    config = current_app.config
+    daily = config.get('USAGE_QUOTA_DAILY_TOKENS') or 0
+    monthly = config.get('USAGE_QUOTA_MONTHLY_TOKENS') or 0
+    if not daily and not monthly:
+        return True, '', 0.0
+
+    now = datetime.utcnow()
+    today = now.date()
+    if daily:
+        tokens, _ = get_usage_totals(user_id, today)
+        if tokens >= daily or tokens + estimated > daily:
+            tomorrow = datetime.combine(today + timedelta(days=1), datetime.min.time())
+            return False, 'Daily token quota exceeded', (tomorrow - now).total_seconds()
+    if monthly:
+        month_start = today.replace(day=1)
+        tokens, _ = get_usage_totals(user_id, month_start)
+        if tokens >= monthly or tokens + estimated > monthly:
+            next_month = (month_start + timedelta(days=32)).replace(day=1)
+            reset = datetime.combine(next_month, datetime.min.time())
+            return False, 'Monthly token quota exceeded', (reset - now).total_seconds()
+    return True, '', 0.0
+
+
+def enforce_quota(f):
+    """
+    Decorator từ chối request khi user đã dùng hết quota token (đặt sau @jwt_required)
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        allowed, reason, retry_after = check_quota(int(request.user_id))
+        if not allowed:
+            logger.debug("Quota exceeded for user %s: %s", request.user_id, reason)
+            return too_many_requests(retry_after, error=reason)
+        return f(*args, **kwargs)
+    return decorated
\ No newline at end of file
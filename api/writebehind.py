@@ -0,0 +1,237 @@
+import atexit
+import logging
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List
+
+from sqlalchemy import event
+
+from .database import db
+from .metrics import metrics
+from .models import CodeSession, IdAllocator
+
+logger = logging.getLogger(__name__)
+
+
+class SessionIdAllocator:
+    """
+    Cấp phát id cho CodeSession theo block lấy từ bảng IdAllocator (dùng chung
+    giữa các worker), nhờ đó có thể trả session_id trước khi row được insert
+    """
+
+    NAME = 'code_session'
+
+    def __init__(self, block_size: int = 100):
+        self.block_size = block_size
+        self._next = 0
+        self._end = 0
+        self._lock = threading.Lock()
+
+    def allocate(self) -> int:
+        with self._lock:
+            if self._next >= self._end:
+                self._next, self._end = self._reserve_block()
+            session_id = self._next
+            self._next += 1
+            return session_id
+
+    def _reserve_block(self):
+        table = IdAllocator.__table__
+        floor = db.select([db.func.coalesce(db.func.max(CodeSession.id), 0) + 1])\
+            .scalar_subquery()
+        # Connection riêng: block đã cấp phải được commit ngay, kể cả khi
+        # transaction của request bị rollback
+        with db.engine.begin() as conn:
+            result = conn.execute(
+                table.update()
+                .where(table.c.name == self.NAME)
+                .values(next_id=db.case(
+                    (table.c.next_id > floor, table.c.next_id),
+                    else_=floor
+                ) + self.block_size)
+            )
+            if not result.rowcount:
+                start = conn.execute(db.select([floor])).scalar()
+                conn.execute(table.insert().values(
+                    name=self.NAME,
+                    next_id=start + self.block_size
+                ))
+            end = conn.execute(
+                db.select([table.c.next_id]).where(table.c.name == self.NAME)
+            ).scalar()
+        return end - self.block_size, end
+
+
+class WriteBehindBuffer:
+    """
+    Gom các CodeSession mới vào buffer và insert theo batch (khi đủ
+    max_batch row hoặc sau flush_interval giây) trong một transaction
+    """
+
+    def __init__(self):
+        self.app = None
+        self.enabled = False
+        self.max_batch = 200
+        self.flush_interval = 0.1
+        self.allocator = SessionIdAllocator()
+        self._pending = []
+        self._pending_users = {}
+        self._lock = threading.Lock()
+        self._flushed = threading.Condition(self._lock)
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread = None
+        self.flushes = 0
+        self.rows_flushed = 0
+        self.failed_rows = 0
+        self.total_flush_time = 0.0
+        self.max_flush_time = 0.0
+        self.max_depth = 0
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config.get('WRITE_BEHIND_ENABLED', False)
+        self.max_batch = app.config.get('WRITE_BEHIND_MAX_BATCH', 200)
+        self.flush_interval = app.config.get('WRITE_BEHIND_FLUSH_INTERVAL', 0.1)
+        self.allocator.block_size = app.config.get('WRITE_BEHIND_ID_BLOCK', 100)
+        if self.enabled and self._thread is None:
+            self._thread = threading.Thread(
+                target=self._loop, name='write-behind', daemon=True
+            )
+            self._thread.start()
+            atexit.register(self.stop)
+        metrics.register_stats('write_behind', self.stats)
+
+    def enqueue(self, **fields) -> int:
+        """
+        Đưa một CodeSession vào buffer, trả về id đã được cấp phát trước
+        """
+        fields['id'] = self.allocator.allocate()
+        fields.setdefault('created_at', datetime.utcnow())
+        with self._lock:
+            self._pending.append(fields)
+            user_id = int(fields['user_id'])
+            self._pending_users[user_id] = self._pending_users.get(user_id, 0) + 1
+            depth = len(self._pending)
+            self.max_depth = max(self.max_depth, depth)
+        if depth >= self.max_batch:
+            self._wake.set()
+        return fields['id']
+
+    def wait_for_user(self, user_id, timeout: float = 5.0) -> None:
+        """
+        Read-your-writes: chờ các session đang chờ ghi của user được flush
+        """
+        user_id = int(user_id)
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            if not self._pending_users.get(user_id):
+                return
+            self._wake.set()
+            while self._pending_users.get(user_id):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logger.warning("Timed out waiting for write-behind flush of user %s", user_id)
+                    return
+                self._flushed.wait(remaining)
+
+    def flush(self) -> int:
+        """
+        Ghi toàn bộ buffer xuống DB (cần app context)
+        """
+        total = 0
+        while True:
+            with self._lock:
+                batch = self._pending[:self.max_batch]
+                del self._pending[:self.max_batch]
+            if not batch:
+                return total
+            started = time.monotonic()
+            failed = self._write(batch)
+            elapsed = time.monotonic() - started
+            total += len(batch)
+            with self._lock:
+                for fields in batch:
+                    user_id = int(fields['user_id'])
+                    self._pending_users[user_id] -= 1
+                    if not self._pending_users[user_id]:
+                        del self._pending_users[user_id]
+                self.flushes += 1
+                self.rows_flushed += len(batch) - failed
+                self.failed_rows += failed
+                self.total_flush_time += elapsed
+                self.max_flush_time = max(self.max_flush_time, elapsed)
+                self._flushed.notify_all()
+
+    def stop(self) -> None:
+        """
+        Flush phần còn lại khi tắt process
+        """
+        if self._stopped or self.app is None:
+            return
+        self._stopped = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+        with self.app.app_context():
+            self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'depth': len(self._pending),
+                'max_depth': self.max_depth,
+                'flushes': self.flushes,
+                'rows_flushed': self.rows_flushed,
+                'failed_rows': self.failed_rows,
+                'avg_flush_time': self.total_flush_time / self.flushes if self.flushes else 0.0,
+                'max_flush_time': self.max_flush_time
+            }
+
+    def _write(self, batch: List[Dict[str, Any]]) -> int:
+        try:
+            db.session.add_all([CodeSession(**fields) for fields in batch])
+            db.session.commit()
+            return 0
+        except Exception as e:
+            logger.error("Write-behind batch failed, retrying rows one by one: %s", e)
+            db.session.rollback()
+
+        failed = 0
+        for fields in batch:
+            try:
+                db.session.add(CodeSession(**fields))
+                db.session.commit()
+            except Exception as e:
+                logger.error("Write-behind dropped session %s: %s", fields['id'], e)
+                db.session.rollback()
+                failed += 1
+        return failed
+
+    def _loop(self) -> None:
+        while not self._stopped:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                with self.app.app_context():
+                    self.flush()
+            except Exception as e:
+                logger.error("Write-behind flush error: %s", e)
+
+
+write_behind = WriteBehindBuffer()
+
+
+@event.listens_for(db.session, 'before_flush')
+def _allocate_session_ids(session, flush_context, instances):
+    """
+    Khi bật write-behind, mọi CodeSession insert trực tiếp cũng lấy id từ
+    allocator để không trùng với id đã cấp cho các row còn trong buffer
+    """
+    if not write_behind.enabled:
+        return
+    for obj in session.new:
+        if isinstance(obj, CodeSession) and obj.id is None:
+            obj.id = write_behind.allocator.allocate()
\ No newline at end of file
@@ -0,0 +1,4 @@
+from api import create_async_app
+
+# uvicorn asgi:app --workers 1 --loop asyncio
+app = create_async_app()
\ No newline at end of file
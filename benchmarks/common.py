@@ -0,0 +1,102 @@
+"""
+Các hàm dùng chung cho benchmark: cấu hình môi trường trước khi import app,
+tính percentile và lưu kết quả JSON để so sánh giữa các lần chạy.
+"""
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+def configure_environment(password_iterations: Optional[int] = None, **overrides) -> str:
+    """
+    Đặt biến môi trường cho app benchmark. Phải gọi TRƯỚC khi import config/api
+    vì Config đọc env lúc import. Trả về đường dẫn file SQLite tạm.
+    Biến đã có sẵn trong env được giữ nguyên.
+    """
+    fd, db_path = tempfile.mkstemp(prefix='bench-', suffix='.db')
+    os.close(fd)
+
+    defaults = {
+        'DATABASE_URL': f"sqlite:///{db_path}",
+        'OPENAI_API_KEY': 'sk-benchmark',
+        # Key ký JWT sinh cho lần chạy này, không ghi vào instance/
+        'JWT_KEYS_DIR': tempfile.mkdtemp(prefix='bench-jwt-'),
+        # Benchmark đo throughput, không đo rate limiter
+        'RATE_LIMIT_ENABLED': 'false',
+        'RETENTION_WORKER_ENABLED': 'false'
+    }
+    if password_iterations:
+        defaults['PASSWORD_HASH_ITERATIONS'] = str(password_iterations)
+    defaults.update({key: str(value) for key, value in overrides.items()})
+
+    for key, value in defaults.items():
+        os.environ.setdefault(key, value)
+    return db_path
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """
+    Percentile theo nearest-rank trên list đã sort
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(p / 100.0 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(latencies: List[float], elapsed: Optional[float] = None) -> Dict[str, float]:
+    """
+    Thống kê latency (ms) và throughput (ops/s)
+    """
+    values = sorted(latencies)
+    count = len(values)
+    summary = {
+        'count': count,
+        'mean_ms': sum(values) / count * 1000 if count else 0.0,
+        'p50_ms': percentile(values, 50) * 1000,
+        'p95_ms': percentile(values, 95) * 1000,
+        'p99_ms': percentile(values, 99) * 1000,
+        'max_ms': values[-1] * 1000 if count else 0.0
+    }
+    if elapsed is None:
+        elapsed = sum(values)
+    summary['throughput'] = count / elapsed if elapsed else 0.0
+    return summary
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=ROOT, stderr=subprocess.DEVNULL
+        ).decode('ascii').strip()
+    except Exception:
+        return None
+
+
+def save_results(path: str, name: str, options: Dict[str, Any], results: List[Dict[str, Any]]) -> None:
+    """
+    Lưu kết quả kèm metadata (commit, python, thời điểm chạy)
+    """
+    payload = {
+        'benchmark': name,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'git_revision': _git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'options': options,
+        'results': results
+    }
+    with open(path, 'w') as f:
+        json.dump(payload, f, indent=2)
\ No newline at end of file
@@ -0,0 +1,270 @@
+"""
+Server giả lập OpenAI Chat Completions API chạy local, dùng cho benchmark
+(không cần API key thật, không tốn tiền, latency điều chỉnh được).
+
+Hỗ trợ:
+- latency cố định + jitter ngẫu nhiên cho mỗi request
+- streaming (SSE, giống stream=True của ChatCompletion.create)
+- inject lỗi 429 / 500 theo tỉ lệ, hoặc luôn lỗi với một số model (thử fallback)
+- một tỉ lệ request chậm bất thường (tail latency, thử hedged request)
+
+Chạy riêng: python -m benchmarks.fake_openai --port 8999 --latency 0.5
+rồi trỏ openai.api_base = 'http://127.0.0.1:8999/v1'
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Sequence
+
+
+class FakeOpenAIServer:
+    """
+    ThreadingHTTPServer trả về response có cùng format với OpenAI
+    """
+
+    def __init__(
+        self,
+        host: str = '127.0.0.1',
+        port: int = 0,
+        latency: float = 0.2,
+        jitter: float = 0.0,
+        chunk_delay: float = 0.01,
+        response_tokens: int = 120,
+        error_rate: float = 0.0,
+        error_status: int = 500,
+        slow_rate: float = 0.0,
+        slow_latency: float = 2.0,
+        failing_models: Sequence[str] = (),
+        seed: Optional[int] = None
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.chunk_delay = chunk_delay
+        self.response_tokens = response_tokens
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.failing_models = set(failing_models)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.streams = 0
+        self.slow = 0
+
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def api_base(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> 'FakeOpenAIServer':
+        self._thread = threading.Thread(
+            target=self.httpd.serve_forever, name='fake-openai', daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def install(self) -> 'FakeOpenAIServer':
+        """
+        Trỏ thư viện openai trong process hiện tại vào server giả
+        """
+        import openai
+        openai.api_base = self.api_base
+        openai.api_key = openai.api_key or 'sk-benchmark'
+        return self
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'errors': self.errors,
+                'streams': self.streams,
+                'slow': self.slow
+            }
+
+    def _sample(self, model: str):
+        """
+        Trả về (delay, lỗi hay không) cho một request
+        """
+        with self._lock:
+            self.requests += 1
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            if self._random.random() < self.slow_rate:
+                self.slow += 1
+                delay += self.slow_latency
+            failed = model in self.failing_models or self._random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+        return delay, failed
+
+    def _words(self, prompt: str):
+        seed = prompt.split()[-8:] or ['benchmark']
+        return [seed[i % len(seed)] for i in range(self.response_tokens)]
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def handle(self):
+                try:
+                    super().handle()
+                except (BrokenPipeError, ConnectionResetError):
+                    # Client hủy request (hedged request thua, ngắt stream)
+                    pass
+
+            def _send_json(self, status: int, payload: Dict[str, Any]) -> None:
+                body = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                try:
+                    params = json.loads(self.rfile.read(length) or b'{}')
+                except ValueError:
+                    params = {}
+
+                if not self.path.rstrip('/').endswith('/chat/completions'):
+                    self._send_json(404, {'error': {
+                        'message': f"Unknown path {self.path}",
+                        'type': 'invalid_request_error'
+                    }})
+                    return
+
+                delay, failed = server._sample(params.get('model', 'gpt-3.5-turbo'))
+                time.sleep(delay)
+
+                if failed:
+                    status = server.error_status
+                    if status == 429:
+                        self.send_response(429)
+                        self.send_header('Retry-After', '1')
+                        body = json.dumps({'error': {
+                            'message': 'Rate limit reached (injected)',
+                            'type': 'rate_limit_exceeded'
+                        }}).encode('utf-8')
+                    else:
+                        self.send_response(status)
+                        body = json.dumps({'error': {
+                            'message': 'The server had an error (injected)',
+                            'type': 'server_error'
+                        }}).encode('utf-8')
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+
+                messages = params.get('messages') or []
+                prompt = ' '.join(m.get('content', '') for m in messages)
+                model = params.get('model', 'gpt-3.5-turbo')
+                words = server._words(prompt)
+                prompt_tokens = max(1, len(prompt) // 4)
+                completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+                created = int(time.time())
+
+                if params.get('stream'):
+                    with server._lock:
+                        server.streams += 1
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/event-stream')
+                    self.send_header('Connection', 'close')
+                    self.end_headers()
+                    self.close_connection = True
+                    for i, word in enumerate(words):
+                        delta = {'content': (' ' if i else '') + word}
+                        if i == 0:
+                            delta['role'] = 'assistant'
+                        chunk = {
+                            'id': completion_id,
+                            'object': 'chat.completion.chunk',
+                            'created': created,
+                            'model': model,
+                            'choices': [{'index': 0, 'delta': delta, 'finish_reason': None}]
+                        }
+                        self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+                        self.wfile.flush()
+                        if server.chunk_delay:
+                            time.sleep(server.chunk_delay)
+                    self.wfile.write(b"data: [DONE]\n\n")
+                    self.wfile.flush()
+                    return
+
+                self._send_json(200, {
+                    'id': completion_id,
+                    'object': 'chat.completion',
+                    'created': created,
+                    'model': model,
+                    'choices': [{
+                        'index': 0,
+                        'message': {'role': 'assistant', 'content': ' '.join(words)},
+                        'finish_reason': 'stop'
+                    }],
+                    'usage': {
+                        'prompt_tokens': prompt_tokens,
+                        'completion_tokens': len(words),
+                        'total_tokens': prompt_tokens + len(words)
+                    }
+                })
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake OpenAI server for benchmarks')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8999)
+    parser.add_argument('--latency', type=float, default=0.2)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--chunk-delay', type=float, default=0.01)
+    parser.add_argument('--response-tokens', type=int, default=120)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--error-status', type=int, default=500, choices=[429, 500, 503])
+    parser.add_argument('--slow-rate', type=float, default=0.0)
+    parser.add_argument('--slow-latency', type=float, default=2.0)
+    parser.add_argument('--failing-models', nargs='*', default=[])
+    args = parser.parse_args()
+
+    server = FakeOpenAIServer(
+        host=args.host,
+        port=args.port,
+        latency=args.latency,
+        jitter=args.jitter,
+        chunk_delay=args.chunk_delay,
+        response_tokens=args.response_tokens,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        slow_rate=args.slow_rate,
+        slow_latency=args.slow_latency,
+        failing_models=args.failing_models
+    )
+    print(f"Fake OpenAI listening on {server.api_base}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
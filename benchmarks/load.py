@@ -0,0 +1,245 @@
+"""
+Load test end-to-end: chạy app từ create_app() trên server WSGI local (threaded),
+OpenAI được thay bằng benchmarks.fake_openai, rồi bắn register / login /
+code-assist / history ở nhiều mức concurrency.
+Báo cáo p50 / p95 / p99 latency, throughput và tỉ lệ lỗi cho từng scenario.
+
+Chạy: python -m benchmarks.load --concurrency 1 8 32 --requests 200 \\
+          --latency 0.3 --output load.json
+"""
+import argparse
+import itertools
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Tuple
+
+from benchmarks.common import configure_environment, save_results, summarize
+
+SCENARIOS = ('register', 'login', 'code_assist', 'code_assist_stream', 'history')
+
+PASSWORD = 'benchmark-password'
+
+
+class LoadRunner:
+    """
+    Gửi request HTTP thật tới app qua requests.Session (mỗi thread một session)
+    """
+
+    def __init__(self, base_url: str, repeat_queries: bool = False):
+        import requests
+        self._requests = requests
+        self.base_url = base_url
+        self.repeat_queries = repeat_queries
+        self._local = threading.local()
+        self._counter = itertools.count()
+        self.users: List[Dict[str, str]] = []
+
+    @property
+    def http(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = self._requests.Session()
+        return session
+
+    def _url(self, path: str) -> str:
+        return f"{self.base_url}{path}"
+
+    def _next_user(self) -> Dict[str, str]:
+        return self.users[next(self._counter) % len(self.users)]
+
+    def _auth(self, user: Dict[str, str]) -> Dict[str, str]:
+        return {'Authorization': f"Bearer {user['token']}"}
+
+    def register(self) -> int:
+        name = f"bench_{uuid.uuid4().hex[:12]}"
+        response = self.http.post(self._url('/api/auth/register'), json={
+            'username': name,
+            'email': f"{name}@bench.local",
+            'password': PASSWORD
+        })
+        return response.status_code
+
+    def login(self) -> int:
+        user = self._next_user()
+        response = self.http.post(self._url('/api/auth/login'), json={
+            'username': user['username'],
+            'password': PASSWORD
+        })
+        return response.status_code
+
+    def _query(self) -> str:
+        if self.repeat_queries:
+            return 'How do I reverse a list in Python?'
+        return f"How do I reverse a list in Python? ({uuid.uuid4().hex[:8]})"
+
+    def code_assist(self) -> int:
+        user = self._next_user()
+        response = self.http.post(
+            self._url('/api/code-assist'),
+            json={'query': self._query(), 'code_context': 'items = [1, 2, 3]', 'language': 'python'},
+            headers=self._auth(user)
+        )
+        return response.status_code
+
+    def code_assist_stream(self) -> int:
+        user = self._next_user()
+        response = self.http.post(
+            self._url('/api/code-assist/stream'),
+            json={'query': self._query(), 'code_context': 'items = [1, 2, 3]', 'language': 'python'},
+            headers=self._auth(user),
+            stream=True
+        )
+        # Đọc hết stream để đo thời gian tới event cuối cùng; lỗi upstream
+        # được báo bằng event 'error' trong khi HTTP status vẫn là 200
+        body = b''.join(response.iter_content(chunk_size=None))
+        if b'event: error' in body:
+            return 502
+        return response.status_code
+
+    def history(self) -> int:
+        user = self._next_user()
+        response = self.http.get(self._url('/api/history'), headers=self._auth(user))
+        return response.status_code
+
+    def prepare_users(self, count: int) -> None:
+        """
+        Tạo sẵn user + token cho các scenario cần đăng nhập
+        """
+        for _ in range(count):
+            name = f"bench_{uuid.uuid4().hex[:12]}"
+            response = self.http.post(self._url('/api/auth/register'), json={
+                'username': name,
+                'email': f"{name}@bench.local",
+                'password': PASSWORD
+            })
+            response.raise_for_status()
+            self.users.append({'username': name, 'token': response.json()['token']})
+
+    def run(self, operation: Callable[[], int], concurrency: int, total: int) -> Dict[str, Any]:
+        latencies: List[float] = []
+        statuses: Dict[str, int] = {}
+        lock = threading.Lock()
+
+        def call(_) -> None:
+            started = time.perf_counter()
+            try:
+                status = str(operation())
+            except Exception as e:
+                status = type(e).__name__
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                statuses[status] = statuses.get(status, 0) + 1
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            started = time.perf_counter()
+            list(executor.map(call, range(total)))
+            wall = time.perf_counter() - started
+
+        result = summarize(latencies, wall)
+        result['statuses'] = statuses
+        result['errors'] = sum(
+            count for status, count in statuses.items()
+            if not (status.isdigit() and int(status) < 400)
+        )
+        return result
+
+
+def start_app_server(app) -> Tuple[Any, str]:
+    """
+    Chạy app trên werkzeug threaded server ở port ngẫu nhiên
+    """
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietHandler)
+    thread = threading.Thread(target=server.serve_forever, name='bench-app', daemon=True)
+    thread.start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end load benchmark')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--requests', type=int, default=200, help='Số request mỗi scenario / mức concurrency')
+    parser.add_argument('--users', type=int, default=20, help='Số user tạo sẵn cho login / code-assist / history')
+    parser.add_argument('--password-iterations', type=int, default=1000,
+                        help='Cost hash password (mặc định thấp để register/login không chiếm hết CPU)')
+    parser.add_argument('--repeat-queries', action='store_true',
+                        help='Dùng cùng một query (đo đường cache / coalescing)')
+    parser.add_argument('--latency', type=float, default=0.2, help='Latency fake OpenAI (giây)')
+    parser.add_argument('--jitter', type=float, default=0.05)
+    parser.add_argument('--chunk-delay', type=float, default=0.005)
+    parser.add_argument('--response-tokens', type=int, default=120)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--error-status', type=int, default=500, choices=[429, 500, 503])
+    parser.add_argument('--slow-rate', type=float, default=0.0, help='Tỉ lệ request chậm bất thường')
+    parser.add_argument('--slow-latency', type=float, default=2.0)
+    parser.add_argument('--failing-models', nargs='*', default=[], help='Model luôn trả lỗi (thử fallback)')
+    parser.add_argument('--output', help='Lưu kết quả dạng JSON')
+    args = parser.parse_args()
+
+    db_path = configure_environment(password_iterations=args.password_iterations)
+
+    # Import sau khi đã cấu hình env
+    from benchmarks.fake_openai import FakeOpenAIServer
+    from api import create_app
+
+    fake = FakeOpenAIServer(
+        latency=args.latency,
+        jitter=args.jitter,
+        chunk_delay=args.chunk_delay,
+        response_tokens=args.response_tokens,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        slow_rate=args.slow_rate,
+        slow_latency=args.slow_latency,
+        failing_models=args.failing_models,
+        seed=0
+    ).start().install()
+
+    app = create_app()
+    app.config['DEBUG'] = False
+    server, base_url = start_app_server(app)
+    runner = LoadRunner(base_url, repeat_queries=args.repeat_queries)
+
+    results = []
+    try:
+        runner.prepare_users(args.users)
+        for concurrency in args.concurrency:
+            for scenario in args.scenarios:
+                result = runner.run(getattr(runner, scenario), concurrency, args.requests)
+                result.update({'scenario': scenario, 'concurrency': concurrency})
+                results.append(result)
+                print(
+                    f"{scenario:<20} c={concurrency:<4} "
+                    f"p50 {result['p50_ms']:8.1f} ms  p95 {result['p95_ms']:8.1f} ms  "
+                    f"p99 {result['p99_ms']:8.1f} ms  {result['throughput']:8.1f} req/s  "
+                    f"errors {result['errors']}"
+                )
+    finally:
+        server.shutdown()
+        fake.stop()
+        try:
+            os.remove(db_path)
+        except OSError:
+            pass
+
+    if args.output:
+        options = dict(vars(args))
+        options['fake_openai'] = fake.stats()
+        from api.routes import code_assistant
+        if code_assistant.resilience is not None:
+            options['upstream'] = code_assistant.resilience.stats()
+        save_results(args.output, 'load', options, results)
+
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
@@ -0,0 +1,110 @@
+"""
+Microbenchmark cho các hàm nằm trên hot path: jwt_required, generate_token,
+hash / verify password và format kết quả /history.
+
+Chạy: python -m benchmarks.micro --rounds 2000 --output micro.json
+"""
+import argparse
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict
+
+from benchmarks.common import configure_environment, save_results, summarize
+
+BENCHMARKS = ('jwt_required', 'generate_token', 'hash_password', 'verify_password', 'history_serialization')
+
+
+def measure(func: Callable[[], Any], rounds: int, warmup: int = 10) -> Dict[str, float]:
+    for _ in range(min(warmup, rounds)):
+        func()
+    latencies = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - started)
+    return summarize(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Microbenchmarks')
+    parser.add_argument('--benchmarks', nargs='+', choices=BENCHMARKS, default=list(BENCHMARKS))
+    parser.add_argument('--rounds', type=int, default=2000)
+    parser.add_argument('--password-rounds', type=int, default=20,
+                        help='Số vòng cho hash / verify (chậm theo thiết kế)')
+    parser.add_argument('--history-rows', type=int, default=50)
+    parser.add_argument('--output', help='Lưu kết quả dạng JSON')
+    args = parser.parse_args()
+
+    configure_environment()
+
+    # Import sau khi đã cấu hình env
+    from api import create_app
+    from api.auth import generate_token, jwt_required
+    from api.database import db
+    from api.models import User
+    from api.passwords import _hash_password, _verify_password, password_hasher
+    from api.routes import HISTORY_FIELDS, _serialize_history
+
+    app = create_app()
+    with app.app_context():
+        user = User(username='bench_micro', email='bench_micro@bench.local')
+        user.set_password('benchmark-password')
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+        token = generate_token(str(user_id))
+
+    @jwt_required
+    def protected():
+        return 'ok'
+
+    cases = {}
+
+    def bench_jwt_required():
+        with app.test_request_context(headers={'Authorization': f"Bearer {token}"}):
+            protected()
+    cases['jwt_required'] = (bench_jwt_required, args.rounds)
+
+    def bench_generate_token():
+        with app.app_context():
+            generate_token(str(user_id))
+    cases['generate_token'] = (bench_generate_token, args.rounds)
+
+    method = password_hasher.method
+    pwhash = _hash_password('benchmark-password', method)
+    cases['hash_password'] = (lambda: _hash_password('benchmark-password', method), args.password_rounds)
+    cases['verify_password'] = (lambda: _verify_password(pwhash, 'benchmark-password'), args.password_rounds)
+
+    Row = namedtuple('Row', HISTORY_FIELDS)
+    now = datetime.utcnow()
+    rows = [
+        Row(i, f"How do I reverse a list? #{i}", 'python', now - timedelta(minutes=i), 150)
+        for i in range(args.history_rows)
+    ]
+    fields = list(HISTORY_FIELDS)
+
+    def bench_history_serialization():
+        with app.test_request_context():
+            app.json_encoder().encode(_serialize_history(rows, fields))
+    cases['history_serialization'] = (bench_history_serialization, args.rounds)
+
+    results = []
+    for name in args.benchmarks:
+        func, rounds = cases[name]
+        result = measure(func, rounds)
+        result['benchmark'] = name
+        results.append(result)
+        print(
+            f"{name:<24} p50 {result['p50_ms']:9.3f} ms  p95 {result['p95_ms']:9.3f} ms  "
+            f"p99 {result['p99_ms']:9.3f} ms  {result['throughput']:10.1f} ops/s"
+        )
+
+    if args.output:
+        options = dict(vars(args))
+        options['password_method'] = method
+        save_results(args.output, 'micro', options, results)
+
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
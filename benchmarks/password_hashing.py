@@ -0,0 +1,75 @@
+"""
+Benchmark hash password: số lần login (verify) mỗi giây trên mỗi core
+với từng mức cost.
+
+Chạy: python -m benchmarks.password_hashing --iterations 100000 260000 600000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.passwords import _hash_password, _verify_password  # noqa: E402
+
+
+def _verify_many(pwhash: str, password: str, rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        _verify_password(pwhash, password)
+    return time.perf_counter() - start
+
+
+def bench(algorithm: str, iterations: int, rounds: int, workers: int) -> dict:
+    method = f"{algorithm}:{iterations}"
+    pwhash = _hash_password('benchmark-password', method)
+
+    # 1 core
+    elapsed = _verify_many(pwhash, 'benchmark-password', rounds)
+    per_core = rounds / elapsed
+
+    # Tất cả core qua process pool
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        start = time.perf_counter()
+        list(executor.map(_verify_many, [pwhash] * workers, ['benchmark-password'] * workers, [rounds] * workers))
+        pool_elapsed = time.perf_counter() - start
+    total = rounds * workers / pool_elapsed
+
+    return {
+        'method': method,
+        'verify_ms': elapsed / rounds * 1000,
+        'logins_per_sec_per_core': per_core,
+        'workers': workers,
+        'logins_per_sec_total': total
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Password hashing benchmark')
+    parser.add_argument('--algorithm', default='pbkdf2:sha256')
+    parser.add_argument('--iterations', type=int, nargs='+', default=[100000, 260000, 600000])
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--output', help='Lưu kết quả dạng JSON')
+    args = parser.parse_args()
+
+    results = []
+    for iterations in args.iterations:
+        result = bench(args.algorithm, iterations, args.rounds, args.workers)
+        results.append(result)
+        print(
+            f"{result['method']:<28} {result['verify_ms']:8.1f} ms/verify "
+            f"{result['logins_per_sec_per_core']:8.1f} logins/s/core "
+            f"{result['logins_per_sec_total']:9.1f} logins/s ({result['workers']} workers)"
+        )
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
@@ -16,10 +16,167 @@ class Config:
     # JWT config
     JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY', 'jwt-secret-key')
     JWT_ACCESS_TOKEN_EXPIRES = timedelta(days=1)
-    JWT_ALGORITHM = 'HS256'
+    # RS256 / EdDSA / ES256: ký bằng private key theo kid, public key công bố ở JWKS
+    JWT_ALGORITHM = os.getenv('JWT_ALGORITHM', 'RS256')
     JWT_TOKEN_LOCATION = ['headers']
     JWT_HEADER_NAME = 'Authorization'
     JWT_HEADER_TYPE = 'Bearer'
+    JWT_KEYS_DIR = os.getenv('JWT_KEYS_DIR', '')  # mặc định <instance>/jwt_keys
+    JWT_RSA_KEY_SIZE = int(os.getenv('JWT_RSA_KEY_SIZE', 2048))
+    # Key mới chỉ được dùng để ký sau khi đã công bố đủ lâu (>= JWKS_MAX_AGE)
+    JWT_KEY_ACTIVATION_DELAY = int(os.getenv('JWT_KEY_ACTIVATION_DELAY', 300))
+    JWT_KEYS_REFRESH_INTERVAL = int(os.getenv('JWT_KEYS_REFRESH_INTERVAL', 60))
+    # Vẫn chấp nhận token HS256 cũ (JWT_SECRET_KEY) trong thời gian chuyển đổi
+    JWT_ACCEPT_HS256 = os.getenv('JWT_ACCEPT_HS256', 'true').lower() == 'true'
+    JWKS_MAX_AGE = int(os.getenv('JWKS_MAX_AGE', 300))
     
     # OpenAI config
-    OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
\ No newline at end of file
+    OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+    
+    # Response cache config
+    RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', 'true').lower() == 'true'
+    RESPONSE_CACHE_MAX_SIZE = int(os.getenv('RESPONSE_CACHE_MAX_SIZE', 1024))
+    RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', 3600))
+    RESPONSE_CACHE_PERSISTENT = os.getenv('RESPONSE_CACHE_PERSISTENT', 'false').lower() == 'true'
+    
+    # Code-assist job queue config
+    CODE_ASSIST_WORKERS = int(os.getenv('CODE_ASSIST_WORKERS', 4))
+    CODE_ASSIST_QUEUE_SIZE = int(os.getenv('CODE_ASSIST_QUEUE_SIZE', 100))
+    # Job 'queued' / 'running' quá lâu (process chạy nó đã dừng) bị đánh dấu failed
+    CODE_ASSIST_JOB_STALE_AFTER = int(os.getenv('CODE_ASSIST_JOB_STALE_AFTER', 3600))  # giây
+    # Job đã xong (chứa nguyên query / code_context) bị xóa sau thời gian này
+    CODE_ASSIST_JOB_TTL = int(os.getenv('CODE_ASSIST_JOB_TTL', 86400))  # giây
+    
+    # Batch code-assist config
+    CODE_ASSIST_BATCH_MAX_ITEMS = int(os.getenv('CODE_ASSIST_BATCH_MAX_ITEMS', 50))
+    CODE_ASSIST_BATCH_CONCURRENCY = int(os.getenv('CODE_ASSIST_BATCH_CONCURRENCY', 8))
+    
+    # Single-flight (gộp request OpenAI giống nhau đang in-flight)
+    SINGLE_FLIGHT_ENABLED = os.getenv('SINGLE_FLIGHT_ENABLED', 'true').lower() == 'true'
+    SINGLE_FLIGHT_TIMEOUT = float(os.getenv('SINGLE_FLIGHT_TIMEOUT', 60))
+    
+    # Auth state cache / token denylist config
+    USER_STATE_CACHE_TTL = int(os.getenv('USER_STATE_CACHE_TTL', 60))
+    USER_STATE_CACHE_MAX_SIZE = int(os.getenv('USER_STATE_CACHE_MAX_SIZE', 100000))
+    AUTH_STATE_SYNC_INTERVAL = float(os.getenv('AUTH_STATE_SYNC_INTERVAL', 5))
+    TOKEN_DENYLIST_CAPACITY = int(os.getenv('TOKEN_DENYLIST_CAPACITY', 100000))
+    TOKEN_DENYLIST_ERROR_RATE = float(os.getenv('TOKEN_DENYLIST_ERROR_RATE', 0.001))
+    
+    # Password hashing config
+    PASSWORD_HASH_ALGORITHM = os.getenv('PASSWORD_HASH_ALGORITHM', 'pbkdf2:sha256')
+    PASSWORD_HASH_ITERATIONS = int(os.getenv('PASSWORD_HASH_ITERATIONS', 260000))
+    PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', os.cpu_count() or 1))
+    # '' = start method mặc định của nền tảng; 'fork' / 'forkserver' / 'spawn'
+    PASSWORD_HASH_START_METHOD = os.getenv('PASSWORD_HASH_START_METHOD', '')
+    
+    # Rate limit config ('memory' cho 1 process, 'database' để chia sẻ giữa các worker)
+    RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+    RATE_LIMIT_STORAGE = os.getenv('RATE_LIMIT_STORAGE', 'memory')
+    # Số bucket tối đa giữ trong memory (LRU), tránh phình theo username / IP lạ
+    RATE_LIMIT_MAX_KEYS = int(os.getenv('RATE_LIMIT_MAX_KEYS', 100000))
+    RATE_LIMITS = {
+        'login': {
+            'ip': os.getenv('RATE_LIMIT_LOGIN_IP', '20/minute'),
+            'user': os.getenv('RATE_LIMIT_LOGIN_USER', '5/minute')
+        },
+        'code_assist': {
+            'ip': os.getenv('RATE_LIMIT_CODE_ASSIST_IP', '60/minute'),
+            'user': os.getenv('RATE_LIMIT_CODE_ASSIST_USER', '20/minute')
+        }
+    }
+    CODE_ASSIST_TOKEN_BUDGET = os.getenv('CODE_ASSIST_TOKEN_BUDGET', '40000/minute')
+    
+    # History pagination config
+    HISTORY_PAGE_SIZE = int(os.getenv('HISTORY_PAGE_SIZE', 50))
+    HISTORY_MAX_PAGE_SIZE = int(os.getenv('HISTORY_MAX_PAGE_SIZE', 200))
+    HISTORY_QUERY_PREVIEW_LENGTH = int(os.getenv('HISTORY_QUERY_PREVIEW_LENGTH', 200))
+    
+    # Nén / khử trùng lặp nội dung CodeSession
+    SESSION_COMPRESSION_LEVEL = int(os.getenv('SESSION_COMPRESSION_LEVEL', 6))
+    SESSION_COMPRESSION_MIN_SIZE = int(os.getenv('SESSION_COMPRESSION_MIN_SIZE', 256))
+    
+    # Usage quota (0 = không giới hạn)
+    USAGE_QUOTA_DAILY_TOKENS = int(os.getenv('USAGE_QUOTA_DAILY_TOKENS', 0))
+    USAGE_QUOTA_MONTHLY_TOKENS = int(os.getenv('USAGE_QUOTA_MONTHLY_TOKENS', 0))
+    
+    # Retention config (0 = không giới hạn)
+    RETENTION_WORKER_ENABLED = os.getenv('RETENTION_WORKER_ENABLED', 'true').lower() == 'true'
+    RETENTION_MAX_AGE_DAYS = int(os.getenv('RETENTION_MAX_AGE_DAYS', 0))
+    RETENTION_MAX_SESSIONS_PER_USER = int(os.getenv('RETENTION_MAX_SESSIONS_PER_USER', 0))
+    RETENTION_INTERVAL = int(os.getenv('RETENTION_INTERVAL', 3600))
+    RETENTION_BATCH_SIZE = int(os.getenv('RETENTION_BATCH_SIZE', 500))
+    RETENTION_BATCH_PAUSE = float(os.getenv('RETENTION_BATCH_PAUSE', 0.05))
+    RETENTION_ARCHIVE_DIR = os.getenv('RETENTION_ARCHIVE_DIR', '')
+    # Xóa content blob mồ côi sau mỗi lần retention xóa session (opt-in)
+    BLOB_GC_ENABLED = os.getenv('BLOB_GC_ENABLED', 'false').lower() == 'true'
+    BLOB_GC_GRACE = int(os.getenv('BLOB_GC_GRACE', 3600))  # giây kể từ lần dùng cuối
+    
+    # Write-behind cho CodeSession (opt-in)
+    WRITE_BEHIND_ENABLED = os.getenv('WRITE_BEHIND_ENABLED', 'false').lower() == 'true'
+    WRITE_BEHIND_MAX_BATCH = int(os.getenv('WRITE_BEHIND_MAX_BATCH', 200))
+    WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv('WRITE_BEHIND_FLUSH_INTERVAL', 0.1))
+    WRITE_BEHIND_ID_BLOCK = int(os.getenv('WRITE_BEHIND_ID_BLOCK', 100))
+    
+    # Metrics (Prometheus text format). Tắt mặc định: /metrics lộ route, số user, trạng thái upstream
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'false').lower() == 'true'
+    METRICS_PATH = os.getenv('METRICS_PATH', '/metrics')
+    # Nếu đặt, scraper phải gửi header Authorization: Bearer <METRICS_TOKEN>
+    METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+    
+    # Logging (JSON qua QueueHandler/QueueListener)
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+    LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+    LOG_DEBUG_SAMPLE_RATE = float(os.getenv('LOG_DEBUG_SAMPLE_RATE', 0.1))
+    LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+    
+    # ASGI (create_async_app)
+    ASYNC_THREADS = int(os.getenv('ASYNC_THREADS', 32))
+    ASYNC_OPENAI_MAX_CONNECTIONS = int(os.getenv('ASYNC_OPENAI_MAX_CONNECTIONS', 1000))
+    
+    # Nén code_context theo token budget trước khi gửi lên OpenAI
+    PROMPT_COMPACTION_ENABLED = os.getenv('PROMPT_COMPACTION_ENABLED', 'true').lower() == 'true'
+    PROMPT_CONTEXT_BUDGET = int(os.getenv('PROMPT_CONTEXT_BUDGET', 3000))
+    PROMPT_MIN_COMPLETION_TOKENS = int(os.getenv('PROMPT_MIN_COMPLETION_TOKENS', 256))
+    PROMPT_SAFETY_MARGIN = int(os.getenv('PROMPT_SAFETY_MARGIN', 64))
+    MODEL_CONTEXT_WINDOWS = {
+        'gpt-3.5-turbo': 4096,
+        'gpt-3.5-turbo-16k': 16384,
+        'gpt-4': 8192,
+        'gpt-4-32k': 32768
+    }
+    DEFAULT_CONTEXT_WINDOW = int(os.getenv('DEFAULT_CONTEXT_WINDOW', 4096))
+    
+    # Resilience cho lời gọi OpenAI (retry / circuit breaker / hedging / fallback)
+    UPSTREAM_RESILIENCE_ENABLED = os.getenv('UPSTREAM_RESILIENCE_ENABLED', 'true').lower() == 'true'
+    UPSTREAM_MAX_RETRIES = int(os.getenv('UPSTREAM_MAX_RETRIES', 3))
+    UPSTREAM_RETRY_BASE_DELAY = float(os.getenv('UPSTREAM_RETRY_BASE_DELAY', 0.5))
+    UPSTREAM_RETRY_MAX_DELAY = float(os.getenv('UPSTREAM_RETRY_MAX_DELAY', 8.0))
+    UPSTREAM_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('UPSTREAM_CIRCUIT_FAILURE_THRESHOLD', 5))
+    UPSTREAM_CIRCUIT_RECOVERY_TIMEOUT = float(os.getenv('UPSTREAM_CIRCUIT_RECOVERY_TIMEOUT', 30.0))
+    UPSTREAM_HEDGE_AFTER = float(os.getenv('UPSTREAM_HEDGE_AFTER', 0))  # 0 = tắt hedging
+    # Số thread tối đa của pool hedging; pool đầy thì gọi thẳng, không hedge
+    UPSTREAM_HEDGE_WORKERS = int(os.getenv('UPSTREAM_HEDGE_WORKERS', 16))
+    UPSTREAM_FALLBACK_MODELS = [
+        m.strip() for m in os.getenv('UPSTREAM_FALLBACK_MODELS', '').split(',') if m.strip()
+    ]
+    
+    # HTTP client cho OpenAI (connection pool dùng chung, timeout, deadline)
+    OPENAI_POOL_CONNECTIONS = int(os.getenv('OPENAI_POOL_CONNECTIONS', 4))
+    OPENAI_POOL_MAXSIZE = int(os.getenv('OPENAI_POOL_MAXSIZE', 64))
+    OPENAI_POOL_BLOCK = os.getenv('OPENAI_POOL_BLOCK', 'false').lower() == 'true'
+    OPENAI_KEEPALIVE = os.getenv('OPENAI_KEEPALIVE', 'true').lower() == 'true'
+    OPENAI_CONNECT_TIMEOUT = float(os.getenv('OPENAI_CONNECT_TIMEOUT', 5.0))
+    OPENAI_READ_TIMEOUT = float(os.getenv('OPENAI_READ_TIMEOUT', 60.0))
+    REQUEST_DEADLINE = float(os.getenv('REQUEST_DEADLINE', 90.0))  # 0 = không giới hạn
+    REQUEST_DEADLINE_HEADER = os.getenv('REQUEST_DEADLINE_HEADER', 'X-Request-Timeout')
+    
+    # Dùng lại câu trả lời của session gần giống (SimHash), opt-in
+    NEAR_DUP_ENABLED = os.getenv('NEAR_DUP_ENABLED', 'false').lower() == 'true'
+    NEAR_DUP_THRESHOLD = float(os.getenv('NEAR_DUP_THRESHOLD', 0.95))  # 1 - số bit lệch / 64
+    NEAR_DUP_SCOPE = os.getenv('NEAR_DUP_SCOPE', 'user')  # 'global' = dùng chung giữa các user
+    NEAR_DUP_SYNC_INTERVAL = float(os.getenv('NEAR_DUP_SYNC_INTERVAL', 5.0))
+    
+    # Tạo user hàng loạt (POST /api/auth/users/bulk, flask users-import)
+    PROVISIONING_TOKEN = os.getenv('PROVISIONING_TOKEN', '')  # rỗng = tắt endpoint
+    PROVISIONING_BATCH_SIZE = int(os.getenv('PROVISIONING_BATCH_SIZE', 200))
+    PROVISIONING_MAX_CONTENT_LENGTH = int(os.getenv('PROVISIONING_MAX_CONTENT_LENGTH', 64 * 1024 * 1024))
\ No newline at end of file
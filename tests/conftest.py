@@ -0,0 +1,57 @@
+import itertools
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Config đọc biến môi trường lúc import -> phải đặt trước khi import api
+_TMP_DIR = tempfile.mkdtemp(prefix='api-tests-')
+os.environ.update({
+    'OPENAI_API_KEY': 'test-key',
+    'DATABASE_URL': 'sqlite:///' + os.path.join(_TMP_DIR, 'test.db'),
+    'JWT_KEYS_DIR': os.path.join(_TMP_DIR, 'jwt_keys'),
+    'PASSWORD_HASH_ITERATIONS': '1000',
+    'PASSWORD_HASH_WORKERS': '0',
+    'RATE_LIMIT_ENABLED': 'false',
+    'RETENTION_WORKER_ENABLED': 'false',
+    'WRITE_BEHIND_ENABLED': 'false',
+    'NEAR_DUP_ENABLED': 'false',
+    'LOG_LEVEL': 'WARNING'
+})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_user_ids = itertools.count(1)
+
+
+@pytest.fixture(scope='session')
+def app():
+    from api import create_app
+    app = create_app()
+    app.config['TESTING'] = True
+    return app
+
+
+@pytest.fixture
+def app_context(app):
+    from api.database import db
+    with app.app_context():
+        yield
+        db.session.rollback()
+
+
+@pytest.fixture
+def make_user(app_context):
+    """
+    Tạo user mới (tên không trùng giữa các test), trả về User
+    """
+    from api.database import db
+    from api.models import User
+
+    def factory(**fields):
+        n = next(_user_ids)
+        user = User(username=f'user{n}', email=f'user{n}@example.com', password_hash='x', **fields)
+        db.session.add(user)
+        db.session.commit()
+        return user
+    return factory
\ No newline at end of file
@@ -0,0 +1,101 @@
+import uuid
+from datetime import datetime, timedelta
+
+from api.auth_state import AuthState, BloomFilter
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(capacity=1000, error_rate=0.001)
+    items = [uuid.uuid4().hex for _ in range(1000)]
+    for item in items:
+        bloom.add(item)
+    assert all(item in bloom for item in items)
+    assert bloom.count == 1000
+
+
+def test_bloom_filter_false_positive_rate_is_bounded():
+    bloom = BloomFilter(capacity=1000, error_rate=0.001)
+    for _ in range(1000):
+        bloom.add(uuid.uuid4().hex)
+    false_positives = sum(uuid.uuid4().hex in bloom for _ in range(20000))
+    # Kỳ vọng ~0.1%, để dư nhiều cho dao động ngẫu nhiên
+    assert false_positives / 20000 < 0.01
+
+
+def test_revoked_token_is_denied(make_user):
+    user = make_user()
+    state = AuthState()
+    jti = uuid.uuid4().hex
+    assert not state.is_revoked(jti)
+
+    state.revoke_token(jti, user.id, datetime.utcnow() + timedelta(hours=1))
+    assert state.is_revoked(jti)
+    assert not state.is_revoked(uuid.uuid4().hex)
+    assert state.stats()['bloom_negatives'] >= 2
+
+
+def test_revocation_reaches_other_workers(make_user):
+    user = make_user()
+    worker_a = AuthState()
+    worker_b = AuthState()
+    worker_b.sync(force=True)
+
+    jti = uuid.uuid4().hex
+    worker_a.revoke_token(jti, user.id, datetime.utcnow() + timedelta(hours=1))
+    worker_b.sync(force=True)
+    assert worker_b.is_revoked(jti)
+
+
+def test_rebuild_keeps_active_revocations_only(make_user):
+    user = make_user()
+    state = AuthState()
+    active = uuid.uuid4().hex
+    expired = uuid.uuid4().hex
+    state.revoke_token(active, user.id, datetime.utcnow() + timedelta(hours=1))
+    state.revoke_token(expired, user.id, datetime.utcnow() - timedelta(seconds=1))
+
+    other = AuthState()
+    other.sync(force=True)
+    assert other.is_revoked(active)
+    assert not other.is_revoked(expired)
+
+
+def test_user_state_is_cached_and_invalidated(make_user):
+    from api.database import db
+
+    user = make_user()
+    state = AuthState()
+    assert state.is_user_active(user.id)
+    assert state.is_user_active(user.id)
+    assert state.stats()['user_hits'] == 1
+
+    user.is_active = False
+    db.session.commit()
+    state.invalidate_user(user.id)
+    assert not state.is_user_active(user.id)
+
+def test_user_cache_is_bounded(make_user):
+    state = AuthState()
+    state.max_users = 2
+    users = [make_user() for _ in range(3)]
+    state.is_user_active(users[0].id)
+    state.is_user_active(users[1].id)
+    state.is_user_active(users[0].id)
+    # users[1] ít được dùng gần đây nhất -> bị bỏ khi thêm users[2]
+    state.is_user_active(users[2].id)
+    assert list(state._users) == [users[0].id, users[2].id]
+    assert state.stats()['cached_users'] == 2
+
+
+def test_rebuild_does_not_commit_the_request_session(make_user):
+    from api.database import db
+    from api.models import User
+
+    user = make_user()
+    state = AuthState()
+    # Thay đổi đang chờ của request (chưa flush) không được commit bởi rebuild
+    user.email = 'pending-change@example.com'
+    with db.session.no_autoflush:
+        state.sync(force=True)
+    db.session.rollback()
+    assert db.session.query(User).get(user.id).email != 'pending-change@example.com'
\ No newline at end of file
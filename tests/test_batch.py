@@ -0,0 +1,70 @@
+import logging
+import threading
+
+import pytest
+
+from api.logging_config import RequestContextFilter
+
+
+class _Records(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+        self.addFilter(RequestContextFilter())
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+@pytest.fixture
+def headers(app):
+    client = app.test_client()
+    client.post('/api/auth/register', json={'username': 'batchlog', 'email': 'batchlog@example.com', 'password': 'pw'})
+    token = client.post('/api/auth/login', json={'username': 'batchlog', 'password': 'pw'}).get_json()['token']
+    return {'Authorization': f'Bearer {token}'}
+
+
+def test_batch_worker_logs_carry_the_request_id(app, headers, monkeypatch):
+    from api import routes
+
+    worker_logger = logging.getLogger('api.code_assistant')
+    handler = _Records()
+    worker_logger.addHandler(handler)
+
+    def process_request(query, code_context=None, language='python', use_cache=True):
+        worker_logger.warning("processing %s", query)
+        return {'success': True, 'response': 'ok', 'tokens_used': 1, 'model': 'test-model'}
+
+    monkeypatch.setattr(routes.code_assistant, 'process_request', process_request)
+    try:
+        response = app.test_client().post(
+            '/api/code-assist/batch',
+            json={'items': [{'query': 'first'}, {'query': 'second'}]},
+            headers={**headers, 'X-Request-ID': 'batch-request-1'}
+        )
+    finally:
+        worker_logger.removeHandler(handler)
+
+    assert response.status_code == 200
+    assert len(handler.records) == 2
+    for record in handler.records:
+        assert record.threadName != threading.current_thread().name
+        assert record.request_id == 'batch-request-1'
+
+
+def test_worker_with_only_an_app_context_keeps_the_request_id(app):
+    from flask import g
+
+    seen = []
+
+    def worker():
+        with app.app_context():
+            g.request_id = 'worker-request-1'
+            record = logging.LogRecord('api', logging.INFO, __file__, 0, 'msg', None, None)
+            RequestContextFilter().filter(record)
+            seen.append(record.request_id)
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    thread.join(5)
+    assert seen == ['worker-request-1']
\ No newline at end of file
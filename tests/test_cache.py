@@ -0,0 +1,37 @@
+from datetime import datetime, timedelta
+
+from api.cache import ResponseCache
+from api.database import db
+from api.models import ResponseCacheEntry
+
+
+def _entry(key, expires_in):
+    now = datetime.utcnow()
+    db.session.add(ResponseCacheEntry(
+        cache_key=key, model='m', response='r', tokens_used=1,
+        created_at=now, expires_at=now + timedelta(seconds=expires_in)
+    ))
+    db.session.commit()
+
+
+def _keys():
+    return {row.cache_key for row in db.session.query(ResponseCacheEntry.cache_key)}
+
+
+def test_expired_persistent_entries_are_purged_on_write(app_context):
+    cache = ResponseCache(max_size=0, ttl=60, persistent=True)
+    _entry('expired', -10)
+    _entry('live', 600)
+
+    assert cache.get('expired') is None
+    cache.set('new', {'response': 'r', 'tokens_used': 1, 'model': 'm'})
+    db.session.expire_all()
+    assert _keys() >= {'live', 'new'}
+    assert 'expired' not in _keys()
+    assert cache.stats()['expired_purged'] >= 1
+
+    # Trong EXPIRED_PURGE_INTERVAL không xóa lại
+    _entry('expired-again', -10)
+    cache.set('newer', {'response': 'r', 'tokens_used': 1, 'model': 'm'})
+    db.session.expire_all()
+    assert 'expired-again' in _keys()
\ No newline at end of file
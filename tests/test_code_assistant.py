@@ -0,0 +1,28 @@
+from api.code_assistant import CodeAssistant
+from api.compaction import estimate_tokens
+
+ANSWER = ['Reverse the list ', 'with three pointers: ', '`prev`, `head` and `next`.\n', '```python\nprev = None\n```']
+
+
+def _chunk(content):
+    return {'choices': [{'delta': {'content': content}}]}
+
+
+def test_streamed_tokens_cover_the_whole_prompt_and_completion(monkeypatch):
+    assistant = CodeAssistant()
+    sent = {}
+
+    def create(hedge=True, **params):
+        sent.update(params)
+        return iter([_chunk(text) for text in ANSWER]), params['model']
+
+    monkeypatch.setattr(assistant, '_resilient_create', create)
+    events = list(assistant.stream_request('How do I reverse a linked list?', 'class Node: pass', use_cache=False))
+
+    done = events[-1]
+    assert done['type'] == 'done'
+    prompt = assistant.count_message_tokens(sent['messages'])
+    assert done['tokens_used'] == prompt + estimate_tokens(done['response'])
+    # System prompt và mọi token của completion đều được tính, không phải số chunk
+    assert prompt > estimate_tokens(sent['messages'][-1]['content'])
+    assert done['tokens_used'] - prompt > len(ANSWER)
\ No newline at end of file
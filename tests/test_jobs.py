@@ -0,0 +1,80 @@
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+from api.database import db
+from api.jobs import JobQueue
+from api.models import CodeAssistJob
+
+
+@pytest.fixture
+def queue(app, app_context):
+    queue = JobQueue()
+    queue.app = app
+    queue.stale_after = 600
+    queue.ttl = 3600
+    return queue
+
+
+def _job(user, status, age=timedelta(0), **fields):
+    created = datetime.utcnow() - age
+    job = CodeAssistJob(
+        id=uuid.uuid4().hex, user_id=user.id, status=status, query='q', language='python',
+        created_at=created, **fields
+    )
+    db.session.add(job)
+    db.session.commit()
+    return job.id
+
+
+def _status(job_id):
+    job = db.session.query(CodeAssistJob).get(job_id)
+    return job.status if job is not None else None
+
+
+def test_abandoned_jobs_are_failed(queue, make_user):
+    user = make_user()
+    old = datetime.utcnow() - timedelta(hours=1)
+    stale_queued = _job(user, 'queued', age=timedelta(hours=1))
+    stale_running = _job(user, 'running', age=timedelta(hours=1), started_at=old)
+    fresh_queued = _job(user, 'queued')
+    fresh_running = _job(user, 'running', age=timedelta(hours=1), started_at=datetime.utcnow())
+
+    assert queue.fail_stale() == 2
+    db.session.expire_all()
+    assert _status(stale_queued) == 'failed'
+    assert _status(stale_running) == 'failed'
+    assert db.session.query(CodeAssistJob).get(stale_queued).error
+    assert _status(fresh_queued) == 'queued'
+    assert _status(fresh_running) == 'running'
+    assert queue.stats()['abandoned'] == 2
+
+
+def test_failed_job_is_not_run_later(queue, make_user):
+    user = make_user()
+    job_id = _job(user, 'queued', age=timedelta(hours=1))
+    queue.fail_stale()
+
+    class Assistant:
+        def process_request(self, **kwargs):
+            raise AssertionError('abandoned job must not run')
+
+    assert queue._process(job_id, Assistant()) is False
+    db.session.expire_all()
+    assert _status(job_id) == 'failed'
+
+
+def test_finished_jobs_expire_after_ttl(queue, make_user):
+    user = make_user()
+    now = datetime.utcnow()
+    expired = _job(user, 'succeeded', finished_at=now - timedelta(hours=2))
+    expired_failed = _job(user, 'failed', finished_at=now - timedelta(hours=2))
+    recent = _job(user, 'succeeded', finished_at=now - timedelta(minutes=5))
+    queued = _job(user, 'queued', age=timedelta(minutes=1))
+
+    assert queue.delete_expired() == 2
+    assert _status(expired) is None
+    assert _status(expired_failed) is None
+    assert _status(recent) == 'succeeded'
+    assert _status(queued) == 'queued'
\ No newline at end of file
@@ -0,0 +1,120 @@
+import os
+import time
+
+import jwt as pyjwt
+import pytest
+from flask import Flask
+
+from api.jwt_keys import KeyRing
+
+
+def _ring(directory, algorithm='EdDSA', activation_delay=300):
+    app = Flask(__name__)
+    app.config.update(
+        JWT_ALGORITHM=algorithm,
+        JWT_KEYS_DIR=str(directory),
+        JWT_KEY_ACTIVATION_DELAY=activation_delay,
+        JWT_KEYS_REFRESH_INTERVAL=0,
+        JWT_SECRET_KEY='legacy-secret'
+    )
+    ring = KeyRing()
+    ring.init_app(app)
+    return ring
+
+
+def _age(ring, key, seconds):
+    """
+    Lùi mtime của file key (thời điểm công bố) về `seconds` giây trước
+    """
+    path = os.path.join(ring.directory, f'{key.kid}.pem')
+    created = time.time() - seconds
+    os.utime(path, (created, created))
+    ring.load()
+    return ring.keys[key.kid]
+
+
+def _sign(key, payload=None):
+    return pyjwt.encode(payload or {'sub': '1'}, key.private_key, algorithm=key.algorithm, headers={'kid': key.kid})
+
+
+def _verify(ring, token):
+    header = pyjwt.get_unverified_header(token)
+    return pyjwt.decode(token, ring.verification_key(header), algorithms=[header['alg']])
+
+
+def test_first_key_is_generated_and_published(tmp_path):
+    ring = _ring(tmp_path)
+    assert ring.active is not None
+    assert [key['kid'] for key in ring.jwks()['keys']] == [ring.active.kid]
+    assert oct(os.stat(tmp_path / f'{ring.active.kid}.pem').st_mode & 0o777) == '0o600'
+
+
+def test_rotated_key_is_published_before_it_signs(tmp_path):
+    ring = _ring(tmp_path)
+    old = _age(ring, ring.active, 3600)
+    etag = ring.etag
+
+    new = ring.rotate()
+    assert {key['kid'] for key in ring.jwks()['keys']} == {old.kid, new.kid}
+    assert ring.etag != etag
+    # Key mới chưa đủ JWT_KEY_ACTIVATION_DELAY -> vẫn ký bằng key cũ
+    assert ring.signing_key().kid == old.kid
+
+    _age(ring, new, 301)
+    assert ring.signing_key().kid == new.kid
+
+
+def test_tokens_of_previous_key_still_verify(tmp_path):
+    ring = _ring(tmp_path)
+    old = _age(ring, ring.active, 3600)
+    token = _sign(old)
+    new = _age(ring, ring.rotate(), 600)
+    assert ring.signing_key().kid == new.kid
+
+    assert _verify(ring, token)['sub'] == '1'
+    assert _verify(ring, _sign(new))['sub'] == '1'
+
+
+def test_other_worker_picks_up_rotated_key(tmp_path):
+    ring = _ring(tmp_path)
+    other = _ring(tmp_path)
+    new = ring.rotate()
+    # kid lạ -> worker kia đọc lại thư mục thay vì từ chối token
+    assert _verify(other, _sign(new))['sub'] == '1'
+
+
+def test_unknown_kid_and_algorithm_confusion_are_rejected(tmp_path):
+    ring = _ring(tmp_path)
+    with pytest.raises(pyjwt.InvalidTokenError):
+        ring.verification_key({'alg': 'EdDSA', 'kid': 'missing'})
+    with pytest.raises(pyjwt.InvalidTokenError):
+        ring.verification_key({'alg': 'HS256', 'kid': ring.active.kid})
+    with pytest.raises(pyjwt.InvalidTokenError):
+        ring.verification_key({'alg': 'EdDSA'})
+    # Token HS256 cũ (không có kid) dùng JWT_SECRET_KEY trong thời gian chuyển đổi
+    assert ring.verification_key({'alg': 'HS256'}) == 'legacy-secret'
+
+
+def test_prune_removes_only_keys_retired_longer_than_token_lifetime(tmp_path):
+    ring = _ring(tmp_path, activation_delay=60)
+    oldest = _age(ring, ring.active, 10000)
+    middle = _age(ring, ring.rotate(), 5000)
+    newest = _age(ring, ring.rotate(), 100)
+    assert ring.active.kid == newest.kid
+
+    # oldest thôi ký lúc middle được kích hoạt (~4940s trước), middle thôi ký ~40s trước
+    assert ring.prune(token_lifetime=3600) == [oldest.kid]
+    assert set(ring.keys) == {middle.kid, newest.kid}
+    assert ring.prune(token_lifetime=3600) == []
+
+
+def test_login_tokens_carry_the_active_kid(app):
+    from api.jwt_keys import key_ring
+
+    client = app.test_client()
+    client.post('/api/auth/register', json={'username': 'kidcheck', 'email': 'kidcheck@example.com', 'password': 'pw'})
+    token = client.post('/api/auth/login', json={'username': 'kidcheck', 'password': 'pw'}).get_json()['token']
+    assert pyjwt.get_unverified_header(token)['kid'] == key_ring.signing_key().kid
+    kids = [key['kid'] for key in client.get('/api/auth/.well-known/jwks.json').get_json()['keys']]
+    assert key_ring.signing_key().kid in kids
+    assert client.get('/api/history', headers={'Authorization': f'Bearer {token}'}).status_code == 200
\ No newline at end of file
@@ -0,0 +1,120 @@
+import uuid
+
+import pytest
+from sqlalchemy.dialects import mysql, postgresql
+
+from api import ratelimit
+from api.models import RateLimitBucket
+from api.ratelimit import RateLimiter, parse_limit
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(ratelimit, 'time', clock)
+    return clock
+
+
+@pytest.fixture(params=['memory', 'database'])
+def limiter(request, app_context):
+    limiter = RateLimiter()
+    limiter.storage = request.param
+    return limiter
+
+
+def test_parse_limit():
+    assert parse_limit('20/minute') == (20.0, 20 / 60)
+    assert parse_limit('5/hours') == (5.0, 5 / 3600)
+    assert parse_limit('3') == (3.0, 3.0)
+
+
+def test_bucket_allows_capacity_then_denies(limiter, clock):
+    key = uuid.uuid4().hex
+    assert [limiter.hit(key, '3/minute')[0] for _ in range(3)] == [True] * 3
+    allowed, retry_after = limiter.hit(key, '3/minute')
+    assert not allowed
+    assert retry_after == pytest.approx(20.0)
+
+
+def test_bucket_refills_over_time(limiter, clock):
+    key = uuid.uuid4().hex
+    for _ in range(3):
+        limiter.hit(key, '3/minute')
+    clock.now += 20
+    assert limiter.hit(key, '3/minute')[0]
+    assert not limiter.hit(key, '3/minute')[0]
+    # Không nạp quá capacity dù chờ lâu
+    clock.now += 3600
+    assert [limiter.hit(key, '3/minute')[0] for _ in range(4)] == [True, True, True, False]
+
+
+def test_cost_above_capacity_needs_a_full_bucket(limiter, clock):
+    key = uuid.uuid4().hex
+    assert limiter.hit(key, '5/minute', cost=50) == (True, 0.0)
+    allowed, retry_after = limiter.hit(key, '5/minute', cost=50)
+    assert not allowed
+    assert retry_after == pytest.approx(60.0)
+
+
+def test_charge_can_overdraw_the_budget(limiter, clock):
+    key = uuid.uuid4().hex
+    assert limiter.peek(key, '100/minute') == (True, 0.0)
+    limiter.charge(key, '100/minute', 160)
+    allowed, retry_after = limiter.peek(key, '100/minute')
+    assert not allowed
+    # -60 token, cần nạp lại lên 1 token ở tốc độ 100/60 token/giây
+    assert retry_after == pytest.approx(61 * 60 / 100)
+
+
+def test_memory_buckets_are_bounded(clock):
+    limiter = RateLimiter()
+    limiter.max_keys = 3
+    for n in range(10):
+        limiter.hit(f'login:user:{n}', '1/minute')
+        limiter.hit(f'login:user:{n}', '1/minute')
+    stats = limiter.stats()
+    assert stats['buckets'] == 3
+    assert stats['blocked'] == 3
+    assert list(limiter._buckets) == ['login:user:7', 'login:user:8', 'login:user:9']
+
+
+def test_refill_sql_is_portable():
+    table = RateLimitBucket.__table__
+    expression = RateLimiter()._refilled(table, 5, 0.1, 100.0)
+    for dialect in (postgresql.dialect(), mysql.dialect()):
+        sql = str(expression.compile(dialect=dialect)).lower()
+        assert 'min(' not in sql
+        assert 'case when' in sql
+
+
+def test_batch_is_charged_per_unique_item(app, monkeypatch):
+    from api import routes
+    from api.ratelimit import rate_limiter
+
+    client = app.test_client()
+    name = f'batch{uuid.uuid4().hex[:8]}'
+    client.post('/api/auth/register', json={'username': name, 'email': f'{name}@example.com', 'password': 'pw'})
+    token = client.post('/api/auth/login', json={'username': name, 'password': 'pw'}).get_json()['token']
+    headers = {'Authorization': f'Bearer {token}'}
+
+    monkeypatch.setattr(routes.code_assistant, 'process_request', lambda **kwargs: {
+        'success': True, 'response': 'ok', 'tokens_used': 1, 'model': 'test'
+    })
+    monkeypatch.setattr(rate_limiter, 'enabled', True)
+    monkeypatch.setitem(app.config, 'RATE_LIMITS', {'code_assist': {'user': '4/minute'}})
+    monkeypatch.setitem(app.config, 'CODE_ASSIST_TOKEN_BUDGET', '')
+
+    items = [{'query': 'a'}, {'query': 'b'}, {'query': 'c'}, {'query': 'a'}]
+    response = client.post('/api/code-assist/batch', json={'items': items}, headers=headers)
+    assert response.status_code == 200
+    # 3 item duy nhất đã tiêu 3/4 token -> batch 2 item tiếp theo bị từ chối
+    response = client.post('/api/code-assist/batch', json={'items': [{'query': 'd'}, {'query': 'e'}]}, headers=headers)
+    assert response.status_code == 429
\ No newline at end of file
@@ -0,0 +1,215 @@
+import asyncio
+import threading
+import time
+
+import openai
+import pytest
+
+from api import resilience
+from api.resilience import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError, Resilience
+from api.upstream_http import DeadlineExceeded
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(resilience, 'time', clock)
+    return clock
+
+
+def _failing(errors, result='ok'):
+    """
+    fn(model) ném lần lượt các lỗi trong `errors` rồi trả về result, ghi lại model đã gọi
+    """
+    calls = []
+
+    def fn(model):
+        calls.append(model)
+        if errors:
+            raise errors.pop(0)
+        return result
+    return fn, calls
+
+
+def test_breaker_opens_after_threshold_and_probes_once(clock):
+    breaker = CircuitBreaker(failure_threshold=3, recovery_timeout=30)
+    for _ in range(2):
+        assert breaker.allow()
+        breaker.record_failure()
+    assert breaker.state == CLOSED
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+
+    clock.now += 30
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    # Chỉ một request thử trong lúc half-open
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert breaker.allow()
+
+
+def test_failed_probe_reopens_the_breaker(clock):
+    breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=10)
+    breaker.record_failure()
+    clock.now += 10
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    assert breaker.stats()['opened'] == 2
+
+
+def test_retryable_errors_are_retried_with_backoff(clock):
+    fn, calls = _failing([openai.error.RateLimitError('slow down'), openai.error.Timeout('timeout')])
+    client = Resilience(max_retries=3, base_delay=0.5, max_delay=8)
+    assert client.call(fn, 'model-a') == ('ok', 'model-a')
+    assert calls == ['model-a'] * 3
+    assert len(clock.slept) == 2
+    assert client.stats()['retries'] == 2
+    assert client.breaker('model-a').state == CLOSED
+
+
+def test_retry_after_header_is_respected(clock):
+    error = openai.error.RateLimitError('slow down', headers={'Retry-After': '2'})
+    fn, _ = _failing([error])
+    client = Resilience(max_retries=1, base_delay=0.01, max_delay=8)
+    client.call(fn, 'model-a')
+    assert clock.slept == [2.0]
+
+
+def test_non_retryable_error_is_raised_without_tripping_the_breaker(clock):
+    fn, calls = _failing([openai.error.InvalidRequestError('bad request', param=None)] * 5)
+    client = Resilience(max_retries=3, failure_threshold=1)
+    for _ in range(3):
+        with pytest.raises(openai.error.InvalidRequestError):
+            client.call(fn, 'model-a')
+    assert calls == ['model-a'] * 3
+    assert client.breaker('model-a').state == CLOSED
+
+
+def test_open_breaker_falls_back_to_next_model(clock):
+    client = Resilience(max_retries=0, failure_threshold=1, fallback_models=['model-b'])
+    fn, calls = _failing([openai.error.ServiceUnavailableError('down')])
+    assert client.call(fn, 'model-a') == ('ok', 'model-b')
+    assert client.breaker('model-a').state == OPEN
+
+    # model-a đang mở -> bỏ qua, không gọi upstream
+    fn, calls = _failing([])
+    assert client.call(fn, 'model-a') == ('ok', 'model-b')
+    assert calls == ['model-b']
+    assert client.stats()['short_circuits'] == 1
+
+
+def test_all_breakers_open_raises_circuit_open(clock):
+    client = Resilience(max_retries=0, failure_threshold=1)
+    fn, _ = _failing([openai.error.APIConnectionError('reset')])
+    with pytest.raises(openai.error.APIConnectionError):
+        client.call(fn, 'model-a')
+    fn, calls = _failing([])
+    with pytest.raises(CircuitOpenError):
+        client.call(fn, 'model-a')
+    assert calls == []
+
+
+def test_slow_call_is_hedged():
+    client = Resilience(hedge_after=0.05, hedge_workers=4)
+    attempts = []
+    lock = threading.Lock()
+
+    def fn(model):
+        with lock:
+            attempts.append(model)
+            first = len(attempts) == 1
+        time.sleep(0.5 if first else 0.01)
+        return 'first' if first else 'hedge'
+
+    assert client.call(fn, 'model-a') == ('hedge', 'model-a')
+    stats = client.stats()
+    assert stats['hedges'] == 1
+    assert stats['hedge_wins'] == 1
+
+
+def test_hedging_is_skipped_when_the_pool_is_full():
+    client = Resilience(hedge_after=0.01, hedge_workers=1)
+    release = threading.Event()
+
+    def slow(model):
+        release.wait(5)
+        return model
+
+    results = []
+    thread = threading.Thread(target=lambda: results.append(client.call(slow, 'model-a')))
+    thread.start()
+    while client.stats()['attempts'] < 1:
+        time.sleep(0.001)
+    try:
+        # Slot duy nhất đang bận -> lời gọi này chạy thẳng, không hedge
+        assert client.call(lambda model: 'direct', 'model-b') == ('direct', 'model-b')
+    finally:
+        release.set()
+        thread.join(5)
+    assert results == [('model-a', 'model-a')]
+    stats = client.stats()
+    assert stats['hedges_skipped'] >= 1
+    assert stats['hedges'] == 0
+
+def test_probe_ending_without_a_result_does_not_wedge_the_breaker(clock):
+    client = Resilience(max_retries=0, failure_threshold=1, recovery_timeout=10)
+    fn, _ = _failing([openai.error.ServiceUnavailableError('down')])
+    with pytest.raises(openai.error.ServiceUnavailableError):
+        client.call(fn, 'model-a')
+    clock.now += 10
+
+    # Request thử hết deadline của client -> không kết luận gì về upstream
+    fn, _ = _failing([DeadlineExceeded('deadline')])
+    with pytest.raises(DeadlineExceeded):
+        client.call(fn, 'model-a')
+    assert client.breaker('model-a').state == HALF_OPEN
+
+    fn, calls = _failing([])
+    assert client.call(fn, 'model-a') == ('ok', 'model-a')
+    assert calls == ['model-a']
+    assert client.breaker('model-a').state == CLOSED
+
+
+def test_cancelled_async_probe_is_released(clock):
+    client = Resilience(max_retries=0, failure_threshold=1, recovery_timeout=10)
+    client.breaker('model-a').record_failure()
+    clock.now += 10
+
+    async def run():
+        started = asyncio.Event()
+
+        async def hang(model):
+            started.set()
+            await asyncio.Event().wait()
+
+        task = asyncio.ensure_future(client.acall(hang, 'model-a'))
+        await started.wait()
+        # Client ngắt kết nối giữa lúc đang thử
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+        async def ok(model):
+            return 'ok'
+        return await client.acall(ok, 'model-a')
+
+    assert asyncio.run(run()) == ('ok', 'model-a')
+    assert client.breaker('model-a').state == CLOSED
\ No newline at end of file
@@ -0,0 +1,245 @@
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+from api.database import db
+from api.models import CodeAssistJob, CodeSession, ContentBlob, PurgeRequest
+from api.retention import RetentionManager
+from api.storage import delete_orphan_blobs
+
+
+@pytest.fixture
+def manager(app, app_context):
+    manager = RetentionManager()
+    manager.init_app(app)
+    manager.batch_size = 2
+    manager.batch_pause = 0
+    return manager
+
+
+def _sessions(user, count, created_at=None):
+    sessions = [CodeSession(
+        user_id=user.id, query=f'q{n}', response='r', language='python',
+        created_at=(created_at or datetime.utcnow()) + timedelta(seconds=n)
+    ) for n in range(count)]
+    db.session.add_all(sessions)
+    db.session.commit()
+    return [session.id for session in sessions]
+
+
+def _remaining(user):
+    return db.session.query(CodeSession.id).filter(CodeSession.user_id == user.id).count()
+
+
+def test_purge_request_deletes_in_batches(manager, make_user):
+    user = make_user()
+    other = make_user()
+    ids = _sessions(user, 5)
+    _sessions(other, 2)
+    purge = PurgeRequest(user_id=user.id, max_session_id=max(ids))
+    db.session.add(purge)
+    db.session.commit()
+    # Session tạo sau yêu cầu xóa không bị xóa
+    _sessions(user, 1)
+
+    manager.run_once(enforce_policy=False)
+
+    purge = db.session.query(PurgeRequest).get(purge.id)
+    assert purge.status == 'completed'
+    assert purge.deleted == 5
+    assert purge.heartbeat_at is not None
+    assert _remaining(user) == 1
+    assert _remaining(other) == 2
+
+
+def _job(user, status, session_id=None, created_at=None):
+    job = CodeAssistJob(
+        id=uuid.uuid4().hex, user_id=user.id, status=status, query='secret query',
+        code_context='secret code', language='python', session_id=session_id,
+        created_at=created_at or datetime.utcnow()
+    )
+    db.session.add(job)
+    db.session.commit()
+    return job.id
+
+
+def _job_exists(job_id):
+    return db.session.query(CodeAssistJob.id).filter(CodeAssistJob.id == job_id).first() is not None
+
+
+def test_purge_deletes_the_users_finished_jobs(manager, make_user):
+    user = make_user()
+    other = make_user()
+    ids = _sessions(user, 2)
+    linked = _job(user, 'succeeded', session_id=ids[0])
+    failed = _job(user, 'failed')
+    pending = _job(user, 'queued')
+    others = _job(other, 'failed')
+    purge = PurgeRequest(user_id=user.id, max_session_id=max(ids))
+    db.session.add(purge)
+    db.session.commit()
+    later = _job(user, 'succeeded', created_at=datetime.utcnow() + timedelta(seconds=5))
+
+    manager.run_once(enforce_policy=False)
+
+    assert not _job_exists(linked)
+    assert not _job_exists(failed)
+    assert _job_exists(pending)
+    assert _job_exists(others)
+    assert _job_exists(later)
+
+
+def test_running_purge_with_recent_heartbeat_is_not_reclaimed(manager, make_user):
+    user = make_user()
+    ids = _sessions(user, 2)
+    long_ago = datetime.utcnow() - timedelta(hours=1)
+    purge = PurgeRequest(
+        user_id=user.id, max_session_id=max(ids), status='running',
+        started_at=long_ago, heartbeat_at=datetime.utcnow()
+    )
+    db.session.add(purge)
+    db.session.commit()
+
+    manager.process_purges()
+    assert db.session.query(PurgeRequest).get(purge.id).status == 'running'
+    assert _remaining(user) == 2
+
+    # Không còn heartbeat (process đã chết) -> chạy tiếp
+    purge.heartbeat_at = long_ago
+    db.session.commit()
+    manager.process_purges()
+    assert db.session.query(PurgeRequest).get(purge.id).status == 'completed'
+    assert _remaining(user) == 0
+
+
+def test_policy_deletes_jobs_of_deleted_sessions(manager, make_user):
+    user = make_user(retention_days=7)
+    old = _sessions(user, 1, created_at=datetime.utcnow() - timedelta(days=30))
+    recent = _sessions(user, 1)
+    old_job = _job(user, 'succeeded', session_id=old[0])
+    recent_job = _job(user, 'succeeded', session_id=recent[0])
+
+    manager.enforce_max_age()
+    assert not _job_exists(old_job)
+    assert _job_exists(recent_job)
+
+
+def test_max_sessions_keeps_newest(manager, make_user):
+    user = make_user(max_sessions=2)
+    ids = _sessions(user, 5)
+    manager.enforce_max_sessions()
+    kept = [row.id for row in db.session.query(CodeSession.id).filter(CodeSession.user_id == user.id)]
+    assert sorted(kept) == ids[-2:]
+
+
+def test_max_age_uses_user_override(manager, make_user):
+    user = make_user(retention_days=7)
+    _sessions(user, 2, created_at=datetime.utcnow() - timedelta(days=30))
+    recent = _sessions(user, 1)
+    manager.enforce_max_age()
+    assert [row.id for row in db.session.query(CodeSession.id).filter(CodeSession.user_id == user.id)] == recent
+
+
+def _blob(age: timedelta, last_used: timedelta = None) -> str:
+    now = datetime.utcnow()
+    blob = ContentBlob(
+        hash=uuid.uuid4().hex, data=b'x', size=1, created_at=now - age,
+        last_used_at=now - last_used if last_used is not None else None
+    )
+    db.session.add(blob)
+    db.session.commit()
+    return blob.hash
+
+
+def _blob_exists(blob_hash: str) -> bool:
+    return db.session.query(ContentBlob.hash).filter(ContentBlob.hash == blob_hash).first() is not None
+
+
+def test_orphan_blob_gc_respects_grace_period(app_context, make_user):
+    user = make_user()
+    old_orphan = _blob(timedelta(hours=3))
+    new_orphan = _blob(timedelta(minutes=5))
+    reused_orphan = _blob(timedelta(hours=3), last_used=timedelta(minutes=5))
+    referenced = _blob(timedelta(hours=3))
+    db.session.add(CodeSession(user_id=user.id, query='q', language='python', context_hash=referenced))
+    db.session.commit()
+
+    delete_orphan_blobs(grace=3600)
+
+    assert not _blob_exists(old_orphan)
+    assert _blob_exists(new_orphan)
+    assert _blob_exists(reused_orphan)
+    assert _blob_exists(referenced)
+
+
+def test_blob_gc_is_opt_in(manager, make_user, monkeypatch):
+    user = make_user()
+    orphan = _blob(timedelta(days=1))
+    ids = _sessions(user, 1)
+    db.session.add(PurgeRequest(user_id=user.id, max_session_id=ids[0]))
+    db.session.commit()
+
+    manager.run_once(enforce_policy=False)
+    assert _blob_exists(orphan)
+
+    monkeypatch.setattr(manager, 'blob_gc', True)
+    ids = _sessions(user, 1)
+    db.session.add(PurgeRequest(user_id=user.id, max_session_id=ids[0]))
+    db.session.commit()
+    manager.run_once(enforce_policy=False)
+    assert not _blob_exists(orphan)
+
+
+def test_reusing_a_blob_protects_it_from_gc(app_context, make_user, app):
+    from api.compression import content_hash
+
+    user = make_user()
+    context = 'def f():\n    return 1\n' * app.config['SESSION_COMPRESSION_MIN_SIZE']
+    blob_hash = content_hash(context)
+    session = CodeSession(user_id=user.id, query='q', language='python', code_context=context)
+    db.session.add(session)
+    db.session.commit()
+    db.session.delete(session)
+    db.session.query(ContentBlob).filter(ContentBlob.hash == blob_hash)\
+        .update({'created_at': datetime.utcnow() - timedelta(days=1),
+                 'last_used_at': datetime.utcnow() - timedelta(days=1)})
+    db.session.commit()
+
+    # Session mới dùng lại nội dung đã mồ côi -> blob được "chạm" và GC bỏ qua
+    db.session.add(CodeSession(user_id=user.id, query='q2', language='python', code_context=context))
+    db.session.commit()
+    for reused in db.session.query(CodeSession).filter(CodeSession.context_hash == blob_hash):
+        db.session.delete(reused)
+    db.session.commit()
+
+    delete_orphan_blobs(grace=3600)
+    assert _blob_exists(blob_hash)
+
+def test_deleting_a_session_deletes_its_job(app, app_context):
+    from sqlalchemy import event
+
+    from api.models import User
+
+    client = app.test_client()
+    client.post('/api/auth/register', json={'username': 'jobdelete', 'email': 'jobdelete@example.com', 'password': 'pw'})
+    token = client.post('/api/auth/login', json={'username': 'jobdelete', 'password': 'pw'}).get_json()['token']
+    user = db.session.query(User).filter(User.username == 'jobdelete').one()
+    session_id = _sessions(user, 1)[0]
+    job_id = _job(user, 'succeeded', session_id=session_id)
+
+    # Bật kiểm tra FK của SQLite như PostgreSQL / MySQL
+    def enforce_foreign_keys(dbapi_connection, connection_record):
+        dbapi_connection.execute('PRAGMA foreign_keys=ON')
+    db.engine.dispose()
+    event.listen(db.engine, 'connect', enforce_foreign_keys)
+    try:
+        response = client.delete(f'/api/history/{session_id}', headers={'Authorization': f'Bearer {token}'})
+    finally:
+        event.remove(db.engine, 'connect', enforce_foreign_keys)
+        db.session.remove()
+        db.engine.dispose()
+
+    assert response.status_code == 200
+    assert not _job_exists(job_id)
+    assert db.session.query(CodeSession).get(session_id) is None
\ No newline at end of file
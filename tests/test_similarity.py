@@ -0,0 +1,155 @@
+import random
+
+import pytest
+
+from api.database import db
+from api.models import CodeSession
+from api.similarity import (
+    NearDuplicateIndex, _split_bands, context_fingerprint, near_duplicates, query_fingerprint, simhash
+)
+
+QUERY = 'How do I reverse a linked list in place without extra memory?'
+CONTEXT = 'def reverse(head):\n    prev = None\n    while head:\n        head.next, prev, head = prev, head, head.next\n    return prev\n'
+
+
+def _index(threshold=0.95, scope='user'):
+    index = NearDuplicateIndex()
+    index.enabled = True
+    index.scope = scope
+    index.max_distance = int((1 - threshold) * 64 + 1e-9)
+    index._bands = _split_bands(index.max_distance + 1)
+    return index
+
+
+def test_fingerprints_ignore_case_punctuation_and_formatting():
+    assert query_fingerprint(QUERY) == query_fingerprint(QUERY.upper().replace('?', ' !'))
+    reformatted = '\n\n'.join('  ' + line.replace(' = ', '=') for line in CONTEXT.splitlines())
+    assert context_fingerprint(CONTEXT) == context_fingerprint(reformatted)
+    assert query_fingerprint(QUERY) != query_fingerprint('How do I sort a dict by value?')
+    assert simhash([]) == 0
+
+
+def test_bands_cover_all_64_bits():
+    for count in (1, 3, 4, 7, 64):
+        bands = _split_bands(count)
+        assert len(bands) == count
+        covered = 0
+        for shift, mask in bands:
+            assert covered & (mask << shift) == 0
+            covered |= mask << shift
+        assert covered == (1 << 64) - 1
+
+
+def test_fingerprints_within_max_distance_share_a_bucket():
+    index = _index(threshold=0.9)
+    rng = random.Random(42)
+    for _ in range(2000):
+        fp = rng.getrandbits(64)
+        flipped = fp
+        for bit in rng.sample(range(64), rng.randint(0, index.max_distance)):
+            flipped ^= 1 << bit
+        assert set(index._bucket_keys(fp, 7)) & set(index._bucket_keys(flipped, 7))
+
+
+def test_find_is_scoped_to_user_and_language():
+    index = _index()
+    index.add(1, 10, 'python', query_fingerprint(QUERY), context_fingerprint(CONTEXT))
+
+    assert [match[1] for match in index.find(10, QUERY.lower(), CONTEXT, 'Python')] == [1]
+    assert index.find(11, QUERY, CONTEXT, 'python') == []
+    assert index.find(10, QUERY, CONTEXT, 'javascript') == []
+    # Cùng câu hỏi nhưng code khác / không có code -> không dùng lại
+    assert index.find(10, QUERY, 'print("hello")\n', 'python') == []
+    assert index.find(10, QUERY, '', 'python') == []
+
+    shared = _index(scope='global')
+    shared.add(1, 10, 'python', query_fingerprint(QUERY), context_fingerprint(CONTEXT))
+    assert [match[1] for match in shared.find(11, QUERY, CONTEXT, 'python')] == [1]
+
+
+def test_removed_session_is_not_found():
+    index = _index()
+    query_fp = query_fingerprint(QUERY)
+    index.add(1, 10, 'python', query_fp, 0)
+    index.add(1, 10, 'python', query_fp, 0)
+    assert index.size == 1
+    index.remove(1, 10, 'python', query_fp)
+    assert index.find(10, QUERY, '', 'python') == []
+    assert index.stats()['size'] == 0
+    # Bucket được thu gọn, không giữ slot chết
+    assert index.stats()['buckets'] == 0
+
+
+def test_buckets_are_partitioned_by_user():
+    index = _index()
+    query_fp = query_fingerprint(QUERY)
+    for user_id in range(1, 51):
+        index.add(user_id, user_id, 'python', query_fp, 0)
+    index.find(1, QUERY, '', 'python')
+    # Cùng câu hỏi ở 50 user khác nhau: chỉ xét session của chính user
+    assert index.candidates == 1
+    assert index.stats()['buckets'] == 50 * len(index._bands)
+
+
+@pytest.fixture
+def live_index(app_context, monkeypatch):
+    """
+    Bật index near-duplicate dùng chung (được cập nhật bởi các ORM event)
+    """
+    monkeypatch.setattr(near_duplicates, 'enabled', True)
+    near_duplicates.rebuild()
+    yield near_duplicates
+    near_duplicates.rebuild()
+
+
+def _session(user, query=QUERY, response='Use three pointers.'):
+    return CodeSession(user_id=user.id, query=query, response=response, language='python', tokens_used=50)
+
+
+def test_committed_session_is_answered_again(live_index, make_user):
+    user = make_user()
+    session = _session(user)
+    db.session.add(session)
+    db.session.commit()
+    tokens_saved = live_index.stats()['tokens_saved']
+
+    result = live_index.answer(user.id, QUERY + '  ', '', 'python')
+    assert result['response'] == 'Use three pointers.'
+    assert result['tokens_used'] == 0
+    assert result['near_duplicate']['session_id'] == session.id
+    assert live_index.stats()['tokens_saved'] == tokens_saved + 50
+
+
+def test_rolled_back_session_is_not_indexed(live_index, make_user):
+    user = make_user()
+    db.session.add(_session(user, query='Why does my rolled back query leak?'))
+    db.session.flush()
+    db.session.rollback()
+
+    assert live_index.find(user.id, 'Why does my rolled back query leak?', '', 'python') == []
+    assert live_index.answer(user.id, 'Why does my rolled back query leak?', '', 'python') is None
+
+
+def test_answer_never_returns_another_users_session(live_index, make_user):
+    owner = make_user()
+    other = make_user()
+    session = _session(owner, query='What is the secret of my private project?')
+    db.session.add(session)
+    db.session.commit()
+    stale = live_index.stats()['stale']
+    # Vị trí trong index trỏ tới id của session user khác (vd. rowid bị cấp lại)
+    live_index.remove(session.id, owner.id, 'python', query_fingerprint(session.query))
+    live_index.add(session.id, other.id, 'python', query_fingerprint(session.query), 0)
+
+    assert live_index.answer(other.id, session.query, '', 'python') is None
+    assert live_index.stats()['stale'] == stale + 1
+
+
+def test_deleted_session_is_dropped_from_the_index(live_index, make_user):
+    user = make_user()
+    session = _session(user, query='How to delete from the near duplicate index?')
+    db.session.add(session)
+    db.session.commit()
+    db.session.delete(session)
+    db.session.commit()
+    assert live_index.answer(user.id, 'How to delete from the near duplicate index?', '', 'python') is None
\ No newline at end of file
@@ -0,0 +1,144 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from api.singleflight import SingleFlight
+
+
+def _run_concurrently(sf, key, fn, followers=4):
+    """
+    Chạy một leader rồi các follower khi leader đang in-flight, trả về kết quả theo thread
+    """
+    results = []
+    lock = threading.Lock()
+
+    def call():
+        try:
+            outcome = sf.do(key, fn)
+        except Exception as e:
+            outcome = e
+        with lock:
+            results.append(outcome)
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    while not sf.stats()['in_flight']:
+        time.sleep(0.001)
+    threads = [threading.Thread(target=call) for _ in range(followers)]
+    for thread in threads:
+        thread.start()
+    return leader, threads, results
+
+
+def test_concurrent_identical_calls_run_once():
+    sf = SingleFlight(timeout=5)
+    release = threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        release.wait(5)
+        return 'answer'
+
+    leader, threads, results = _run_concurrently(sf, 'k', fn)
+    time.sleep(0.1)
+    release.set()
+    for thread in [leader] + threads:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert sorted(results, key=lambda r: r[1]) == [('answer', False)] + [('answer', True)] * 4
+    stats = sf.stats()
+    assert stats['leaders'] == 1
+    assert stats['coalesced'] == 4
+    assert stats['in_flight'] == 0
+
+
+def test_leader_error_is_shared_with_followers():
+    sf = SingleFlight(timeout=5)
+    release = threading.Event()
+
+    def fn():
+        release.wait(5)
+        raise ValueError('upstream failed')
+
+    leader, threads, results = _run_concurrently(sf, 'k', fn, followers=2)
+    time.sleep(0.1)
+    release.set()
+    for thread in [leader] + threads:
+        thread.join(5)
+
+    assert len(results) == 3
+    assert all(isinstance(r, ValueError) for r in results)
+    # Lỗi không được giữ lại cho lời gọi sau
+    assert sf.do('k', lambda: 'ok') == ('ok', False)
+
+
+def test_different_keys_are_not_coalesced():
+    sf = SingleFlight()
+    assert sf.do('a', lambda: 1) == (1, False)
+    assert sf.do('b', lambda: 2) == (2, False)
+    assert sf.stats()['leaders'] == 2
+    assert sf.stats()['coalesced'] == 0
+
+
+def test_follower_calls_directly_after_timeout():
+    sf = SingleFlight(timeout=0.05)
+    release = threading.Event()
+
+    def slow():
+        release.wait(5)
+        return 'leader'
+
+    leader = threading.Thread(target=sf.do, args=('k', slow))
+    leader.start()
+    while not sf.stats()['in_flight']:
+        time.sleep(0.001)
+    try:
+        assert sf.do('k', lambda: 'direct') == ('direct', False)
+        assert sf.stats()['timeouts'] == 1
+    finally:
+        release.set()
+        leader.join(5)
+
+
+def test_async_calls_are_coalesced():
+    sf = SingleFlight(timeout=5)
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return 'answer'
+
+    async def main():
+        return await asyncio.gather(*(sf.do_async('k', fn) for _ in range(5)))
+
+    results = asyncio.run(main())
+    assert len(calls) == 1
+    assert sorted(results, key=lambda r: r[1]) == [('answer', False)] + [('answer', True)] * 4
+
+
+def test_async_follower_retries_when_leader_is_cancelled():
+    sf = SingleFlight(timeout=5)
+
+    async def slow():
+        await asyncio.sleep(5)
+        return 'leader'
+
+    async def fast():
+        return 'direct'
+
+    async def main():
+        leader = asyncio.ensure_future(sf.do_async('k', slow))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(sf.do_async('k', fast))
+        await asyncio.sleep(0)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(main()) == ('direct', False)
\ No newline at end of file
@@ -0,0 +1,111 @@
+import threading
+import time
+
+import pytest
+
+from api.database import db
+from api.models import CodeSession
+from api.writebehind import WriteBehindBuffer
+
+
+@pytest.fixture
+def buffer(app, app_context):
+    buffer = WriteBehindBuffer()
+    buffer.app = app
+    buffer.max_batch = 50
+    buffer.allocator.block_size = 10
+    return buffer
+
+
+def _session_fields(user, n):
+    return {'user_id': user.id, 'query': f'q{n}', 'response': 'r', 'language': 'python', 'tokens_used': 1}
+
+
+def _stored(ids):
+    return sorted(row.id for row in db.session.query(CodeSession.id).filter(CodeSession.id.in_(ids)))
+
+
+def test_enqueued_sessions_get_ids_before_they_are_written(buffer, make_user):
+    user = make_user()
+    ids = [buffer.enqueue(**_session_fields(user, n)) for n in range(25)]
+    assert len(set(ids)) == 25
+    assert _stored(ids) == []
+    assert buffer.stats()['depth'] == 25
+
+    assert buffer.flush() == 25
+    assert _stored(ids) == sorted(ids)
+    assert buffer.stats()['rows_flushed'] == 25
+
+
+def test_allocated_ids_skip_directly_inserted_rows(buffer, make_user):
+    user = make_user()
+    direct = CodeSession(id=10 ** 6, user_id=user.id, query='direct', language='python')
+    db.session.add(direct)
+    db.session.commit()
+
+    session_id = buffer.enqueue(**_session_fields(user, 0))
+    assert session_id > direct.id
+    buffer.flush()
+    assert _stored([session_id]) == [session_id]
+
+
+def test_wait_for_user_blocks_until_flushed(buffer, make_user, app):
+    user = make_user()
+    other = make_user()
+    session_id = buffer.enqueue(**_session_fields(user, 0))
+
+    # User không có session chờ ghi thì không phải chờ
+    started = time.monotonic()
+    buffer.wait_for_user(other.id, timeout=2)
+    assert time.monotonic() - started < 0.5
+
+    def flush_later():
+        time.sleep(0.1)
+        with app.app_context():
+            buffer.flush()
+
+    thread = threading.Thread(target=flush_later)
+    thread.start()
+    buffer.wait_for_user(user.id, timeout=5)
+    thread.join(5)
+    assert buffer.stats()['depth'] == 0
+    db.session.rollback()
+    assert _stored([session_id]) == [session_id]
+
+
+def test_failed_row_does_not_drop_the_batch(buffer, make_user):
+    user = make_user()
+    ids = [buffer.enqueue(**_session_fields(user, n)) for n in range(3)]
+    # Row trùng id (vd. do lỗi cấp phát) làm batch insert thất bại
+    db.session.add(CodeSession(id=ids[1], user_id=user.id, query='conflict', language='python'))
+    db.session.commit()
+
+    buffer.flush()
+    stats = buffer.stats()
+    assert stats['failed_rows'] == 1
+    assert stats['rows_flushed'] == 2
+    assert _stored(ids) == sorted(ids)
+    assert db.session.query(CodeSession).get(ids[1]).query == 'conflict'
+
+
+def test_stop_flushes_pending_rows(buffer, make_user):
+    user = make_user()
+    session_id = buffer.enqueue(**_session_fields(user, 0))
+    buffer.stop()
+    db.session.rollback()
+    assert _stored([session_id]) == [session_id]
+
+
+def test_history_deletes_wait_for_buffered_sessions(app, monkeypatch):
+    from api import routes
+
+    client = app.test_client()
+    client.post('/api/auth/register', json={'username': 'wbdelete', 'email': 'wbdelete@example.com', 'password': 'pw'})
+    token = client.post('/api/auth/login', json={'username': 'wbdelete', 'password': 'pw'}).get_json()['token']
+    headers = {'Authorization': f'Bearer {token}'}
+
+    waited = []
+    monkeypatch.setattr(routes.write_behind, 'wait_for_user', lambda user_id, **kwargs: waited.append(int(user_id)))
+    client.delete('/api/history/123456', headers=headers)
+    client.delete('/api/history/clear', headers=headers)
+    assert len(waited) == 2
\ No newline at end of file